@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides asyncio coroutines for requesting results from the
+    DeltaMeter Services API * deltameterservices.com *, mirroring the
+    functions of the deltamtrsvs module; requires Python 3.5+ & aiohttp.
+    Args:
+        Each coroutine takes the same arguments as its deltamtrsvs
+        counterpart, plus an optional AsyncDeltaMeterClient to share one
+        session & concurrency limit across calls
+    Returns:
+        Each coroutine returns the same data structure as its deltamtrsvs
+        counterpart, as consumed by the amsaves module, & raises the same
+        errors for the same responses """
+
+import asyncio
+import time
+
+import aiohttp
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from deltamtrsvs import sort_models, sort_meters, comparison_endpoint, \
+                        meter_record_endpoint, match_bldg_spans, \
+                        plan_meter_records, meter_record_requests, \
+                        assemble_meter_records, request_event, \
+                        InvalidComparison
+from scheduler import RETRY_STATUSES
+
+RETRY_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+# Seconds between checks for a place in flight under a RequestScheduler
+SCHEDULER_POLL = 0.01
+
+
+def _response(url, status, reason, headers, body):
+    """ Return a requests.Response of an answer received with aiohttp, so it
+        is read, cached & reported as those of the deltamtrsvs module """
+
+    response = requests.Response()
+    response.status_code = status
+    response.reason = reason
+    response.url = url
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+
+    return response
+
+
+class AsyncDeltaMeterClient(object):
+    """ Holds an aiohttp session with the headers & base URL for the
+        DeltaMeter Services API; the number of requests in flight at once is
+        bounded by a semaphore of max_concurrency. The session & semaphore
+        are made on entering the client with async with, in the running
+        event loop. Concurrent requests for the same URL share one response;
+        with memoize set, each distinct URL is requested at most once over
+        the life of the client. A ResponseCache, RequestScheduler & hooks are
+        applied as by deltamtrsvs.DeltaMeterClient """
+
+    def __init__(self, headers, base_url='', max_concurrency=100,
+                 memoize=False, cache=None, scheduler=None, hooks=None):
+        self.headers = headers
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.memoize = memoize
+        self.cache = cache
+        self.scheduler = scheduler
+        self.hooks = list(hooks or [])
+        self.session = None
+        self.semaphore = None
+        self._responses = {}
+        self._inFlight = {}
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        self.session = aiohttp.ClientSession(headers=self.headers,
+                                             connector=connector)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """ Release the connections held by the session """
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def forget(self, url=None):
+        """ Drop the memoized response for a URL, or for every URL """
+
+        if url is None:
+            self._responses.clear()
+        else:
+            self._responses.pop(url, None)
+
+    async def _send(self, url, headers=None):
+        """ Send a GET request for an end-point URL; return its response """
+
+        if self.session is None:
+            raise RuntimeError('Enter the client with async with before '
+                               'requesting')
+        async with self.semaphore:
+            async with self.session.get(self.base_url + url,
+                                        headers=headers) as answer:
+                body = await answer.read()
+                return _response(self.base_url + url, answer.status,
+                                 answer.reason, answer.headers, body)
+
+    async def _schedule(self, url, headers=None):
+        """ Send a request within the limits of the client's scheduler,
+            retrying as RequestScheduler.call does """
+
+        scheduler = self.scheduler
+        if scheduler is None:
+            return await self._send(url, headers)
+
+        for attempt in range(scheduler.retries + 1):
+            await asyncio.sleep(scheduler.held())
+            if scheduler.bucket is not None:
+                wait = scheduler.bucket.take()
+                while wait:
+                    await asyncio.sleep(wait)
+                    wait = scheduler.bucket.take()
+            epoch = scheduler.concurrency.try_acquire()
+            while epoch is None:
+                await asyncio.sleep(SCHEDULER_POLL)
+                epoch = scheduler.concurrency.try_acquire()
+            ok = False
+            error = None
+            try:
+                response = await self._send(url, headers)
+                ok = response.status_code not in RETRY_STATUSES
+            except RETRY_ERRORS as failure:
+                error = failure
+            finally:
+                scheduler.concurrency.release(epoch, ok)
+            if error is not None:
+                if attempt == scheduler.retries:
+                    error.retries = attempt
+                    raise error
+                await asyncio.sleep(scheduler.delay(attempt))
+                continue
+
+            response.retries = attempt
+            if ok:
+                return response
+            if attempt == scheduler.retries:
+                response.raise_for_status()
+
+            wait = scheduler.delay(attempt, response)
+            if response.status_code == 429:
+                # The server throttles every request, not just this one
+                scheduler.hold(wait)
+            else:
+                await asyncio.sleep(wait)
+
+    async def _fetch(self, url, endpoint=None, tag=None):
+        """ Request a single end-point URL, answering from the cache as
+            DeltaMeterClient._fetch does; return the response & the cache
+            outcome """
+
+        if self.cache is None:
+            return await self._schedule(url), None
+
+        cached, fresh = self.cache.lookup(url)
+        if fresh:
+            return cached, 'hit'
+
+        validators = {}
+        if cached is not None:
+            if 'ETag' in cached.headers:
+                validators['If-None-Match'] = cached.headers['ETag']
+            if 'Last-Modified' in cached.headers:
+                validators['If-Modified-Since'] = \
+                                               cached.headers['Last-Modified']
+        response = await self._schedule(url, validators)
+        if response.status_code == 304 and cached is not None:
+            self.cache.refresh(url)
+            return cached, 'revalidated'
+        if response.ok:
+            self.cache.store(url, response, endpoint, tag)
+
+        return response, 'miss'
+
+    async def _request(self, url, endpoint=None, tag=None):
+        """ Request a single end-point URL, reporting it to the client's
+            hooks when there are any """
+
+        start = time.time()
+        try:
+            response, cache = await self._fetch(url, endpoint, tag)
+        except Exception as error:
+            event = request_event(url, endpoint, start,
+                                  getattr(error, 'response', None),
+                                  None if self.cache is None else 'miss',
+                                  error=error)
+            for hook in self.hooks:
+                hook(event)
+            raise
+        event = request_event(url, endpoint, start, response, cache)
+        for hook in self.hooks:
+            hook(event)
+
+        return response
+
+    def _settle(self, url, task):
+        """ Retire a finished request, memoizing its response if required """
+
+        del self._inFlight[url]
+        if self.memoize and not task.cancelled() and \
+           task.exception() is None and \
+           task.result().status_code not in RETRY_STATUSES:
+            self._responses[url] = task.result()
+
+    async def _get(self, url, endpoint=None, tag=None):
+        """ Request a single end-point URL, joining an identical request
+            already in flight; return its response, falsy if the server did
+            not answer with success, as a response of the requests
+            library """
+
+        if url in self._responses:
+            return self._responses[url]
+        task = self._inFlight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._request(url, endpoint, tag))
+            task.add_done_callback(lambda task: self._settle(url, task))
+            self._inFlight[url] = task
+
+        return await asyncio.shield(task)
+
+    async def _gather(self, fetch, ids):
+        """ Run a per-ID fetch coroutine for each ID concurrently; return
+            (ID, result) pairs in the order given """
+
+        ids = list(ids)
+        results = await asyncio.gather(*[fetch(objID) for objID in ids])
+
+        return list(zip(ids, results))
+
+    async def get_property_bldgs(self, properties_url, site):
+        """ See deltamtrsvs.get_property_bldgs """
+
+        bldgIDct = {}
+        bldgs = (await self._get(properties_url + site, 'properties')).json()
+        for bldg in bldgs:
+            bldgIDct[str(bldg['BuildingID'])] = bldg
+
+        return bldgIDct
+
+    async def get_bldg_models(self, model_url, bldgIDs):
+        """ See deltamtrsvs.get_bldg_models """
+
+        async def fetch(bldgID):
+            models = await self._get(model_url + bldgID, 'models', bldgID)
+            if not models:
+                return None
+            return sort_models(models.json())
+
+        bldgModelsDct = {}
+        for bldgID, jsonModelsDct in await self._gather(fetch, bldgIDs):
+            if jsonModelsDct is not None:
+                bldgModelsDct[bldgID] = jsonModelsDct
+
+        return bldgModelsDct
+
+    async def get_model_comparisons(self, comparison_url, bldgModelsDct):
+        """ See deltamtrsvs.get_model_comparisons """
+
+        async def fetch(key):
+            comparison_endpt = comparison_endpoint(comparison_url,
+                                                   bldgModelsDct[key])
+            response = await self._get(comparison_endpt, 'comparisons', key)
+            try:
+                if not response.ok:
+                    raise ValueError('status %d' % response.status_code)
+                return response.json()
+            except ValueError as error:
+                raise InvalidComparison(key, comparison_endpt, error)
+
+        return dict(await self._gather(fetch, bldgModelsDct))
+
+    async def get_model_audits(self, audit_url, bldgModelsDct):
+        """ See deltamtrsvs.get_model_audits """
+
+        async def fetch(key):
+            modelID = str(bldgModelsDct[key]['SolutionID'])
+            return modelID, (await self._get(audit_url + modelID, 'audits',
+                                             key)).json()
+
+        return dict(audit for key, audit in
+                    await self._gather(fetch, bldgModelsDct))
+
+    async def get_fv_charts(self, fv_charts_url, bldgIDs):
+        """ See deltamtrsvs.get_fv_charts """
+
+        async def fetch(bldgID):
+            fvChart = await self._get(fv_charts_url + bldgID, 'fv_charts',
+                                      bldgID)
+            if not fvChart:
+                return None
+            return fvChart.json()
+
+        fvCharts = {}
+        for bldgID, jsonFvChart in await self._gather(fetch, bldgIDs):
+            if jsonFvChart is not None:
+                fvCharts[bldgID] = jsonFvChart
+
+        return fvCharts
+
+    async def get_bldg_meters(self, bldg_meters_url, bldgIDs):
+        """ See deltamtrsvs.get_bldg_meters """
+
+        async def fetch(bldgID):
+            return sort_meters((await self._get(bldg_meters_url + bldgID,
+                                                'meters', bldgID)).json())
+
+        return dict(await self._gather(fetch, bldgIDs))
+
+    async def get_meter_records(self, auditSpans, bldgMeterDct,
+                                meter_records_url, refModelsDct=None,
+                                chunk_days=None):
+        """ See deltamtrsvs.get_meter_records """
+
+        plan = plan_meter_records(match_bldg_spans(auditSpans, bldgMeterDct,
+                                                   refModelsDct),
+                                  bldgMeterDct, chunk_days)
+
+        async def fetch(request):
+            meterID, begin, end, bldgID = request
+            return (await self._get(meter_record_endpoint(
+                                    meter_records_url, meterID, begin, end),
+                                    'meter_records', bldgID)).json()
+
+        fetched = dict(await self._gather(fetch,
+                                          meter_record_requests(plan)))
+
+        return assemble_meter_records(plan, fetched)
+
+
+async def _call(headers, client, method, *args):
+    """ Run a client method on the given client, or on a client opened for
+        the duration of the call """
+
+    if client is not None:
+        return await getattr(client, method)(*args)
+    async with AsyncDeltaMeterClient(headers) as client:
+        return await getattr(client, method)(*args)
+
+
+async def aget_property_bldgs(properties_url, site, headers, client=None):
+    """ Pass an API URL, property ID; return a list of building IDs for the
+        property """
+
+    return await _call(headers, client, 'get_property_bldgs', properties_url,
+                       site)
+
+
+async def aget_bldg_models(model_url, bldgIDs, headers, client=None):
+    """ Pass a list of building IDs; return a dictionary with building IDs as
+        keys and dictionaries of model objects keyed by model type """
+
+    return await _call(headers, client, 'get_bldg_models', model_url, bldgIDs)
+
+
+async def aget_model_comparisons(comparison_url, bldgModelsDct, headers,
+                                 client=None):
+    """ Pass a dictionary of building models; return comparisons' data in
+        .JSON format with building IDs as keys """
+
+    return await _call(headers, client, 'get_model_comparisons',
+                       comparison_url, bldgModelsDct)
+
+
+async def aget_model_audits(audit_url, bldgModelsDct, headers, client=None):
+    """ Pass a dictionary of building models; return a dictionary of audit
+        models with model IDs as keys """
+
+    return await _call(headers, client, 'get_model_audits', audit_url,
+                       bldgModelsDct)
+
+
+async def aget_fv_charts(fv_charts_url, bldgIDs, headers, client=None):
+    """ Pass a URL, a list of building ID's and required API header; return a
+        dictionary of FirstView chart objects """
+
+    return await _call(headers, client, 'get_fv_charts', fv_charts_url,
+                       bldgIDs)
+
+
+async def aget_bldg_meters(bldg_meters_url, bldgIDs, headers, client=None):
+    """ Takes a list of building ID numbers; returns a dictionary with
+        building IDs as keys and dictionaries of meter objects with the name
+        of the fuel type (Electricity or Gas) as keys """
+
+    return await _call(headers, client, 'get_bldg_meters', bldg_meters_url,
+                       bldgIDs)
+
+
+async def aget_meter_records(auditSpans, bldgMeterDct, meter_records_url,
+                             headers, refModelsDct=None, chunk_days=None,
+                             client=None):
+    """ Takes a dictionary of date ranges from amsaves_usage_range function
+        and dictionary of meter objects from get_bldg_meters function;
+        returns a dictionary of dictionaries containing meter readings for
+        each fuel (electric & gas) with building IDs as keys """
+
+    return await _call(headers, client, 'get_meter_records', auditSpans,
+                       bldgMeterDct, meter_records_url, refModelsDct,
+                       chunk_days)
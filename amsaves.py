@@ -9,45 +9,50 @@ __license__ = "GNU Affero (GPLv3)"
         Services API * deltameterservices.com * """
 
 from collections import defaultdict
-import pandas as pd
-import requests
-import datetime
+from itertools import chain, islice
+from operator import itemgetter
 
+from lazyimport import LazyModule
+from stageprof import stage
 
+# Imported on first use by a transform, so importing this module is cheap
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+KWH_PER_THERM = 29.3072
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+AUDIT_FUELS = {'KWH': 'Electricity', 'THERM': 'Gas'}
+# The columns of each fuel's periods in the long format of the audits
+AUDIT_NAMES = ['Units Used', 'W/SF', 'Per. Start', 'Per. End', 'Hrs. in Per.',
+               'Air Temp']
+ELEC_AUDIT_NAMES = ['[kWh/Mo.]', 'Elec. [W/SF]', 'Per. Start', 'Per. End',
+                    'Hrs. in Per.', 'Air Temp']
+GAS_AUDIT_NAMES = ['[Therms/Mo.]', 'Gas [W/SF]', 'Per. Start', 'Per. End',
+                   'Hrs. in Per.', 'Air Temp']
+USAGE_SPAN_KEYS = [('KWH', ('E. Per. Begin', 'E. Per. End')),
+                   ('THERM', ('G. Per. Begin', 'G. Per. End'))]
+RATE_KEYS = [('Elec. Meter Records', 'Electric Rate'),
+             ('Gas Meter Records', 'Gas Rate')]
+# Records aggregated at once by amsaves_usage_range & amsaves_billing_rate;
+# records streamed from the API are read this many at a time
+CHUNK_RECORDS = 10000
+
+
+def _round(values):
+    """ Round an array to whole numbers as the built-in round function of
+        Python 2 does, with halves rounded away from zero """
+
+    magnitude = np.abs(values)
+    whole = np.floor(magnitude)
+
+    return np.sign(values)*(whole + (magnitude - whole >= 0.5))
+
+
+@stage(1)
 def amsaves_results(comparisonsDct, bldgModelsDct, bldgIDct):
     """ Pass the results of get_model_comparisons function; produce requested 
         results for the 'America Saves!' program as a DataFrame """
 
-    uses = []
-    for key, value in comparisonsDct.iteritems():
-        elecRatio = value['ElectricRatioA']
-        gasRatio = value['GasRatioA']
-        elecKwhSavings = round(-value['ElectricDifference']*elecRatio, 0)
-        gasThermSavings = round(-value['GasDifference']/29.3072*gasRatio, 0)
-        elecBaseLdKwh = round(value['ModelAValues'][1]*elecRatio + \
-                              value['ModelAValues'][3]*elecRatio + \
-                              value['ModelAValues'][5]*elecRatio + \
-                              value['ModelAValues'][7]*elecRatio, 0)
-        elecClgKwh = round(value['ModelAValues'][0]*elecRatio, 0)
-        elecHtgKwh = round(value['ModelAValues'][8]*elecRatio, 0)
-        gasSpcHtgTherm = round(value['ModelAValues'][9]/29.3072*gasRatio, 0)
-        gasBaseLd = round((value['ModelAValues'][2] + \
-                           value['ModelAValues'][4] + \
-                           value['ModelAValues'][6])/29.3072*gasRatio, 0)
-        bldgID = key
-        bldg = bldgIDct[key]
-        jsonModel = bldgModelsDct[key]['Reference Model']
-        customID = bldg['ExternalID']
-        bldgName = bldg['BuildingName']
-        rSquare = jsonModel['R2Coefficient']
-        iterQuant = jsonModel['IterationQty']
-        bldgArea = jsonModel['SquareFeet']
-        solnID = jsonModel['SolutionID']
-        uses.append([key, customID, bldgName, rSquare, iterQuant, bldgArea,
-                     solnID, elecKwhSavings, gasThermSavings, elecBaseLdKwh,
-                     elecClgKwh, elecHtgKwh, gasSpcHtgTherm, gasBaseLd,
-                     elecRatio, gasRatio])
-
     names = ['Blg. ID', 'BldgEnergy ID', 'Bldg Name', 'R2Coef.', 'Iterations',
              'Bldg. Area [ft2]', 'Solution ID', 'Electric Savings [kWh]',
              'Gas Savings [Therms]', 'Elec. Base-load [kWh]',
@@ -55,57 +60,136 @@ def amsaves_results(comparisonsDct, bldgModelsDct, bldgIDct):
              'Gas Space Heat [Therms]', 'Gas Base-load [Therms]',
              'Elec. True-up Ratio', 'Gas True-up Ratio']
 
-    usesDf = pd.DataFrame(data=uses, columns=names)
+    keys = list(comparisonsDct)
+    if not keys:
+        return pd.DataFrame(columns=names)
+
+    # Stack the comparisons, one row per building
+    comparisons = [comparisonsDct[key] for key in keys]
+    modelAValues = np.array([value['ModelAValues'][:10] for value
+                             in comparisons], dtype=float)
+    elecRatio = np.array([value['ElectricRatioA'] for value in comparisons],
+                         dtype=float)
+    gasRatio = np.array([value['GasRatioA'] for value in comparisons],
+                        dtype=float)
+    elecDifference = np.array([value['ElectricDifference'] for value
+                               in comparisons], dtype=float)
+    gasDifference = np.array([value['GasDifference'] for value
+                              in comparisons], dtype=float)
+
+    # End-uses by column of ModelAValues; 0 cooling, 1, 3, 5 & 7 electric
+    # base-load, 2, 4 & 6 gas base-load, 8 electric heat, 9 gas space heat.
+    # Gas is converted from kWh to therms once, for the stacked columns
+    elecUses = modelAValues[:, [1, 3, 5, 7, 0, 8]]
+    elec = np.column_stack([-elecDifference, elecUses]) * \
+           elecRatio[:, np.newaxis]
+    gasBase = modelAValues[:, 2] + modelAValues[:, 4] + modelAValues[:, 6]
+    gas = np.column_stack([-gasDifference, modelAValues[:, 9], gasBase]) / \
+          KWH_PER_THERM * gasRatio[:, np.newaxis]
+    elecBaseLd = elec[:, 1] + elec[:, 2] + elec[:, 3] + elec[:, 4]
+
+    # Join the building & reference model metadata by building ID
+    bldgs = [bldgIDct[key] for key in keys]
+    jsonModels = [bldgModelsDct[key]['Reference Model'] for key in keys]
+    metadata = [[bldg[field] for bldg in bldgs] for field
+                in ('ExternalID', 'BuildingName')] + \
+               [[jsonModel[field] for jsonModel in jsonModels] for field
+                in ('R2Coefficient', 'IterationQty', 'SquareFeet',
+                    'SolutionID')]
+
+    columns = [keys] + metadata + \
+              [_round(elec[:, 0]), _round(gas[:, 0]), _round(elecBaseLd),
+               _round(elec[:, 5]), _round(elec[:, 6]), _round(gas[:, 1]),
+               _round(gas[:, 2]), elecRatio, gasRatio]
+    usesDf = pd.DataFrame(dict(zip(names, columns)), columns=names)
     # TODO (eayoungs): Return a tuple, add primary building IDs from
     #                  deltameterservices.com; create a dictionary of
     #                  dataframes as in am_saves_audit, 
     return usesDf
 
 
-def amsaves_audit(audits):
+def amsaves_audit_records(audits):
+    """ Pass the results of get_model_audits function; produce one typed,
+        long-format DataFrame of every model's billing periods, keyed by
+        model ID & fuel (Electricity or Gas) """
+
+    rows = [(key, jsonAudit['UnitOfMeasure'], jsonAudit['TotalUnitsUsed'],
+             jsonAudit['ElecWattsPerFt2'], jsonAudit['PeriodStartDate'],
+             jsonAudit['PeriodEndDate'], jsonAudit['DaysInPeriod'],
+             jsonAudit['AirTemp'])
+            for key, jsonAudits in audits.iteritems()
+            for jsonAudit in jsonAudits]
+    auditDf = pd.DataFrame.from_records(rows, columns=['Model ID', 'Fuel'] +
+                                                      AUDIT_NAMES)
+
+    auditDf['Fuel'] = auditDf['Fuel'].map(AUDIT_FUELS)
+    auditDf = auditDf[auditDf['Fuel'].notnull()].reset_index(drop=True)
+    for column in ('Per. Start', 'Per. End'):
+        auditDf[column] = pd.to_datetime(auditDf[column], format=DATE_FORMAT)
+    auditDf['Hrs. in Per.'] = auditDf['Hrs. in Per.']*24
+
+    return auditDf
+
+
+def _usage_frame(values, fuels):
+    """ Pass the columns of an audit DataFrame & a list of (row indices,
+        column names) pairs, one per fuel; return a DataFrame of each fuel's
+        rows side by side """
+
+    data = {}
+    names = []
+    for rows, fuelNames in fuels:
+        for column, name in zip(values, fuelNames):
+            data[len(names)] = column[rows]
+            names.append(name)
+    usageDf = pd.DataFrame(data)
+    usageDf.columns = names
+
+    return usageDf
+
+
+@stage(2)
+def amsaves_audit(audits, long_format=False):
     """ Pass the results of get_model_audits function; produce audit of 
-        results for the 'America Saves!' program as a DataFrame """
+        results for the 'America Saves!' program as a dictionary of
+        DataFrames with model IDs as keys, or, with long_format set, as the
+        single DataFrame of amsaves_audit_records function """
+
+    auditDf = amsaves_audit_records(audits)
+    if long_format:
+        return auditDf
+
+    # TODO (eayoungs): Move data frame construction to test function; stick
+    #                  deltameterservices.com structure, filter & , per
+    #                  amsaves_flags()
+    for column in ('Per. Start', 'Per. End'):
+        auditDf[column] = auditDf[column].dt.date
+    values = [auditDf[column].values for column in AUDIT_NAMES]
+    groups = auditDf.groupby(['Model ID', 'Fuel'], sort=False).indices
+    noRows = np.array([], dtype=int)
 
     combinedUsageDct = {}
-    for key, value in audits.iteritems():
-        elecUsage = []
-        gasUsage = []
-        jsonAudits = value
-        for jsonAudit in jsonAudits:
-            values = jsonAudit['TotalUnitsUsed']
-            periodStartDate = \
-                       datetime.datetime.strptime(jsonAudit['PeriodStartDate'],
-                                                  '%Y-%m-%dT%H:%M:%S').date()
-            periodEndDate = \
-                         datetime.datetime.strptime(jsonAudit['PeriodEndDate'],
-                                                    '%Y-%m-%dT%H:%M:%S').date()
-            hrsInPeriod = jsonAudit['DaysInPeriod']*24
-            pwrDensity = jsonAudit['ElecWattsPerFt2']
-            airTemp = jsonAudit['AirTemp']
-            if jsonAudit['UnitOfMeasure'] == 'KWH':
-                elecUsage.append([values, pwrDensity, periodStartDate,
-                                  periodEndDate, hrsInPeriod, airTemp])
-                elecNames = ['[kWh/Mo.]', 'Elec. [W/SF]', 'Per. Start',
-                         'Per. End', 'Hrs. in Per.', 'Air Temp']
-            elif jsonAudit['UnitOfMeasure'] == 'THERM':
-                gasUsage.append([values, pwrDensity, periodStartDate,
-                                 periodEndDate, hrsInPeriod, airTemp])
-                gasNames = ['[Therms/Mo.]', 'Gas [W/SF]', 'Per. Start',
-                         'Per. End', 'Hrs. in Per.', 'Air Temp']
-
-        # TODO (eayoungs): Move data frame construction to test function; stick
-        #                  deltameterservices.com structure, filter & , per
-        #                  amsaves_flags()
-        elecUsageDf = pd.DataFrame(data=elecUsage, columns=elecNames)
-        if gasUsage:
-            gasUsageDf = pd.DataFrame(data=gasUsage, columns=gasNames)
-            combinedUsageDf = pd.concat([elecUsageDf, gasUsageDf], axis=1)
-            combinedUsageDct[key] = combinedUsageDf
-        else: combinedUsageDct[key] = elecUsageDf
+    for key in audits:
+        elecFuel = (groups.get((key, 'Electricity'), noRows),
+                    ELEC_AUDIT_NAMES)
+        gasRows = groups.get((key, 'Gas'))
+        if gasRows is None:
+            combinedUsageDct[key] = _usage_frame(values, [elecFuel])
+        elif len(gasRows) == len(elecFuel[0]):
+            combinedUsageDct[key] = _usage_frame(values, [elecFuel,
+                                                 (gasRows, GAS_AUDIT_NAMES)])
+        else:
+            # Unequal numbers of periods are padded by aligning on the index
+            combinedUsageDct[key] = pd.concat(
+                             [_usage_frame(values, [elecFuel]),
+                              _usage_frame(values, [(gasRows,
+                                                     GAS_AUDIT_NAMES)])],
+                             axis=1)
 
     return combinedUsageDct
 
 
+@stage(1)
 def amsaves_flags(fvCharts):
     """ Pass the results of get_fv_charts function; produce 'flags' formatted
         to specification of America Saves! project requirements """
@@ -134,79 +218,268 @@ def amsaves_flags(fvCharts):
     # deltameterservices.com to return statment
     return diagnMsgCodes
 
+FLAG_COLUMNS = ['Bldg ID', 'Int. Elec.', 'Ultra-High Elec.', 'Excessive Htg.',
+                'Shell & Vent.', 'Excessive Clg', 'Inefficient Clg',
+                'Erratic Operation', 'High Gas Eqp.']
+# The flag column of each diagnostic by its message code; Occupant Load is
+# split by code, the others flag any code
+FLAG_MESSAGES = [('Occupant Load', ('A', 'B', 'C'), 'Int. Elec.'),
+                 ('Occupant Load', ('O', 'P'), 'Ultra-High Elec.'),
+                 ('Controls Heating', None, 'Excessive Htg.'),
+                 ('Shell Ventilation', None, 'Shell & Vent.'),
+                 ('Controls Cooling', None, 'Excessive Clg'),
+                 ('Cooling Efficiency', None, 'Inefficient Clg'),
+                 ('Data Consistency', None, 'Erratic Operation')]
+# Summer Gas Use flags high gas equipment by its text, as M
+GAS_FLAG = ('Summer Gas Use', 'High', 'High Gas Eqp.', 'M')
+_FLAG_NAMES = sorted(set(name for name, codes, column in FLAG_MESSAGES)
+                     | set([GAS_FLAG[0]]))
+
+
+def amsaves_diagnostic_records(fvCharts):
+    """ Pass the results of get_fv_charts function; produce one long-format
+        DataFrame of every building's diagnostics, in a single pass """
+
+    rows = [(key, diagnstc['MessageName'], diagnstc['MessageCode'],
+             diagnstc['MessageText'])
+            for key, value in fvCharts.iteritems()
+            for diagnstc in value['Diagnostics']]
+
+    return pd.DataFrame.from_records(rows, columns=['Bldg ID', 'MessageName',
+                                                   'MessageCode',
+                                                   'MessageText'])
+
+
+def flag_table(diagnDf, bldgIDs=None):
+    """ Pass a DataFrame of diagnostics as from amsaves_diagnostic_records
+        function & optionally the IDs of every building, including those
+        without diagnostics; produce the site's flags, one row per building
+        with the columns of FLAG_COLUMNS, each flag the whole of its message
+        code & a missing code no flag. A later diagnostic of the same name
+        replaces an earlier one, as in amsaves_flags """
+
+    if bldgIDs is None:
+        bldgIDs = diagnDf['Bldg ID'].unique()
+    bldgIDs = sorted(bldgIDs)
+    flags = np.full((len(bldgIDs), len(FLAG_COLUMNS) - 1), '', dtype=object)
+
+    # Number each row's building & message name, -1 for names without flags
+    bldgIndex = pd.Categorical(diagnDf['Bldg ID'].values,
+                               categories=bldgIDs).codes.astype(int)
+    nameIndex = pd.Categorical(diagnDf['MessageName'].values,
+                               categories=_FLAG_NAMES).codes.astype(int)
+    # The last diagnostic of each name & building holds
+    keys = bldgIndex*len(_FLAG_NAMES) + nameIndex
+    flagged = (nameIndex >= 0) & (bldgIndex >= 0)
+    rows = np.flatnonzero(flagged)[::-1]
+    rows = rows[np.unique(keys[rows], return_index=True)[1]]
+
+    codes = diagnDf['MessageCode'].iloc[rows].fillna('')
+    columns = np.full(len(rows), -1, dtype=int)
+    for name, flagCodes, column in FLAG_MESSAGES:
+        matched = nameIndex[rows] == _FLAG_NAMES.index(name)
+        if flagCodes is None:
+            matched &= (codes != '').values
+        else:
+            matched &= codes.isin(flagCodes).values
+        columns[matched] = FLAG_COLUMNS.index(column) - 1
+    valued = columns >= 0
+    flags[bldgIndex[rows][valued], columns[valued]] = \
+        codes.values[valued]
+
+    gasName, gasText, gasColumn, gasValue = GAS_FLAG
+    gasRows = rows[nameIndex[rows] == _FLAG_NAMES.index(gasName)]
+    highGas = gasRows[diagnDf['MessageText'].values[gasRows] == gasText]
+    flags[bldgIndex[highGas], FLAG_COLUMNS.index(gasColumn) - 1] = gasValue
+
+    table = pd.DataFrame(flags, columns=FLAG_COLUMNS[1:])
+    table.insert(0, FLAG_COLUMNS[0], bldgIDs)
+
+    return table
+
+
+@stage(1)
+def amsaves_flag_table(fvCharts):
+    """ Pass the results of get_fv_charts function; produce the site's flags
+        as a DataFrame of FLAG_COLUMNS, formatted to specification of
+        America Saves! project requirements """
+
+    return flag_table(amsaves_diagnostic_records(fvCharts), list(fvCharts))
+
 # TODO (eayoungs): Create a function to return summary & meta data for each
 #                  building. (Some metadata, such as date ranges of meter
 #                  readings will come from audit data)
 
 
+def _record_batches(groupRecords, size=CHUNK_RECORDS):
+    """ Pass the records of each group of an aggregation, as lists, arrays
+        or iterators; yield batches of about size records, each a list of
+        (group number, records) pairs. Iterators are read size records at a
+        time, so streamed records are never all held at once """
+
+    batch = []
+    batchSize = 0
+    for group, records in enumerate(groupRecords):
+        if isinstance(records, (list, tuple, np.ndarray)):
+            chunks = [records]
+        else:
+            records = iter(records)
+            chunks = iter(lambda: list(islice(records, size)), [])
+        for chunk in chunks:
+            if not len(chunk):
+                continue
+            batch.append((group, chunk))
+            batchSize += len(chunk)
+            if batchSize >= size:
+                yield batch
+                batch = []
+                batchSize = 0
+    if batch:
+        yield batch
+
+
+def _batch_groups(batch):
+    """ Pass a batch from _record_batches; return an array of the group
+        number of each of its records """
+
+    return np.repeat([group for group, records in batch],
+                     [len(records) for group, records in batch])
+
+
+def _batch_column(batch, field):
+    """ Pass a batch from _record_batches & a field name; return a list of
+        the field's value in each of its records """
+
+    return list(chain.from_iterable(map(itemgetter(field), records)
+                                    for group, records in batch))
+
+
+def _batch_values(batch, field, dtype=None):
+    """ Pass a batch from _record_batches & a field name; return an array of
+        the field's value in each of its records, taking the field's column
+        whole from records held as arrays (see the seriesstore module) """
+
+    parts = []
+    pending = []
+    for group, records in batch:
+        if isinstance(records, np.ndarray):
+            if pending:
+                parts.append(np.array(_batch_column(pending, field), dtype))
+                pending = []
+            parts.append(records[field])
+        else:
+            pending.append((group, records))
+    if pending:
+        parts.append(np.array(_batch_column(pending, field), dtype))
+
+    values = np.concatenate(parts)
+
+    return values if dtype is None else values.astype(dtype, copy=False)
+
+
+def _group_extremes(groups, values, groupQty):
+    """ Pass an array of group numbers & an array of values, one per row;
+        return the positions of the least & greatest value of each group, -1
+        for groups without rows """
+
+    least = np.full(groupQty, -1, dtype=int)
+    greatest = np.full(groupQty, -1, dtype=int)
+    if len(groups):
+        order = np.lexsort((values, groups))
+        sortedGroups = groups[order]
+        firsts = np.flatnonzero(np.r_[True, sortedGroups[1:] !=
+                                      sortedGroups[:-1]])
+        lasts = np.r_[firsts[1:] - 1, len(order) - 1]
+        least[sortedGroups[firsts]] = order[firsts]
+        greatest[sortedGroups[lasts]] = order[lasts]
+
+    return least, greatest
+
+
+@stage(2)
 def amsaves_usage_range(audits):
-    """ Pass the results of get_model_audits function; produce time span of
-        utility billing used in ma given model results for the 'America
-        Saves!' program """
+    """ Pass the results of get_model_audits function, of
+        stream_model_audits or of MeterSeriesStore.model_audits; produce
+        time span of utility billing used in ma given model results for the
+        'America Saves!' program """
+
+    keys = list(audits)
+    unitQty = len(USAGE_SPAN_KEYS)
+    # Periods of other units fall in a last group of their own
+    groupQty = len(keys)*unitQty + 1
+    beginDates = np.zeros(groupQty, 'datetime64[s]')
+    endDates = np.zeros(groupQty, 'datetime64[s]')
+    found = np.zeros(groupQty, dtype=bool)
+
+    for batch in _record_batches([audits[key] for key in keys]):
+        # Group the periods of each model by unit of measure
+        # TODO (eayoungs): Raise exception for units other than KWH & THERM
+        units = _batch_values(batch, 'UnitOfMeasure')
+        unitIndex = np.full(len(units), -1, dtype=int)
+        for index, (unit, spanKeys) in enumerate(USAGE_SPAN_KEYS):
+            unitIndex[units == unit] = index
+        groups = np.where(unitIndex >= 0,
+                          _batch_groups(batch)*unitQty + unitIndex,
+                          groupQty - 1)
+        batchBegins = _batch_values(batch, 'PeriodStartDate',
+                                    'datetime64[s]')
+        batchEnds = _batch_values(batch, 'PeriodEndDate', 'datetime64[s]')
+        least = _group_extremes(groups, batchBegins, groupQty)[0]
+        greatest = _group_extremes(groups, batchEnds, groupQty)[1]
+
+        # Keep the earlier begin & later end of this batch & those before it
+        inBatch = least >= 0
+        earlier = inBatch & (~found | (batchBegins[least] < beginDates))
+        later = inBatch & (~found | (batchEnds[greatest] > endDates))
+        beginDates[earlier] = batchBegins[least[earlier]]
+        endDates[later] = batchEnds[greatest[later]]
+        found |= inBatch
 
     auditSpans = {}
-    for key, value in audits.iteritems():
+    for position, key in enumerate(keys):
         spanData = {}
-        jsonAudits = value
-        elecStart = []
-        elecEnd = []
-        gasStart = []
-        gasEnd = []
-        for jsonAudit in jsonAudits:
-            periodStartDate = str(jsonAudit['PeriodStartDate'])
-            periodEndDate = str(jsonAudit['PeriodEndDate'])
-            if jsonAudit['UnitOfMeasure'] == 'KWH':
-                elecStart.append(periodStartDate)
-                elecEnd.append(periodEndDate)
-            elif jsonAudit['UnitOfMeasure'] == 'THERM':
-                gasStart.append(periodStartDate)
-                gasEnd.append(periodEndDate)
-            # TODO (eayoungs): Add final else statement to raise exception
-        if len(elecStart) > 0:
-            elecSpanBegin = min(elecStart)
-            elecSpanEnd = max(elecEnd)
-        if len(gasStart) > 0:
-            gasSpanBegin = min(gasStart)
-            gasSpanEnd = max(gasEnd)
-        else: 
-            gasSpanBegin = 0
-            gasSpanEnd = 0
-
-        spanData['E. Per. Begin'] = elecSpanBegin
-        spanData['E. Per. End'] = elecSpanEnd
-        spanData['G. Per. Begin'] = gasSpanBegin
-        spanData['G. Per. End'] = gasSpanEnd
+        for index, (unit, (beginKey, endKey)) in enumerate(USAGE_SPAN_KEYS):
+            group = position*unitQty + index
+            if found[group]:
+                spanData[beginKey] = str(beginDates[group])
+                spanData[endKey] = str(endDates[group])
+            else:
+                spanData[beginKey] = 0
+                spanData[endKey] = 0
         auditSpans[key] = spanData
 
     return auditSpans
 
 
+@stage(3)
 def amsaves_billing_rate(bldgMeterRecordsDct):
     """ Takes a dictionary of building meters with building IDs as keys, whose
         values are dictionaries with named keys describing the fuel type
-        containing meter readings; returns a dictionary with building IDs as
-        keys containing a dictionary of cost & consumption values with
-        descriptive keys """
-
-    bldgRatesDct = {}
-    for key, value in bldgMeterRecordsDct.iteritems():
-        utilityRateDct = {}
-        elecMeterRecords = value['Elec. Meter Records']
-        elecUse = sum([elecMeterRecord['TotalUnitsUsed'] for elecMeterRecord
-                       in elecMeterRecords])
-        elecCost = sum([elecMeterRecord['TotalUsageCost'] for elecMeterRecord
-                        in elecMeterRecords])
-        elecRate = elecCost / elecUse
-        utilityRateDct['Electric Rate'] = elecRate
-
-        if len(value) == 2:
-            gasMeterRecords = value['Gas Meter Records']
-            gasUse = sum([gasMeterRecord['TotalUnitsUsed'] for gasMeterRecord
-                          in gasMeterRecords])
-            gasCost = sum([gasMeterRecord['TotalUsageCost'] for gasMeterRecord
-                           in gasMeterRecords])
-            gasRate = gasCost / gasUse
-            utilityRateDct['Gas Rate'] = gasRate
-        bldgRatesDct[key] = utilityRateDct
-
-    return bldgRatesDct 
+        containing meter readings, as lists, as iterators such as those of
+        stream_meter_records or as arrays of a MeterSeriesStore; returns a
+        dictionary with building IDs as keys containing a dictionary of cost
+        & consumption values with descriptive keys. A fuel with no usage has
+        a rate of NaN """
+
+    # Each list of meter records is one group of the aggregation
+    groups = [(key, recordsKey, meterRecords)
+              for key, value in bldgMeterRecordsDct.iteritems()
+              for recordsKey, meterRecords in value.iteritems()]
+    totalUse = np.zeros(len(groups))
+    totalCost = np.zeros(len(groups))
+    for batch in _record_batches([group[2] for group in groups]):
+        groupOfRecord = _batch_groups(batch)
+        totalUse += np.bincount(groupOfRecord, _batch_values(
+                                batch, 'TotalUnitsUsed', float), len(groups))
+        totalCost += np.bincount(groupOfRecord, _batch_values(
+                                 batch, 'TotalUsageCost', float), len(groups))
+    rates = np.full(len(groups), np.nan)
+    np.divide(totalCost, totalUse, out=rates, where=totalUse != 0)
+
+    rateKeys = dict(RATE_KEYS)
+    bldgRatesDct = dict((key, {}) for key in bldgMeterRecordsDct)
+    for (key, recordsKey, meterRecords), rate in zip(groups, rates):
+        if recordsKey in rateKeys:
+            bldgRatesDct[key][rateKeys[recordsKey]] = float(rate)
+
+    return bldgRatesDct
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides the writing of a file whole, used by every module
+    writing files read by other threads or processes (the reports, metrics,
+    meter series & partitions of results). A file is written to a temporary
+    file beside it & renamed over it, so readers see the old file or the new
+    one, never a partial write.
+    Usage:
+        makedirs('reports/46')
+        atomic_write('reports/46/46-results.csv', resultsDf.to_csv) """
+
+import os
+import socket
+import threading
+
+
+def makedirs(directory):
+    """ Pass a directory; make it & its parents unless they exist, allowing
+        for another writer making them in the meantime """
+
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+
+def atomic_write(path, write):
+    """ Pass a path & a function writing a file to the path passed to it;
+        replace the file at the path whole with the one written """
+
+    # Named by host, process & thread, so no two writers share one
+    tmpPath = '%s.%s.%d.%d.tmp' % (path, socket.gethostname(), os.getpid(),
+                                   threading.current_thread().ident)
+    try:
+        write(tmpPath)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmpPath, path)
+    except Exception:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module runs the America Saves! reports for a batch of sites,
+    spreading the sites across a pool of processes, each site with its own
+    pooled DeltaMeterClient & pipeline (see the pipeline module), so the
+    transforms of several sites use every core. Each site's results, audits,
+    flags & usage ranges are written to a directory of its own, and a
+    summary of the run, one row per site, to the output directory. With a
+    checkpoint file, each building's stages are kept as they are done (see
+    the checkpoint module), and a later run resumes where a failed one
+    stopped. The reports are written by a pool of background threads (see
+    the reportwriter module), and the audits, by default one file per
+    reference model, can instead be written as one dataset partitioned by
+    site, under the audits directory of the output directory.
+    Usage:
+        python batch.py 46 47 48 --output reports --processes 4
+        python batch.py 46 47 48 --checkpoint checkpoints.db
+        python batch.py 46 47 48 --writers 16 --audit-dataset """
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import amsaves as ams
+import checkpoint
+import deltamtrsvs
+from lazyimport import LazyModule
+import pipeline
+import reportwriter
+
+pd = LazyModule('pandas')
+
+# The reports written for each site
+OUTPUTS = ['results', 'audit', 'flags', 'usage_range']
+# The directory of the audit dataset, within the output directory
+AUDIT_DATASET = 'audits'
+# Of each site, the buildings, those with the results of a comparison of
+# their models, the reference models audited, the buildings with at least
+# one flag & the buildings failed
+SUMMARY_COLUMNS = ['Site', 'Status', 'Buildings', 'Models', 'Audits',
+                   'Flagged', 'Failed', 'Wall Time [s]', 'Error']
+
+
+def flags_frame(diagnMsgCodes):
+    """ Pass the results of amsaves_flags function; return the site's flags
+        as a DataFrame of amsaves.FLAG_COLUMNS """
+
+    diagnDf = pd.DataFrame.from_records(
+              [(bldgID, name, value[0], value[1])
+               for bldgID, msgCodes in diagnMsgCodes.items()
+               for name, value in msgCodes.items()],
+              columns=['Bldg ID', 'MessageName', 'MessageCode',
+                       'MessageText'])
+
+    return ams.flag_table(diagnDf, list(diagnMsgCodes))
+
+
+def flagged_count(flagsDf):
+    """ Pass the flags of a site as from flags_frame function; return the
+        number of buildings with at least one flag """
+
+    return int((flagsDf[ams.FLAG_COLUMNS[1:]] != '').any(axis=1).sum())
+
+
+def usage_range_frame(auditSpans):
+    """ Pass the results of amsaves_usage_range function; return a DataFrame
+        of the usage ranges of each reference model """
+
+    colNms = [key for unit, keys in ams.USAGE_SPAN_KEYS for key in keys]
+    df = pd.DataFrame.from_dict(auditSpans, orient='index')
+    df = df.reindex(columns=colNms)
+    df.index.name = 'Ref. Model ID'
+
+    return df.sort_index()
+
+
+def write_site(directory, site, reports, writer=None, audit_dataset=None):
+    """ Pass a directory, a site & the results of the site's OUTPUTS stages,
+        & optionally a reportwriter.ReportWriter to queue the writes on & the
+        directory of an audit dataset; write the reports as .CSV files as the
+        tests of amsaves do, but for the audits, written as the site's
+        partition of the dataset if its directory is passed. Without a
+        writer, one is made & waited for """
+
+    if writer is None:
+        with reportwriter.ReportWriter() as writer:
+            return write_site(directory, site, reports, writer,
+                              audit_dataset)
+    writer.write_csv(os.path.join(directory, site + '-results.csv'),
+                     reports['results'])
+    if audit_dataset is None:
+        for modelID, df in reports['audit'].items():
+            writer.write_csv(os.path.join(directory, modelID + '-audit.csv'),
+                             df)
+    else:
+        reportwriter.write_audit_dataset(writer, audit_dataset, site,
+                                         reports['audit'])
+    writer.write_csv(os.path.join(directory, site + '-flags.csv'),
+                     flags_frame(reports['flags']), index=False)
+    writer.write_csv(os.path.join(directory, site + '-use_ranges.csv'),
+                     usage_range_frame(reports['usage_range']))
+
+
+def run_site(task):
+    """ Pass a tuple of a site, the API headers, the dictionary of end-point
+        URLs, the output directory, the threads per fan-out of requests, the
+        path of the checkpoint file or None, whether to resume from it, the
+        threads writing the reports & whether to write the audits as a
+        dataset; run & write the site's reports, returning a row of the run
+        summary. A failure is recorded in the summary rather than raised, so
+        one site does not stop the batch """
+
+    (site, headers, urls, output, fetch_workers, checkpointPath, resume,
+     writers, auditDataset) = task
+    start = time.time()
+    row = dict((name, None) for name in SUMMARY_COLUMNS)
+    row['Site'] = site
+    try:
+        with deltamtrsvs.DeltaMeterClient(headers,
+                                          pool_maxsize=fetch_workers or 1
+                                          ) as client:
+            if checkpointPath is None:
+                pipe = pipeline.Pipeline(client, urls,
+                                         fetch_workers=fetch_workers)
+                reports = pipe.run(OUTPUTS, [site])[site]
+                row['Buildings'] = len(pipe.get(site, 'bldgs'))
+                row['Failed'] = 0
+            else:
+                store = checkpoint.CheckpointStore(checkpointPath)
+                try:
+                    run = checkpoint.CheckpointedRun(client, urls, store,
+                                                     fetch_workers, OUTPUTS)
+                    reports = run.run(site, resume)
+                    row['Buildings'] = len(store.load(site)['bldgs'])
+                finally:
+                    store.close()
+                row['Failed'] = len(reports['failed'])
+            with reportwriter.ReportWriter(writers) as writer:
+                write_site(os.path.join(output, site), site, reports, writer,
+                           os.path.join(output, AUDIT_DATASET)
+                           if auditDataset else None)
+        row['Models'] = reports['results'].shape[0]
+        row['Audits'] = len(reports['audit'])
+        row['Flagged'] = flagged_count(flags_frame(reports['flags']))
+        row['Status'] = 'ok' if not row['Failed'] else 'partial'
+    except Exception as error:
+        row['Status'] = 'failed'
+        row['Error'] = repr(error)
+    row['Wall Time [s]'] = time.time() - start
+
+    return row
+
+
+def run_batch(sites, headers, urls, output, processes=None,
+              fetch_workers=None, checkpoint_path=None, resume=True,
+              writers=4, audit_dataset=False):
+    """ Pass a list of sites, the API headers, a dictionary of end-point URLs
+        (see pipeline.config_urls) & an output directory, & optionally the
+        number of processes & threads per fan-out of requests, the path of a
+        checkpoint file, whether to resume from it, the threads writing each
+        site's reports & whether to write the audits as one dataset (see
+        AUDIT_DATASET); run & write the reports of every site & return the
+        summary of the run as a DataFrame, also written to the output
+        directory """
+
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    tasks = [(str(site), headers, urls, output, fetch_workers,
+              checkpoint_path, resume, writers, audit_dataset)
+             for site in sites]
+    rows = []
+    if tasks:
+        pool = multiprocessing.Pool(processes or
+                                    min(len(tasks),
+                                        multiprocessing.cpu_count()))
+        try:
+            rows = pool.map(run_site, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+    summary.to_csv(os.path.join(output, 'summary.csv'), index=False)
+
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the America Saves! '
+                                     'reports for a batch of sites')
+    parser.add_argument('sites', nargs='+', help='property IDs of the sites')
+    parser.add_argument('--output', default='reports',
+                        help='directory to write the reports to')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='processes to run sites in, by default one per '
+                        'core')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='threads per fan-out of requests')
+    parser.add_argument('--checkpoint', default=None,
+                        help='SQLite file to keep the stages of each '
+                        'building in, resuming the run kept there')
+    parser.add_argument('--restart', action='store_true',
+                        help='start over rather than resume the run kept in '
+                        'the checkpoint file')
+    parser.add_argument('--writers', type=int, default=4,
+                        help='threads writing the reports of each site')
+    parser.add_argument('--audit-dataset', action='store_true',
+                        help='write the audits as one dataset partitioned '
+                        'by site, in place of a file per model')
+    args = parser.parse_args(argv)
+
+    import private as pvt
+    summary = run_batch(args.sites, pvt.headers, pipeline.config_urls(pvt),
+                        args.output, args.processes, args.max_workers,
+                        args.checkpoint, not args.restart, args.writers,
+                        args.audit_dataset)
+    print(summary.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
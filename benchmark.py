@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module benchmarks the whole chain of deltamtrsvs requests & amsaves
+    transforms for a property against a local stub server of synthetic
+    fixtures (see the stubapi module), reporting the wall time, requests per
+    second & request latency of each stage & the peak memory of the process
+    after it, and writing the results as .JSON for comparison across
+    commits.
+    Usage:
+        python benchmark.py --scales 10 100 1000 --latency 0.005
+        python benchmark.py --scales 10 100 --records
+        python benchmark.py --imports """
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import amsaves as ams
+import deltamtrsvs
+import pipeline
+import records
+import stubapi
+
+SITE = '46'
+# Seconds a cold import of the fetch layer may take, & the modules it must
+# not import
+IMPORT_BUDGET_S = 0.5
+FETCH_MODULES = ['deltamtrsvs', 'scheduler', 'respcache', 'metrics']
+HEAVY_MODULES = ['numpy', 'pandas']
+
+
+def percentile(values, fraction):
+    """ Pass a list of values & a fraction; return the value at that fraction
+        of the sorted values, or None if there are none """
+
+    if not values:
+        return None
+    values = sorted(values)
+
+    return values[int(round(fraction*(len(values) - 1)))]
+
+
+def process_peak_memory_mb():
+    """ Return the peak resident memory of this whole process so far in
+        megabytes, or None where the resource module is not available, as
+        on Windows """
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        return peak/1024.0/1024.0
+    return peak/1024.0
+
+
+class StageTimer(object):
+    """ Pass a stub server & a client; times each stage of the chain run
+        within stage(), counting the requests it made of the server & the
+        latency of each of the client's responses """
+
+    def __init__(self, server, client):
+        self.server = server
+        self.stages = []
+        self._latencies = []
+        client.session.hooks['response'].append(self._record)
+
+    def _record(self, response, *args, **kwargs):
+        self._latencies.append(response.elapsed.total_seconds())
+
+    def stage(self, name, function, *args, **kwargs):
+        """ Run a function as the named stage; return its result """
+
+        requests = self.server.requests
+        del self._latencies[:]
+        start = time.time()
+        result = function(*args, **kwargs)
+        wallTime = time.time() - start
+        requests = self.server.requests - requests
+        self.stages.append({'stage': name,
+                            'wall_time_s': wallTime,
+                            'requests': requests,
+                            'requests_per_s': requests/wallTime if wallTime
+                                              else None,
+                            'latency_p50_s': percentile(self._latencies, 0.5),
+                            'latency_p95_s': percentile(self._latencies,
+                                                        0.95),
+                            'process_peak_memory_mb':
+                                process_peak_memory_mb()})
+
+        return result
+
+
+def run_chain(timer, client, urls, site=SITE, max_workers=None):
+    """ Run the chain of requests & transforms for a site, timing each stage
+        with a StageTimer """
+
+    bldgIDct = timer.stage('get_property_bldgs', client.get_property_bldgs,
+                           urls['properties_url'], site)
+    bldgIDs = sorted(bldgIDct)
+    bldgModelsDct = timer.stage('get_bldg_models', client.get_bldg_models,
+                                urls['model_url'], bldgIDs, max_workers)
+    refModelsDct = {}
+    for key, value in bldgModelsDct.items():
+        refModelsDct[key] = value['Reference Model']
+
+    comparisonsDct = timer.stage('get_model_comparisons',
+                                 client.get_model_comparisons,
+                                 urls['comparison_url'], bldgModelsDct,
+                                 max_workers)
+    audits = timer.stage('get_model_audits', client.get_model_audits,
+                         urls['audit_url'], refModelsDct, max_workers)
+    fvCharts = timer.stage('get_fv_charts', client.get_fv_charts,
+                           urls['fv_charts_url'], sorted(bldgModelsDct),
+                           max_workers)
+    bldgMeterDct = timer.stage('get_bldg_meters', client.get_bldg_meters,
+                               urls['bldg_meters_url'], bldgIDs, max_workers)
+    auditSpans = timer.stage('amsaves_usage_range', ams.amsaves_usage_range,
+                             audits)
+    bldgMeterRecordsDct = timer.stage('get_meter_records',
+                                      client.get_meter_records, auditSpans,
+                                      bldgMeterDct,
+                                      urls['meter_records_url'],
+                                      refModelsDct, max_workers)
+    timer.stage('amsaves_results', ams.amsaves_results, comparisonsDct,
+                bldgModelsDct, bldgIDct)
+    timer.stage('amsaves_audit', ams.amsaves_audit, audits)
+    timer.stage('amsaves_flags', ams.amsaves_flags, fvCharts)
+    timer.stage('amsaves_billing_rate', ams.amsaves_billing_rate,
+                bldgMeterRecordsDct)
+
+
+def run_benchmark(bldgQty, latency=0, max_workers=None):
+    """ Pass a number of buildings; run the chain against a stub server of
+        that many synthetic buildings & return the results of each stage """
+
+    fixtures = stubapi.synthetic_fixtures(bldgQty, SITE)
+    with stubapi.StubServer(fixtures, latency) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        with deltamtrsvs.DeltaMeterClient({}, pool_maxsize=max_workers or 1
+                                          ) as client:
+            timer = StageTimer(server, client)
+            start = time.time()
+            run_chain(timer, client, urls, SITE, max_workers)
+            wallTime = time.time() - start
+
+    return {'buildings': bldgQty,
+            'latency_s': latency,
+            'max_workers': max_workers,
+            'wall_time_s': wallTime,
+            'requests': server.requests,
+            'requests_per_s': server.requests/wallTime,
+            'process_peak_memory_mb': process_peak_memory_mb(),
+            'stages': timer.stages}
+
+
+def deep_size(value, seen=None):
+    """ Pass an object; return the bytes held by it & every object it
+        refers to through dictionaries, lists, tuples & __slots__, counting
+        each object once """
+
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen)
+                    for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in value)
+    else:
+        for cls in type(value).__mro__:
+            for field in getattr(cls, '__slots__', ()):
+                if hasattr(value, field):
+                    size += deep_size(getattr(value, field), seen)
+
+    return size
+
+
+def run_record_benchmark(bldgQty, max_workers=None):
+    """ Pass a number of buildings; fetch their objects from a stub server of
+        that many synthetic buildings & return the memory held by them as
+        dictionaries parsed from .JSON & as the records of the records
+        module, & the time taken by the amsaves transforms of each """
+
+    fixtures = stubapi.synthetic_fixtures(bldgQty, SITE)
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        with deltamtrsvs.DeltaMeterClient({}, pool_maxsize=max_workers or 1
+                                          ) as client:
+            pipe = pipeline.Pipeline(client, urls, fetch_workers=max_workers)
+            jsonObjs = pipe.run(['bldgs', 'models', 'comparisons', 'audits',
+                                 'meters', 'meter_records'], [SITE])[SITE]
+
+    converters = {'bldgs': records.property_bldgs_from_json,
+                  'models': records.bldg_models_from_json,
+                  'comparisons': records.model_comparisons_from_json,
+                  'audits': records.model_audits_from_json,
+                  'meters': records.bldg_meters_from_json,
+                  'meter_records': records.meter_records_from_json}
+    recordObjs = dict((name, convert(jsonObjs[name])) for name, convert
+                      in converters.items())
+
+    def transform(objs):
+        start = time.time()
+        ams.amsaves_results(objs['comparisons'], objs['models'],
+                            objs['bldgs'])
+        ams.amsaves_audit(objs['audits'])
+        ams.amsaves_usage_range(objs['audits'])
+        ams.amsaves_billing_rate(objs['meter_records'])
+        return time.time() - start
+
+    run = {'buildings': bldgQty, 'stages': []}
+    for name in sorted(converters):
+        jsonBytes = deep_size(jsonObjs[name])
+        recordBytes = deep_size(recordObjs[name])
+        run['stages'].append({'stage': name,
+                              'json_mb': jsonBytes/1024.0/1024.0,
+                              'records_mb': recordBytes/1024.0/1024.0,
+                              'ratio': float(recordBytes)/jsonBytes})
+    run['json_mb'] = sum(stage['json_mb'] for stage in run['stages'])
+    run['records_mb'] = sum(stage['records_mb'] for stage in run['stages'])
+    run['json_transform_s'] = transform(jsonObjs)
+    run['records_transform_s'] = transform(recordObjs)
+
+    return run
+
+
+def import_time(modules, repeat=3):
+    """ Pass a list of module names; import them in a fresh interpreter,
+        repeat times, & return the least seconds taken & the HEAVY_MODULES
+        imported with them """
+
+    script = ('import json, sys, time\n'
+              'start = time.time()\n' +
+              ''.join('import %s\n' % module for module in modules) +
+              'print(json.dumps([time.time() - start, [name for name in %r '
+              'if name in sys.modules]]))' % HEAVY_MODULES)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    runs = [json.loads(subprocess.check_output([sys.executable, '-c', script],
+                                               cwd=directory
+                                               ).decode('ascii'))
+            for run in range(repeat)]
+
+    return min(run[0] for run in runs), runs[0][1]
+
+
+def git_commit():
+    """ Return the commit of the working tree, or None outside of git """
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           stderr=devnull
+                                           ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the DeltaMeter '
+                                     'Services fetch & America Saves! report '
+                                     'chain against a local stub server')
+    parser.add_argument('--scales', type=int, nargs='+',
+                        default=[10, 100, 1000],
+                        help='numbers of buildings to benchmark')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='latency injected per request, in seconds')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='threads per fan-out of requests')
+    parser.add_argument('--output', default='bench_output.json',
+                        help='file to write the .JSON results to')
+    parser.add_argument('--records', action='store_true',
+                        help='compare the memory of the objects fetched as '
+                        'dictionaries & as compact records instead')
+    parser.add_argument('--imports', action='store_true',
+                        help='time cold imports of the modules instead, '
+                        'failing if the fetch layer is over its budget')
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        # Each group is timed once, each run in a fresh interpreter
+        timings = [(modules, import_time(modules))
+                   for modules in (FETCH_MODULES, ['pipeline'],
+                                   ['workqueue'], ['batch'], ['amsaves'])]
+        for modules, (seconds, heavy) in timings:
+            print('%-44s %6.3f s %s' % (', '.join(modules), seconds,
+                                        ', '.join(heavy)))
+        overBudget = False
+        seconds, heavy = timings[0][1]
+        if seconds > IMPORT_BUDGET_S or heavy:
+            print('The fetch layer is over its budget of %.2f s, or imports '
+                  '%s' % (IMPORT_BUDGET_S, ', '.join(HEAVY_MODULES)))
+            overBudget = True
+        sys.exit(1 if overBudget else 0)
+
+    if args.records:
+        runs = []
+        for bldgQty in args.scales:
+            run = run_record_benchmark(bldgQty, args.max_workers)
+            runs.append(run)
+            print('%5d buildings: %8.1f MB as .JSON, %8.1f MB as records; '
+                  'transforms %.3f s, %.3f s' %
+                  (bldgQty, run['json_mb'], run['records_mb'],
+                   run['json_transform_s'], run['records_transform_s']))
+            for stage in run['stages']:
+                print('    %-24s %8.2f MB %8.2f MB %5.2f' %
+                      (stage['stage'], stage['json_mb'], stage['records_mb'],
+                       stage['ratio']))
+        with open(args.output, 'w') as outf:
+            json.dump({'commit': git_commit(),
+                       'python': platform.python_version(),
+                       'time': time.time(),
+                       'records': runs}, outf, indent=2)
+        return
+
+    runs = []
+    for bldgQty in args.scales:
+        run = run_benchmark(bldgQty, args.latency, args.max_workers)
+        runs.append(run)
+        print('%5d buildings: %8.3f s, %8.1f requests/s, %7.1f MB peak' %
+              (bldgQty, run['wall_time_s'], run['requests_per_s'],
+               run['process_peak_memory_mb'] or 0))
+        for stage in run['stages']:
+            print('    %-24s %8.3f s %6d requests' %
+                  (stage['stage'], stage['wall_time_s'], stage['requests']))
+
+    results = {'commit': git_commit(),
+               'python': platform.python_version(),
+               'time': time.time(),
+               'runs': runs}
+    with open(args.output, 'w') as outf:
+        json.dump(results, outf, indent=2)
+
+
+if __name__ == '__main__':
+    main()
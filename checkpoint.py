@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides checkpointed, resumable runs of the chain of
+    deltamtrsvs requests & amsaves transforms for a site. The requests &
+    transforms are run building by building, and the result of each stage of
+    each building kept in a local, SQLite backed store as soon as it is
+    made. A building failing at any stage, e.g. on a timeout, an invalid
+    comparison or a bad record, is recorded as failed without stopping the
+    others; resuming the run skips every stage already done & retries only
+    the failed buildings, from the stage they failed at.
+    Usage:
+        store = CheckpointStore('checkpoints.sqlite')
+        run = CheckpointedRun(deltamtrsvs.DeltaMeterClient(headers),
+                              pipeline.config_urls(pvt), store)
+        reports = run.run(site)
+        ...
+        reports = run.run(site)  # Again, after a failure """
+
+import pickle
+import sqlite3
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import amsaves as ams
+from lazyimport import LazyModule
+
+pd = LazyModule('pandas')
+
+# The ID under which the results of a whole site are kept
+SITE_KEY = ''
+
+
+class CheckpointStore(object):
+    """ Pass the path of the SQLite file to hold the results of each stage
+        of each building, & optionally the seconds to wait for a lock held by
+        another process """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=timeout,
+                                   check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS stages ('
+                             'site TEXT, bldg_id TEXT, stage TEXT, '
+                             'result BLOB, PRIMARY KEY (site, bldg_id, '
+                             'stage))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS failures ('
+                             'site TEXT, bldg_id TEXT, stage TEXT, '
+                             'error TEXT, attempts INTEGER, updated REAL, '
+                             'PRIMARY KEY (site, bldg_id))')
+
+    def close(self):
+        """ Close the SQLite file """
+
+        with self._lock:
+            self._db.close()
+
+    def load(self, site, bldgID=SITE_KEY):
+        """ Pass a site & building ID; return a dictionary of the results of
+            the building's completed stages, with stage names as keys """
+
+        with self._lock:
+            rows = self._db.execute('SELECT stage, result FROM stages WHERE '
+                                    'site = ? AND bldg_id = ?',
+                                    (site, bldgID)).fetchall()
+
+        return dict((stage, pickle.loads(bytes(result)))
+                    for stage, result in rows)
+
+    def save(self, site, bldgID, stage, result):
+        """ Pass a site, building ID, stage name & the stage's result; keep
+            the result """
+
+        blob = sqlite3.Binary(pickle.dumps(result, 2))
+        with self._lock:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO stages VALUES '
+                                 '(?, ?, ?, ?)', (site, bldgID, stage, blob))
+
+    def fail(self, site, bldgID, stage, error):
+        """ Pass a site, building ID, the stage it failed at & the error;
+            record the failure, counting the building's attempts """
+
+        with self._lock:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO failures VALUES '
+                                 '(?, ?, ?, ?, COALESCE((SELECT attempts '
+                                 'FROM failures WHERE site = ? AND '
+                                 'bldg_id = ?), 0) + 1, ?)',
+                                 (site, bldgID, stage, repr(error), site,
+                                  bldgID, time.time()))
+
+    def succeed(self, site, bldgID):
+        """ Pass a site & building ID; drop any failure of the building """
+
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM failures WHERE site = ? AND '
+                                 'bldg_id = ?', (site, bldgID))
+
+    def failures(self, site):
+        """ Pass a site; return a dictionary of the stage, error & attempts
+            of each failed building, with building IDs as keys """
+
+        with self._lock:
+            rows = self._db.execute('SELECT bldg_id, stage, error, attempts '
+                                    'FROM failures WHERE site = ?',
+                                    (site,)).fetchall()
+
+        return dict((bldgID, {'stage': stage, 'error': error,
+                              'attempts': attempts})
+                    for bldgID, stage, error, attempts in rows)
+
+    def clear(self, site):
+        """ Pass a site; drop every result & failure kept for it """
+
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM stages WHERE site = ?', (site,))
+                self._db.execute('DELETE FROM failures WHERE site = ?',
+                                 (site,))
+
+
+def _models(run, bldgID, bldg, done):
+    # None for a building without models, which has no further stages
+    return run.client.get_bldg_models(run.urls['model_url'],
+                                      [bldgID]).get(bldgID)
+
+
+def _comparison(run, bldgID, bldg, done):
+    return run.client.get_model_comparisons(run.urls['comparison_url'],
+                                            {bldgID: done['models']})[bldgID]
+
+
+def _audits(run, bldgID, bldg, done):
+    return run.client.get_model_audits(run.urls['audit_url'],
+                                       {bldgID: done['models']
+                                                ['Reference Model']})
+
+
+def _fv_chart(run, bldgID, bldg, done):
+    return run.client.get_fv_charts(run.urls['fv_charts_url'],
+                                    [bldgID]).get(bldgID)
+
+
+def _meters(run, bldgID, bldg, done):
+    return run.client.get_bldg_meters(run.urls['bldg_meters_url'],
+                                      [bldgID])[bldgID]
+
+
+def _usage_range(run, bldgID, bldg, done):
+    return ams.amsaves_usage_range(done['audits'])
+
+
+def _meter_records(run, bldgID, bldg, done):
+    return run.client.get_meter_records(done['usage_range'],
+                                        {bldgID: done['meters']},
+                                        run.urls['meter_records_url'],
+                                        {bldgID: done['models']
+                                                 ['Reference Model']}
+                                        ).get(bldgID)
+
+
+def _results(run, bldgID, bldg, done):
+    return ams.amsaves_results({bldgID: done['comparison']},
+                               {bldgID: done['models']}, {bldgID: bldg})
+
+
+def _audit(run, bldgID, bldg, done):
+    return ams.amsaves_audit(done['audits'])
+
+
+def _flags(run, bldgID, bldg, done):
+    if done['fv_chart'] is None:
+        return {}
+    return ams.amsaves_flags({bldgID: done['fv_chart']})
+
+
+def _billing_rate(run, bldgID, bldg, done):
+    if done['meter_records'] is None:
+        return {}
+    return ams.amsaves_billing_rate({bldgID: done['meter_records']})
+
+
+# The stages of each building, in the order run, each passed the results of
+# those before it, & the stages whose results it reads. The models are
+# always requested, as a building without them has no further stages
+BLDG_STAGES = [('models', _models, []),
+               ('comparison', _comparison, ['models']),
+               ('audits', _audits, ['models']),
+               ('fv_chart', _fv_chart, []),
+               ('meters', _meters, []),
+               ('usage_range', _usage_range, ['audits']),
+               ('meter_records', _meter_records, ['usage_range', 'meters',
+                                                  'models']),
+               ('results', _results, ['comparison', 'models']),
+               ('audit', _audit, ['audits']),
+               ('flags', _flags, ['fv_chart']),
+               ('billing_rate', _billing_rate, ['meter_records'])]
+# The stages merged across buildings into the reports of a site
+REPORTS = ['results', 'audit', 'flags', 'usage_range', 'billing_rate']
+
+
+def needed_stages(outputs):
+    """ Pass a list of the names of REPORTS; return the set of the names of
+        the stages they need run """
+
+    deps = dict((name, stageDeps) for name, function, stageDeps
+                in BLDG_STAGES)
+    needed = set()
+    todo = ['models'] + list(outputs)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(deps[name])
+
+    return needed
+
+
+class StageError(Exception):
+    """ Raised for a building failing at a stage, with the stage's name & the
+        error it raised """
+
+    def __init__(self, stage, error):
+        Exception.__init__(self, '%s: %r' % (stage, error))
+        self.stage = stage
+        self.error = error
+
+
+def run_stages(run, bldgID, bldg, done, save=None, outputs=REPORTS):
+    """ Pass an object with the client & urls of a CheckpointedRun, a building
+        ID & object & a dictionary of the results of the building's stages
+        done, & optionally the names of the REPORTS wanted; run the stages
+        not done that the reports need, adding their results to the
+        dictionary & passing each stage's name & result to save. Return the
+        dictionary, raising StageError if a stage fails """
+
+    needed = needed_stages(outputs)
+    for name, function, deps in BLDG_STAGES:
+        if 'models' in done and done['models'] is None:
+            break
+        if name in done or name not in needed:
+            continue
+        try:
+            result = function(run, bldgID, bldg, done)
+        except Exception as error:
+            raise StageError(name, error)
+        if save is not None:
+            save(name, result)
+        done[name] = result
+
+    return done
+
+
+def merge_reports(bldgResults, outputs=REPORTS):
+    """ Pass an iterable of dictionaries of the results of each building's
+        stages, & optionally the names of the REPORTS wanted; return a
+        dictionary of the site's reports, merged from the buildings whose
+        stages are all done, with the names of the reports as keys """
+
+    results = []
+    reports = dict((name, {}) for name in outputs if name != 'results')
+    for done in bldgResults:
+        if not all(name in done for name in outputs):
+            continue
+        if 'results' in outputs:
+            results.append(done['results'])
+        for name in reports:
+            reports[name].update(done[name])
+    if 'results' in outputs:
+        reports['results'] = (pd.concat(results, ignore_index=True)
+                              if results
+                              else ams.amsaves_results({}, {}, {}))
+
+    return reports
+
+
+class CheckpointedRun(object):
+    """ Pass a DeltaMeterClient, a dictionary of end-point URLs with the
+        names of deltamtrsvs.URL_NAMES as keys (see pipeline.config_urls),
+        a CheckpointStore & optionally the number of buildings to run at
+        once & the names of the REPORTS to make, running only the stages
+        they need """
+
+    def __init__(self, client, urls, store, max_workers=None,
+                 outputs=REPORTS):
+        self.client = client
+        self.urls = urls
+        self.store = store
+        self.max_workers = max_workers
+        self.outputs = outputs
+
+    def _run_bldg(self, site, bldgID, bldg):
+        """ Run the stages of a building not already done, keeping each
+            result; return True if every stage is done """
+
+        save = lambda name, result: self.store.save(site, bldgID, name,
+                                                    result)
+        try:
+            run_stages(self, bldgID, bldg, self.store.load(site, bldgID),
+                       save, self.outputs)
+        except StageError as error:
+            self.store.fail(site, bldgID, error.stage, error.error)
+            return False
+        self.store.succeed(site, bldgID)
+
+        return True
+
+    def run(self, site, resume=True):
+        """ Pass a site & whether to resume from the results kept of earlier
+            runs, rather than start over; run every building's stages not
+            already done & return the site's reports (see reports) """
+
+        if not resume:
+            self.store.clear(site)
+        bldgIDct = self.store.load(site).get('bldgs')
+        if bldgIDct is None:
+            bldgIDct = self.client.get_property_bldgs(
+                                   self.urls['properties_url'], site)
+            self.store.save(site, SITE_KEY, 'bldgs', bldgIDct)
+
+        run = lambda bldgID: self._run_bldg(site, bldgID, bldgIDct[bldgID])
+        bldgIDs = sorted(bldgIDct)
+        if not self.max_workers or len(bldgIDs) < 2:
+            for bldgID in bldgIDs:
+                run(bldgID)
+        else:
+            pool = ThreadPool(min(self.max_workers, len(bldgIDs)))
+            try:
+                pool.map(run, bldgIDs)
+            finally:
+                pool.close()
+                pool.join()
+
+        return self.reports(site)
+
+    def reports(self, site):
+        """ Pass a site; return a dictionary of its reports, merged from the
+            buildings done, with the names of the run's outputs as keys, &
+            the failures of the buildings not done with the key 'failed'
+            (see CheckpointStore.failures) """
+
+        bldgIDct = self.store.load(site).get('bldgs') or {}
+        failed = self.store.failures(site)
+        reports = merge_reports((self.store.load(site, bldgID)
+                                 for bldgID in sorted(bldgIDct)
+                                 if bldgID not in failed), self.outputs)
+        reports['failed'] = failed
+
+        return reports
@@ -15,152 +15,954 @@ __license__ = "GNU Affero (GPLv3)"
         Each function will return a single data structure containing objects
         and IDs; typically a dictionary with IDs as keys """
 
+from collections import defaultdict
+import codecs
+from contextlib import contextmanager
+import datetime
+import json
+import re
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from multiprocessing.pool import ThreadPool
+import threading
+
+from scheduler import RETRY_STATUSES
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+# The attributes of the private module holding the end-point URLs used by
+# the functions of this module
+URL_NAMES = ['properties_url', 'model_url', 'comparison_url', 'audit_url',
+             'fv_charts_url', 'bldg_meters_url', 'meter_records_url']
+# Meter records are ordered & bounded by the date of each reading
+RECORD_DATE_KEY = 'PeriodStartDate'
+SPAN_KEYS = {'Electricity': ('E. Per. Begin', 'E. Per. End'),
+             'Gas': ('G. Per. Begin', 'G. Per. End')}
+RECORDS_KEYS = {'Electricity': 'Elec. Meter Records',
+                'Gas': 'Gas Meter Records'}
+# Bytes read at a time from the body of a streamed response
+STREAM_CHUNK_BYTES = 64*1024
+_SEPARATORS = re.compile(r'[\s,]*')
+_ITEM_ENDS = frozenset(' \t\r\n,]')
+
+
+def sort_models(jsonModels):
+    """ Pass the list of model objects returned for a building; return a
+        dictionary of the models with their model type as keys """
+
+    jsonModelsDct = {}
+    for jsonModel in jsonModels:
+        if 'Reference Model' in jsonModel['SolutionType']:
+            jsonModelsDct['Reference Model'] = jsonModel
+        elif 'Proposed Model' in jsonModel['SolutionType']:
+            jsonModelsDct['Proposed Model'] = jsonModel
+        else:
+            # TODO (eayoungs): Create & raise custom exception here
+            jsonModelsDct['Test'] = 'FAIL'
+
+    return jsonModelsDct
+
+
+def sort_meters(jsonBldgMeters):
+    """ Pass the list of meter objects returned for a building; return a
+        dictionary of the meters with the name of the fuel type (Electricity
+        or Gas) as keys """
+
+    meterReadingDct = {}
+    for jsonBldgMeter in jsonBldgMeters:
+        if jsonBldgMeter['MeterTypeID'] == 1:
+            meterReadingDct['Electricity'] = jsonBldgMeter
+        elif jsonBldgMeter['MeterTypeID'] == 2:
+            meterReadingDct['Gas'] = jsonBldgMeter
+
+    return meterReadingDct
+
+
+def comparison_endpoint(comparison_url, jsonModelsDct):
+    """ Pass a building's dictionary of models; return the end-point
+        comparing its reference & proposed models """
+
+    refModel = str(jsonModelsDct['Reference Model']['SolutionID'])
+    propModel = str(jsonModelsDct['Proposed Model']['SolutionID'])
+
+    return comparison_url + refModel + '/1/' + propModel + '/1/'
+
+
+def meter_record_endpoint(meter_records_url, meterID, begin, end):
+    """ Pass a meter ID & the dates bounding a span of readings; return the
+        end-point for the meter's records over that span """
+
+    return meter_records_url + meterID + '?start=' + begin + '&end=' + end
+
+
+def meter_sync_endpoint(meter_records_url, meterID, start):
+    """ Pass a meter ID & a date; return the end-point for the meter's
+        records since that date """
+
+    return meter_records_url + meterID + '?start=' + start
+
+
+def bldg_audit_spans(auditSpans, refModelsDct):
+    """ Pass the date ranges from amsaves_usage_range function, keyed by model
+        ID, & the dictionary of reference models they were requested for,
+        keyed by building ID; return the date ranges keyed by building ID """
+
+    bldgSpans = {}
+    for bldgID, refModel in refModelsDct.items():
+        modelID = str(refModel['SolutionID'])
+        if modelID in auditSpans:
+            bldgSpans[bldgID] = auditSpans[modelID]
+
+    return bldgSpans
+
+
+def match_bldg_spans(auditSpans, bldgMeterDct, refModelsDct=None):
+    """ Pass date ranges keyed by building ID, or keyed by model ID with the
+        reference models they were requested for (see bldg_audit_spans), &
+        the meters of each building; return the date ranges keyed by
+        building ID. Raise ValueError if no range is keyed by a building of
+        the meters, e.g. for the model IDs of amsaves_usage_range without
+        the reference models """
+
+    if refModelsDct is not None:
+        return bldg_audit_spans(auditSpans, refModelsDct)
+    if auditSpans and bldgMeterDct and \
+       not set(auditSpans) & set(bldgMeterDct):
+        raise ValueError('No date range is keyed by the ID of a building '
+                         'with meters; pass the reference models of ranges '
+                         'keyed by model ID')
+
+    return auditSpans
+
+
+def split_window(begin, end, chunk_days=None):
+    """ Pass the dates bounding a span of readings; return a list of date
+        pairs covering the span in parts of at most chunk_days """
+
+    if not chunk_days:
+        return [(begin, end)]
+
+    start = datetime.datetime.strptime(begin, DATE_FORMAT)
+    stop = datetime.datetime.strptime(end, DATE_FORMAT)
+    step = datetime.timedelta(days=chunk_days)
+    chunks = []
+    while start + step < stop:
+        chunks.append((start.strftime(DATE_FORMAT),
+                       (start + step).strftime(DATE_FORMAT)))
+        start += step
+    chunks.append((start.strftime(DATE_FORMAT), end))
+
+    return chunks
+
+
+def meter_spans(bldgMeterDct, bldgSpans=None):
+    """ Pass the meters of each building & optionally their date ranges, both
+        keyed by building ID (see match_bldg_spans); yield a (building ID,
+        records key, meter ID, begin, end) tuple per meter, with begin & end
+        None for the whole history without date ranges. Buildings without a
+        range & fuels without both of its dates, e.g. the 0 of a model
+        without gas, are left out """
+
+    for bldgID, bldgMeter in bldgMeterDct.items():
+        span = {} if bldgSpans is None else bldgSpans.get(bldgID)
+        if span is None:
+            continue
+        for fuel, meter in bldgMeter.items():
+            beginKey, endKey = SPAN_KEYS[fuel]
+            begin = span.get(beginKey)
+            end = span.get(endKey)
+            if bldgSpans is not None and (not begin or not end):
+                continue
+            yield (bldgID, RECORDS_KEYS[fuel], str(meter['MeterID']), begin,
+                   end)
+
+
+def plan_meter_records(bldgSpans, bldgMeterDct, chunk_days=None):
+    """ Pass the date ranges & meters of each building, keyed by building ID;
+        return a list of (meter ID, chunks, members) tuples with one entry
+        per meter & merged date range, where chunks lists the date pairs to
+        request & members lists the (begin, end, building ID, records key)
+        ranges of the buildings served by them """
+
+    meterWindows = defaultdict(list)
+    for bldgID, recordsKey, meterID, begin, end in meter_spans(bldgMeterDct,
+                                                               bldgSpans):
+        meterWindows[meterID].append((begin, end, bldgID, recordsKey))
+
+    plan = []
+    for meterID, windows in meterWindows.items():
+        merged = []
+        for window in sorted(windows):
+            begin, end = window[:2]
+            if merged and begin <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+                merged[-1][2].append(window)
+            else:
+                merged.append([begin, end, [window]])
+        for begin, end, members in merged:
+            plan.append((meterID, split_window(begin, end, chunk_days),
+                         members))
+
+    return plan
+
+
+def meter_record_requests(plan):
+    """ Pass the result of plan_meter_records; return a list of the (meter ID,
+        begin, end, building ID) requests it calls for """
+
+    return [(meterID, begin, end, members[0][2]) for meterID, chunks, members
+            in plan for begin, end in chunks]
+
+
+def assemble_meter_records(plan, fetched):
+    """ Pass the result of plan_meter_records & a dictionary of the records
+        fetched for each of its requests; return a dictionary of dictionaries
+        containing meter readings for each fuel with building IDs as keys """
+
+    bldgMeterRecordsDct = {}
+    for meterID, chunks, members in plan:
+        records = []
+        for begin, end in chunks:
+            chunkRecords = fetched[(meterID, begin, end, members[0][2])]
+            if records:
+                # Readings on the boundary of two parts may be in both
+                lastDate = records[-1][RECORD_DATE_KEY]
+                chunkRecords = [record for record in chunkRecords
+                                if record[RECORD_DATE_KEY] > lastDate]
+            records.extend(chunkRecords)
+
+        for begin, end, bldgID, recordsKey in members:
+            if len(members) > 1:
+                bldgRecords = [record for record in records
+                               if begin <= record[RECORD_DATE_KEY] <= end]
+            else:
+                bldgRecords = records
+            bldgMeterRecordsDct.setdefault(bldgID, {})[recordsKey] = \
+                                                                  bldgRecords
+
+    return bldgMeterRecordsDct
+
+
+def iter_json_array(chunks):
+    """ Pass an iterable of the byte strings making up a .JSON array, e.g.
+        the body of a streamed response; yield the items of the array one at
+        a time as they are decoded, without decoding the whole array. An
+        empty body yields nothing """
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    text = u''
+    opened = False
+    for chunk in chunks:
+        text += utf8.decode(chunk)
+        pos = _SEPARATORS.match(text).end()
+        if not opened and pos < len(text):
+            if text[pos] != '[':
+                raise ValueError('Expecting a .JSON array')
+            opened = True
+            pos = _SEPARATORS.match(text, pos + 1).end()
+        while opened and pos < len(text) and text[pos] != ']':
+            try:
+                item, end = decoder.raw_decode(text, pos)
+            except ValueError:
+                # The rest of the item is in the next chunk
+                break
+            if end == len(text) or text[end] not in _ITEM_ENDS:
+                # A number may continue in the next chunk
+                break
+            yield item
+            pos = _SEPARATORS.match(text, end).end()
+        if opened and pos < len(text) and text[pos] == ']':
+            return
+        text = text[pos:]
+
+    if opened:
+        raise ValueError('Invalid or unterminated .JSON array')
+
+
+class InvalidComparison(ValueError):
+    """ Raised for a building whose models the API cannot compare, with the
+        building ID & comparison end-point """
+
+    def __init__(self, bldgID, url, reason):
+        ValueError.__init__(self, 'Invalid comparison for building %s at %s: '
+                            '%s' % (bldgID, url, reason))
+        self.bldgID = bldgID
+        self.url = url
+
+
+def request_event(url, endpoint, start, response, cache, size=None,
+                  error=None):
+    """ Pass an end-point URL & name, the time a request was started, its
+        response or None, its cache outcome & optionally the bytes received
+        & the error it raised; return the dictionary describing the request
+        passed to a client's hooks (see DeltaMeterClient) """
+
+    return {'endpoint': endpoint or 'other',
+            'url': url,
+            'status': (response.status_code if response is not None
+                       else None),
+            'latency': time.time() - start,
+            'bytes': (size if size is not None else
+                      len(response.content) if response is not None else 0),
+            'cache': cache,
+            'retries': getattr(response if response is not None else error,
+                               'retries', 0)}
+
+
+class _InFlight(object):
+    """ A request in progress, shared by every caller asking for its URL """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+class DeltaMeterClient(object):
+    """ Holds a pooled, keep-alive session with the headers & base URL for
+        the DeltaMeter Services API; each method encapsulates the end-point
+        of the module function of the same name, so connections are reused
+        across every building & model requested through one client.
+        Concurrent requests for the same URL share one response; with
+        memoize set, each distinct URL is requested at most once over the
+        life of the client (e.g. one report run). Pass a ResponseCache from
+        the respcache module to keep responses across runs, & a
+        RequestScheduler from the scheduler module to limit, retry & adapt
+        the concurrency of requests. Each hook, e.g. an EndpointMetrics
+        object of the metrics module, is called after every request with a
+        dictionary of its endpoint name, url, status (None on a connection
+        error), latency in seconds, response bytes, cache outcome ('hit',
+        'revalidated', 'miss' or None without a cache) & retries """
+
+    def __init__(self, headers, base_url='', pool_maxsize=10, memoize=False,
+                 cache=None, scheduler=None, hooks=None):
+        self.headers = headers
+        self.base_url = base_url
+        self.memoize = memoize
+        self.cache = cache
+        self.scheduler = scheduler
+        self.hooks = list(hooks or [])
+        self._responses = {}
+        # The end-point name & tag of each memoized response, by URL
+        self._memoKeys = {}
+        self._inFlight = {}
+        self._pools = {}
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=pool_maxsize,
+                              pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Release the pooled connections held by the session & the threads
+            of the client's fan-outs """
+
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+            pool.join()
+        self.session.close()
+
+    def forget(self, url=None):
+        """ Drop the memoized response for a URL, or for every URL """
+
+        with self._lock:
+            if url is None:
+                self._responses.clear()
+                self._memoKeys.clear()
+            else:
+                self._responses.pop(url, None)
+                self._memoKeys.pop(url, None)
+
+    def invalidate(self, url=None, tag=None, endpoint=None):
+        """ Drop the cached & memoized responses matching an end-point URL,
+            tag (the building ID the response belongs to) or end-point name,
+            or every response if none are given, e.g. invalidate(tag=bldgID)
+            to refresh a single building """
+
+        with self._lock:
+            urls = [memoURL for memoURL, (memoEndpoint, memoTag)
+                    in self._memoKeys.items()
+                    if url in (None, memoURL) and tag in (None, memoTag)
+                    and endpoint in (None, memoEndpoint)]
+        if self.cache is not None:
+            urls.extend(self.cache.invalidate(url, tag, endpoint))
+        for url in urls:
+            self.forget(url)
+
+    def _send(self, url, **kwargs):
+        """ Send a GET request for an end-point URL over the pooled session,
+            through the scheduler when the client has one """
+
+        send = lambda: self.session.get(self.base_url + url, **kwargs)
+        if self.scheduler is None:
+            return send()
+
+        return self.scheduler.call(send)
+
+    def _report(self, url, endpoint, start, response, cache, size=None,
+                error=None):
+        """ Call the client's hooks with the description of a request """
+
+        event = request_event(url, endpoint, start, response, cache, size,
+                              error)
+        for hook in self.hooks:
+            hook(event)
+
+    def _request(self, url, endpoint=None, tag=None):
+        """ Request a single end-point URL, reporting it to the client's
+            hooks when there are any """
+
+        if not self.hooks:
+            return self._fetch(url, endpoint, tag)[0]
+
+        start = time.time()
+        try:
+            response, cache = self._fetch(url, endpoint, tag)
+        except Exception as error:
+            self._report(url, endpoint, start,
+                         getattr(error, 'response', None),
+                         None if self.cache is None else 'miss', error=error)
+            raise
+        self._report(url, endpoint, start, response, cache)
+
+        return response
+
+    def _fetch(self, url, endpoint=None, tag=None):
+        """ Request a single end-point URL over the pooled session; answer
+            from the cache while the cached response is fresh, revalidating
+            it with the server once it is not. Return the response & the
+            cache outcome """
+
+        if self.cache is None:
+            return self._send(url), None
+
+        cached, fresh = self.cache.lookup(url)
+        if fresh:
+            return cached, 'hit'
+
+        validators = {}
+        if cached is not None:
+            if 'ETag' in cached.headers:
+                validators['If-None-Match'] = cached.headers['ETag']
+            if 'Last-Modified' in cached.headers:
+                validators['If-Modified-Since'] = \
+                                               cached.headers['Last-Modified']
+        response = self._send(url, headers=validators)
+        if response.status_code == 304 and cached is not None:
+            self.cache.refresh(url)
+            return cached, 'revalidated'
+        if response.ok:
+            self.cache.store(url, response, endpoint, tag)
+
+        return response, 'miss'
+
+    def _get(self, url, endpoint=None, tag=None):
+        """ Request a single end-point URL, joining an identical request
+            already in flight rather than repeating it; the end-point name &
+            tag select the time-to-live & invalidation group of a cached
+            response """
+
+        with self._lock:
+            if url in self._responses:
+                return self._responses[url]
+            call = self._inFlight.get(url)
+            if call is not None:
+                leader = False
+            else:
+                leader = True
+                call = self._inFlight[url] = _InFlight()
+
+        if not leader:
+            return call.wait()
+
+        try:
+            call.response = self._request(url, endpoint, tag)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._inFlight[url]
+                if self.memoize and call.error is None and \
+                   call.response.status_code not in RETRY_STATUSES:
+                    self._responses[url] = call.response
+                    self._memoKeys[url] = (endpoint, tag)
+            call.done.set()
+
+        return call.response
+
+    def _iter(self, url, endpoint=None, tag=None):
+        """ Request a single end-point URL returning a .JSON array; yield the
+            items of the array as its body arrives. Responses kept by the
+            cache or memoized are requested in full, as by _get. Raise
+            HTTPError for a failed response rather than decode its body """
+
+        if self.cache is not None or self.memoize:
+            response = self._get(url, endpoint, tag)
+            response.raise_for_status()
+            for item in iter_json_array([response.content]):
+                yield item
+            return
+
+        start = time.time()
+        response = None
+        try:
+            response = self._send(url, stream=True)
+            response.raise_for_status()
+        except Exception as error:
+            if response is not None:
+                response.close()
+            if self.hooks:
+                self._report(url, endpoint, start,
+                             getattr(error, 'response', None), None,
+                             error=error)
+            raise
+        sizes = []
+
+        def chunks():
+            for chunk in response.iter_content(STREAM_CHUNK_BYTES):
+                sizes.append(len(chunk))
+                yield chunk
+
+        try:
+            for item in iter_json_array(chunks()):
+                yield item
+        finally:
+            response.close()
+            if self.hooks:
+                self._report(url, endpoint, start, response, None,
+                             sum(sizes))
+
+    def get_property_bldgs(self, properties_url, site):
+        """ See get_property_bldgs """
+
+        bldgIDct = {}
+        properties_endpt = properties_url + site
+        bldgs = self._get(properties_endpt, 'properties').json()
+        for bldg in bldgs:
+            bldgIDct[str(bldg['BuildingID'])] = bldg
+
+        return bldgIDct
+
+    def _fan_out(self, fetch, ids, max_workers=None):
+        """ Apply a per-ID fetch function to each ID; return (ID, result)
+            pairs in the order given, running the requests on a bounded pool
+            of threads when max_workers is set. The pool of each size is
+            made once & kept until the client is closed """
+
+        ids = list(ids)
+        if not max_workers or len(ids) < 2:
+            return [(objID, fetch(objID)) for objID in ids]
+
+        with self._lock:
+            pool = self._pools.get(max_workers)
+            if pool is None:
+                pool = self._pools[max_workers] = ThreadPool(max_workers)
+
+        return list(zip(ids, pool.map(fetch, ids, chunksize=1)))
+
+    def _bldg_models(self, model_url, bldgID):
+        """ Request the models for one building; return a dictionary of model
+            objects keyed by model type, or None if there are no models """
+
+        models = self._get(model_url + bldgID, 'models', bldgID)
+        if not models:
+            return None
+
+        return sort_models(models.json())
+
+    def get_bldg_models(self, model_url, bldgIDs, max_workers=None):
+        """ See get_bldg_models """
+
+        bldgModelsDct = {}
+        fetch = lambda bldgID: self._bldg_models(model_url, bldgID)
+        for bldgID, jsonModelsDct in self._fan_out(fetch, bldgIDs,
+                                                   max_workers):
+            if jsonModelsDct is not None:
+                bldgModelsDct[bldgID] = jsonModelsDct
+
+        return bldgModelsDct
+
+    def _model_comparison(self, comparison_url, bldgID, jsonModelsDct):
+        """ Request the comparison of a building's reference & proposed
+            models """
+
+        comparison_endpt = comparison_endpoint(comparison_url, jsonModelsDct)
+        response = self._get(comparison_endpt, 'comparisons', bldgID)
+        try:
+            if not response.ok:
+                raise ValueError('status %d' % response.status_code)
+            return response.json()
+        except ValueError as error:
+            raise InvalidComparison(bldgID, comparison_endpt, error)
+
+    def get_model_comparisons(self, comparison_url, bldgModelsDct,
+                              max_workers=None):
+        """ See get_model_comparisons """
+
+        fetch = lambda key: self._model_comparison(comparison_url, key,
+                                                   bldgModelsDct[key])
+        return dict(self._fan_out(fetch, bldgModelsDct.keys(), max_workers))
+
+    def get_model_audits(self, audit_url, bldgModelsDct, max_workers=None):
+        """ See get_model_audits """
+
+        def fetch(key):
+            modelID = str(bldgModelsDct[key]['SolutionID'])
+            return modelID, self._get(audit_url + modelID, 'audits',
+                                      key).json()
+
+        return dict(audit for key, audit in
+                    self._fan_out(fetch, bldgModelsDct.keys(), max_workers))
+
+    def iter_model_audits(self, audit_url, modelID, bldgID=None):
+        """ See iter_model_audits """
+
+        return self._iter(audit_url + modelID, 'audits', bldgID)
+
+    def stream_model_audits(self, audit_url, bldgModelsDct):
+        """ See stream_model_audits """
+
+        audits = {}
+        for key, model in bldgModelsDct.items():
+            modelID = str(model['SolutionID'])
+            audits[modelID] = self.iter_model_audits(audit_url, modelID, key)
+
+        return audits
+
+    def _fv_chart(self, fv_charts_url, bldgID):
+        """ Request the FirstView chart for one building; return None if the
+            building has no chart """
+
+        fvChart = self._get(fv_charts_url + bldgID, 'fv_charts', bldgID)
+        if not fvChart:
+            return None
+
+        return fvChart.json()
+
+    def get_fv_charts(self, fv_charts_url, bldgIDs, max_workers=None):
+        """ See get_fv_charts """
+
+        fvCharts = {}
+        fetch = lambda bldgID: self._fv_chart(fv_charts_url, bldgID)
+        for bldgID, jsonFvChart in self._fan_out(fetch, bldgIDs,
+                                                 max_workers):
+            if jsonFvChart is not None:
+                fvCharts[bldgID] = jsonFvChart
+
+        return fvCharts
+
+    def _bldg_meters(self, bldg_meters_url, bldgID):
+        """ Request the meters of one building; return a dictionary of meter
+            objects keyed by fuel type """
+
+        return sort_meters(self._get(bldg_meters_url + bldgID, 'meters',
+                                     bldgID).json())
+
+    def get_bldg_meters(self, bldg_meters_url, bldgIDs, max_workers=None):
+        """ See get_bldg_meters """
+
+        fetch = lambda bldgID: self._bldg_meters(bldg_meters_url, bldgID)
+        return dict(self._fan_out(fetch, bldgIDs, max_workers))
+
+    def get_meter_records(self, auditSpans, bldgMeterDct, meter_records_url,
+                          refModelsDct=None, max_workers=None,
+                          chunk_days=None):
+        """ See get_meter_records """
+
+        plan = plan_meter_records(match_bldg_spans(auditSpans, bldgMeterDct,
+                                                   refModelsDct),
+                                  bldgMeterDct, chunk_days)
+
+        def fetch(request):
+            meterID, begin, end, bldgID = request
+            return self._get(meter_record_endpoint(meter_records_url, meterID,
+                                                   begin, end),
+                             'meter_records', bldgID).json()
+
+        fetched = dict(self._fan_out(fetch, meter_record_requests(plan),
+                                     max_workers))
+
+        return assemble_meter_records(plan, fetched)
+
+    def iter_meter_records(self, meter_records_url, meterID, begin, end,
+                           chunk_days=None, bldgID=None):
+        """ See iter_meter_records """
+
+        lastDate = None
+        for chunkBegin, chunkEnd in split_window(begin, end, chunk_days):
+            # Readings on the boundary of two parts may be in both
+            boundary = lastDate
+            for record in self._iter(meter_record_endpoint(
+                                     meter_records_url, meterID, chunkBegin,
+                                     chunkEnd), 'meter_records', bldgID):
+                if boundary is not None and \
+                   record[RECORD_DATE_KEY] <= boundary:
+                    continue
+                lastDate = record[RECORD_DATE_KEY]
+                yield record
+
+    def stream_meter_records(self, auditSpans, bldgMeterDct,
+                             meter_records_url, refModelsDct=None,
+                             chunk_days=None):
+        """ See stream_meter_records """
+
+        auditSpans = match_bldg_spans(auditSpans, bldgMeterDct, refModelsDct)
+
+        bldgMeterRecordsDct = {}
+        for bldgID, recordsKey, meterID, begin, end in meter_spans(
+                                                       bldgMeterDct,
+                                                       auditSpans):
+            bldgMeterRecordsDct.setdefault(bldgID, {})[recordsKey] = \
+                self.iter_meter_records(meter_records_url, meterID, begin,
+                                        end, chunk_days, bldgID)
+
+        return bldgMeterRecordsDct
+
+    def sync_meter_records(self, bldgMeterDct, meter_records_url, store,
+                           start, max_workers=None):
+        """ See sync_meter_records """
+
+        meterIDs = set()
+        for bldgMeter in bldgMeterDct.values():
+            for meter in bldgMeter.values():
+                meterIDs.add(str(meter['MeterID']))
+
+        def fetch(meterID):
+            since = store.watermark(meterID) or start
+            response = self._get(meter_sync_endpoint(meter_records_url,
+                                                     meterID, since),
+                                 'meter_sync')
+            # A failed response must not advance the meter's watermark
+            response.raise_for_status()
+            return store.append(meterID, response.json())
+
+        return dict(self._fan_out(fetch, sorted(meterIDs), max_workers))
+
+
+_clients = {}
+# The memoizing clients of the memoized_run in progress, if any
+_runClients = None
+_clientsLock = threading.Lock()
+_cache = None
+_scheduler = None
+_hooks = []
+
+
+def _client(headers):
+    """ Return the shared client for a set of API headers, so the module
+        functions reuse one pooled session per set of credentials """
+
+    key = tuple(sorted(headers.items()))
+    with _clientsLock:
+        clients = _clients if _runClients is None else _runClients
+        if key not in clients:
+            clients[key] = DeltaMeterClient(headers,
+                                            memoize=_runClients is not None,
+                                            cache=_cache,
+                                            scheduler=_scheduler,
+                                            hooks=_hooks)
+        return clients[key]
+
+
+def _all_clients():
+    return list(_clients.values()) + list((_runClients or {}).values())
+
+
+@contextmanager
+def memoized_run():
+    """ Within the block, the module functions request each distinct URL at
+        most once, e.g. the models of a building asked for by several
+        reports of one run; the responses are dropped at the end of the
+        block. Blocks within a block share the outer block's responses """
+
+    global _runClients
+    with _clientsLock:
+        outer = _runClients is not None
+        if not outer:
+            _runClients = {}
+    try:
+        yield
+    finally:
+        if not outer:
+            with _clientsLock:
+                clients, _runClients = _runClients, None
+            for client in clients.values():
+                client.close()
+
+
+def use_cache(cache):
+    """ Pass a ResponseCache from the respcache module (or None to stop
+        caching); the module functions will answer from it while its
+        responses are fresh """
+
+    global _cache
+    with _clientsLock:
+        _cache = cache
+        for client in _all_clients():
+            client.cache = cache
+
+
+def use_scheduler(scheduler):
+    """ Pass a RequestScheduler from the scheduler module (or None to stop
+        scheduling); every request of the module functions will be limited,
+        retried & adapted by it, across every set of headers """
+
+    global _scheduler
+    with _clientsLock:
+        _scheduler = scheduler
+        for client in _all_clients():
+            client.scheduler = scheduler
+
+
+def use_hooks(hooks):
+    """ Pass a list of hooks, e.g. an EndpointMetrics object of the metrics
+        module, (or an empty list to stop reporting); each is called after
+        every request of the module functions (see DeltaMeterClient) """
+
+    global _hooks
+    with _clientsLock:
+        _hooks = list(hooks)
+        for client in _all_clients():
+            client.hooks = list(_hooks)
 
 
 def get_property_bldgs(properties_url, site, headers):
     """ Pass an API URL, property ID; return a list of building IDs for the
         property """
-    
-    bldgIDct = {}
-    properties_endpt = properties_url + site
-    bldgs = requests.get(properties_endpt, headers=headers).json()
-    for bldg in bldgs:
-        bldgIDct[str(bldg['BuildingID'])] = bldg
 
-    return bldgIDct
+    return _client(headers).get_property_bldgs(properties_url, site)
 
 
-def get_bldg_models(model_url, bldgIDs, headers):
+def get_bldg_models(model_url, bldgIDs, headers, max_workers=None):
     """ Pass a list of building IDs; return a dictionary of with building IDs
         as keys and dictionaries containing model objects in .JSON format,
         having descriptive keys describing the model type contained within """ 
 
-    bldgModelsDct = {}
-    for bldgID in bldgIDs:
-        model_endpt = model_url + bldgID
-        models = requests.get(model_endpt, headers=headers)
-        if requests.get(model_endpt, headers=headers):
-            jsonModels = models.json()
-            jsonModelsDct = {}
-            for jsonModel in jsonModels:
-                if 'Reference Model' in jsonModel['SolutionType']:
-                    jsonModelsDct['Reference Model'] = jsonModel
-                elif 'Proposed Model' in jsonModel['SolutionType']:
-                    jsonModelsDct['Proposed Model'] = jsonModel
-                else:
-                    # TODO (eayoungs): Create & raise custom exception here
-                    jsonModelsDct['Test'] = 'FAIL'
-            bldgModelsDct[bldgID] = jsonModelsDct
-
-    return bldgModelsDct
-
-
-def get_model_comparisons(comparison_url, bldgModelsDct, headers):
+    return _client(headers).get_bldg_models(model_url, bldgIDs, max_workers)
+
+
+def get_model_comparisons(comparison_url, bldgModelsDct, headers,
+                          max_workers=None):
     """ Pass a list of models' data in .JSON format, return model IDs &
         comparisons's data in .JSON format """
 
-    modelIDs = []
-    comparisonsDct = {}
-    for key, value in bldgModelsDct.iteritems():
-        jsonModelsDct = value
-        refModel = str(jsonModelsDct['Reference Model']['SolutionID'])
-        propModel = str(jsonModelsDct['Proposed Model']['SolutionID'])
-        comparison_endpt = comparison_url + refModel +'/1/' + propModel + '/1/'
-            # TODO (eayoungs): Add error msgs. & exception handling to account
-            #                  for invalid comparisons
-        comparison = requests.get(comparison_endpt, headers=headers)
-        comparisonsDct[key] = comparison.json()
-
-    return comparisonsDct 
+    return _client(headers).get_model_comparisons(comparison_url,
+                                                  bldgModelsDct, max_workers)
 
 
-def get_model_audits(audit_url, bldgModelsDct, headers):
+def get_model_audits(audit_url, bldgModelsDct, headers, max_workers=None):
     """ Pass a dictionary of building models; return a dictionary of audit
         models with model IDs as keys """
 
-    modelsIdDct = {}
-    for key, value in bldgModelsDct.iteritems():
-        modelsIdDct[key] = str(value['SolutionID'])
+    return _client(headers).get_model_audits(audit_url, bldgModelsDct,
+                                             max_workers)
 
-    audits = {}
-    for key, value in modelsIdDct.iteritems():
-        modelID = value
-        audit_endpt = audit_url + modelID 
-        audits[modelID] = requests.get(audit_endpt, headers=headers).json()
 
-    return audits
+def iter_model_audits(audit_url, modelID, headers):
+    """ Pass a model ID; return a generator of the model's audit periods in
+        .JSON format, decoded one at a time as the response arrives """
 
+    return _client(headers).iter_model_audits(audit_url, modelID)
 
-def get_fv_charts(fv_charts_url, bldgIDs, headers):
+
+def stream_model_audits(audit_url, bldgModelsDct, headers):
+    """ Pass a dictionary of building models; return a dictionary with model
+        IDs as keys, as from get_model_audits, but of generators of each
+        model's audit periods, each requested only once iterated. Pass the
+        dictionary to amsaves_usage_range to read every audit without holding
+        them all in memory """
+
+    return _client(headers).stream_model_audits(audit_url, bldgModelsDct)
+
+
+def get_fv_charts(fv_charts_url, bldgIDs, headers, max_workers=None):
     """ Pass a URL, a list of building ID's and required API header; return a
         list of FirstView chart objects """
 
-    fvCharts = {}
-    for bldgID in bldgIDs:
-        fv_chart_url = fv_charts_url + bldgID
-        if requests.get(fv_chart_url, headers=headers):
-            fvChart = requests.get(fv_chart_url, headers=headers)
-            jsonFvChart = fvChart.json()
-            fvCharts[bldgID] = jsonFvChart
+    return _client(headers).get_fv_charts(fv_charts_url, bldgIDs,
+                                          max_workers)
 
-    return fvCharts
 
-
-def get_bldg_meters(bldg_meters_url, bldgIDs, headers):
+def get_bldg_meters(bldg_meters_url, bldgIDs, headers, max_workers=None):
     """ Takes a list of building ID numbers; returns a dictionary with
         building IDs as keys and dictionaries of meter objects with the name
         of the fuel type (Electricity or Gas) as keys """
 
-    meterReadingDct = {}
-    bldgMeterDct = {}
-    for bldgID in bldgIDs:
-        bldg_meter_url = bldg_meters_url + bldgID
-        bldgMeters = requests.get(bldg_meter_url, headers=headers)
-        jsonBldgMeters = bldgMeters.json()
-
-        for jsonBldgMeter in jsonBldgMeters:
-            if jsonBldgMeter['MeterTypeID'] == 1:
-                meterReadingDct['Electricity'] = jsonBldgMeter
-            elif jsonBldgMeter['MeterTypeID'] == 2:
-                meterReadingDct['Gas'] = jsonBldgMeter
+    return _client(headers).get_bldg_meters(bldg_meters_url, bldgIDs,
+                                            max_workers)
 
-        bldgMeterDct[bldgID] = meterReadingDct
 
-    return bldgMeterDct
-
-
-def get_meter_records(auditSpans, bldgMeterDct, meter_records_url, headers):
+def get_meter_records(auditSpans, bldgMeterDct, meter_records_url, headers,
+                      refModelsDct=None, max_workers=None, chunk_days=None):
     """ Takes a dictionary of date ranges from amsaves_usage_range function
         and dictionary of meter objects from get_building_meters function;
         returns a dictionary of dictionaries containing meter readings for
-        each fuel (electric & gas) with building IDs as keys """
-
-    bldgMeterRecordsDct = {}
-    for key, value in auditSpans.iteritems():
-        elecBegin = value['E. Per. Begin']
-        elecEnd = value['E. Per. End']
-        if len(value) == 4:
-            gasBegin = value['G. Per. Begin']
-            gasEnd = value['G. Per. End']
-
-        metersRecordsDct = {}
-        for key, value in bldgMeterDct.iteritems():
-            bldgID = key
-            bldgMeter = value
-            elecMeterID = str(bldgMeter['Electricity']['MeterID'])
-            elecMeter_record_url = meter_records_url + elecMeterID + \
-                                   '?start=' + elecBegin + '&end=' + elecEnd
-            elecMeterRecords = requests.get(elecMeter_record_url, \
-                                            headers=headers)
-            metersRecordsDct['Elec. Meter Records'] = elecMeterRecords.json()
-            if len(bldgMeter) == 2:
-                elecMeterID = str(bldgMeter['Gas']['MeterID'])
-                gasMeter_record_url = meter_records_url + elecMeterID + '\
-                                          start=' + gasBegin + '&end=' + gasEnd
-                gasMeterRecords = requests.get(gasMeter_record_url, \
-                                               headers=headers)
-                metersRecordsDct['Gas Meter Records'] = gasMeterRecords.json()
-            bldgMeterRecordsDct[bldgID] = metersRecordsDct
-
-    return bldgMeterRecordsDct
+        each fuel (electric & gas) with building IDs as keys. The date
+        ranges are paired with the building of the same ID, or, passing the
+        reference models the audits were requested for, with the building of
+        each model; ranges of amsaves_usage_range are keyed by model ID, so
+        need the reference models, & ValueError is raised if no range is
+        keyed by a building. Overlapping ranges on a meter are requested
+        once; ranges longer than chunk_days are requested in parts,
+        concurrently when max_workers is set """
+
+    return _client(headers).get_meter_records(auditSpans, bldgMeterDct,
+                                              meter_records_url, refModelsDct,
+                                              max_workers, chunk_days)
+
+
+def iter_meter_records(meter_records_url, meterID, begin, end, headers,
+                       chunk_days=None):
+    """ Pass a meter ID & the dates bounding a span of readings; return a
+        generator of the meter's readings over the span in .JSON format,
+        decoded one at a time as the response arrives. Spans longer than
+        chunk_days are requested in parts, one after another """
+
+    return _client(headers).iter_meter_records(meter_records_url, meterID,
+                                               begin, end, chunk_days)
+
+
+def stream_meter_records(auditSpans, bldgMeterDct, meter_records_url,
+                         headers, refModelsDct=None, chunk_days=None):
+    """ Takes the same date ranges & meter objects as get_meter_records;
+        returns a dictionary in the same form, but of generators of each
+        meter's readings, each requested only once iterated. Pass the
+        dictionary to amsaves_billing_rate to read every meter's history
+        without holding it all in memory """
+
+    return _client(headers).stream_meter_records(auditSpans, bldgMeterDct,
+                                                 meter_records_url,
+                                                 refModelsDct, chunk_days)
+
+
+def sync_meter_records(bldgMeterDct, meter_records_url, headers, store, start,
+                       max_workers=None):
+    """ Takes a dictionary of meter objects from get_bldg_meters function, a
+        MeterRecordStore from the meterstore module or a MeterSeriesStore
+        from the seriesstore module & the date to sync from for meters not
+        yet in the store; requests each meter's records since
+        its watermark, appends them to the store & returns a dictionary of
+        the number of records received with meter IDs as keys. Read the
+        records back with store.bldg_meter_records """
+
+    return _client(headers).sync_meter_records(bldgMeterDct,
+                                               meter_records_url, store,
+                                               start, max_workers)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides lazily imported modules, so the heavy dependencies
+    of the amsaves transforms (NumPy & pandas) are imported on their first
+    use rather than with every module referring to them, and processes that
+    only fetch from the API, or only parse their command line, start
+    without them.
+    Usage:
+        pd = LazyModule('pandas')
+        ...
+        pd.DataFrame(...)  # Imports pandas """
+
+import importlib
+
+
+class LazyModule(object):
+    """ Pass the name of a module; the module is imported on the first
+        access of one of its attributes """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            # The import lock makes the import once across threads
+            module = self.__dict__['_module'] = importlib.import_module(
+                                                self.__dict__['_name'])
+
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return '<LazyModule %r%s>' % (self.__dict__['_name'],
+                                      '' if self.__dict__['_module'] is None
+                                      else ' (imported)')
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides a local, SQLite backed store of meter readings from
+    the DeltaMeter Services API * deltameterservices.com *, kept up to date by
+    the sync_meter_records function of the deltamtrsvs module. Each meter
+    keeps a watermark; the date of the latest reading already fetched, so
+    later syncs request only the readings since then """
+
+import json
+import sqlite3
+import threading
+
+from deltamtrsvs import RECORD_DATE_KEY, meter_spans
+
+
+class MeterRecordStore(object):
+    """ Pass the path of the SQLite file to hold the meter readings """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS readings ('
+                             'meter_id TEXT, date TEXT, record TEXT, '
+                             'PRIMARY KEY (meter_id, date))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS watermarks ('
+                             'meter_id TEXT PRIMARY KEY, date TEXT)')
+
+    def close(self):
+        """ Close the SQLite file """
+
+        with self._lock:
+            self._db.close()
+
+    def watermark(self, meterID):
+        """ Pass a meter ID; return the date of its latest stored reading, or
+            None if none are stored """
+
+        with self._lock:
+            row = self._db.execute('SELECT date FROM watermarks '
+                                   'WHERE meter_id = ?', (meterID,)).fetchone()
+
+        return row[0] if row else None
+
+    def append(self, meterID, records):
+        """ Pass a meter ID & a list of its readings in .JSON format; store
+            the readings, replacing any of the same date, & advance the
+            meter's watermark; return the number of readings stored """
+
+        rows = [(meterID, record[RECORD_DATE_KEY], json.dumps(record))
+                for record in records]
+        if not rows:
+            return 0
+
+        latest = max(row[1] for row in rows)
+        with self._lock:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO readings '
+                                     'VALUES (?, ?, ?)', rows)
+                self._db.execute('INSERT OR REPLACE INTO watermarks VALUES '
+                                 '(?, MAX(?, COALESCE((SELECT date FROM '
+                                 'watermarks WHERE meter_id = ?), ?)))',
+                                 (meterID, latest, meterID, latest))
+
+        return len(rows)
+
+    def records(self, meterID, begin=None, end=None):
+        """ Pass a meter ID & optionally the dates bounding a span; return a
+            list of the meter's stored readings in .JSON format, in date
+            order """
+
+        query = 'SELECT record FROM readings WHERE meter_id = ?'
+        params = [meterID]
+        if begin is not None:
+            query += ' AND date >= ?'
+            params.append(begin)
+        if end is not None:
+            query += ' AND date <= ?'
+            params.append(end)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY date',
+                                    params).fetchall()
+
+        return [json.loads(row[0]) for row in rows]
+
+    def bldg_meter_records(self, bldgMeterDct, bldgSpans=None):
+        """ Pass the dictionary of meter objects from get_bldg_meters function
+            & optionally date ranges keyed by building ID (see
+            deltamtrsvs.bldg_audit_spans); return the stored readings in the
+            form returned by get_meter_records, for amsaves_billing_rate. As
+            by get_meter_records, a fuel without both dates of its range has
+            no readings (see deltamtrsvs.meter_spans) """
+
+        bldgMeterRecordsDct = {}
+        for bldgID, recordsKey, meterID, begin, end in meter_spans(
+                                                       bldgMeterDct,
+                                                       bldgSpans):
+            bldgMeterRecordsDct.setdefault(bldgID, {})[recordsKey] = \
+                self.records(meterID, begin, end)
+
+        return bldgMeterRecordsDct
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides metrics of the requests made of the DeltaMeter
+    Services API * deltameterservices.com * by the DeltaMeterClient of the
+    deltamtrsvs module. An EndpointMetrics object is a hook of the client;
+    the client calls it with a dictionary describing each request (see
+    deltamtrsvs.DeltaMeterClient), and it keeps counters & latency
+    histograms per end-point, read as a dictionary or exported as a
+    Prometheus text-format file or a .JSON snapshot """
+
+import json
+import threading
+import time
+
+from atomicfile import atomic_write
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PREFIX = 'deltamtrsvs'
+
+
+def _labels(**labels):
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('"', '\\"'))
+                          for name, value in sorted(labels.items())) + '}'
+
+
+def _write(path, text):
+    """ Replace a file whole, so readers never see a partial write """
+
+    def write(tmpPath):
+        with open(tmpPath, 'w') as outf:
+            outf.write(text)
+
+    atomic_write(path, write)
+
+
+class EndpointMetrics(object):
+    """ Pass optionally the upper bounds of the latency buckets; pass the
+        object as a hook of a DeltaMeterClient, or to deltamtrsvs.use_hooks,
+        to count the requests of each end-point """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        """ Pass the dictionary describing a request; count it """
+
+        with self._lock:
+            metrics = self._endpoints.get(event['endpoint'])
+            if metrics is None:
+                metrics = self._endpoints[event['endpoint']] = {
+                          'requests': 0, 'statuses': {}, 'bytes': 0,
+                          'cache': {}, 'retries': 0, 'latency_sum': 0.0,
+                          'latency_buckets': [0]*len(self.buckets)}
+            metrics['requests'] += 1
+            status = str(event['status'])
+            metrics['statuses'][status] = metrics['statuses'].get(status,
+                                                                  0) + 1
+            metrics['bytes'] += event['bytes']
+            if event['cache'] is not None:
+                metrics['cache'][event['cache']] = \
+                                  metrics['cache'].get(event['cache'], 0) + 1
+            metrics['retries'] += event['retries']
+            metrics['latency_sum'] += event['latency']
+            for index, bound in enumerate(self.buckets):
+                if event['latency'] <= bound:
+                    metrics['latency_buckets'][index] += 1
+
+    def reset(self):
+        """ Drop every count """
+
+        with self._lock:
+            self._endpoints.clear()
+
+    def snapshot(self):
+        """ Return a dictionary of the counts of each end-point, with
+            end-point names as keys """
+
+        with self._lock:
+            snapshot = {}
+            for endpoint, metrics in self._endpoints.items():
+                snapshot[endpoint] = {
+                    'requests': metrics['requests'],
+                    'statuses': dict(metrics['statuses']),
+                    'bytes': metrics['bytes'],
+                    'cache': dict(metrics['cache']),
+                    'retries': metrics['retries'],
+                    'latency': {'count': metrics['requests'],
+                                'sum': metrics['latency_sum'],
+                                'buckets': list(zip(
+                                           self.buckets,
+                                           metrics['latency_buckets']))}}
+
+        return snapshot
+
+    def prometheus_text(self):
+        """ Return the counts in the Prometheus text exposition format """
+
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, kind, helpText):
+            lines.append('# HELP %s_%s %s' % (PREFIX, name, helpText))
+            lines.append('# TYPE %s_%s %s' % (PREFIX, name, kind))
+
+        family('requests_total', 'counter',
+               'Requests of each end-point by status')
+        for endpoint, metrics in sorted(snapshot.items()):
+            for status, count in sorted(metrics['statuses'].items()):
+                lines.append('%s_requests_total%s %d' %
+                             (PREFIX, _labels(endpoint=endpoint,
+                                              status=status), count))
+        family('response_bytes_total', 'counter',
+               'Bytes of the response bodies of each end-point')
+        for endpoint, metrics in sorted(snapshot.items()):
+            lines.append('%s_response_bytes_total%s %d' %
+                         (PREFIX, _labels(endpoint=endpoint),
+                          metrics['bytes']))
+        family('cache_total', 'counter',
+               'Cache hits, revalidations & misses of each end-point')
+        for endpoint, metrics in sorted(snapshot.items()):
+            for outcome, count in sorted(metrics['cache'].items()):
+                lines.append('%s_cache_total%s %d' %
+                             (PREFIX, _labels(endpoint=endpoint,
+                                              outcome=outcome), count))
+        family('retries_total', 'counter',
+               'Retries of the requests of each end-point')
+        for endpoint, metrics in sorted(snapshot.items()):
+            lines.append('%s_retries_total%s %d' %
+                         (PREFIX, _labels(endpoint=endpoint),
+                          metrics['retries']))
+        family('request_seconds', 'histogram',
+               'Latency of the requests of each end-point')
+        for endpoint, metrics in sorted(snapshot.items()):
+            latency = metrics['latency']
+            for bound, count in latency['buckets']:
+                lines.append('%s_request_seconds_bucket%s %d' %
+                             (PREFIX, _labels(endpoint=endpoint,
+                                              le=repr(float(bound))), count))
+            lines.append('%s_request_seconds_bucket%s %d' %
+                         (PREFIX, _labels(endpoint=endpoint, le='+Inf'),
+                          latency['count']))
+            lines.append('%s_request_seconds_sum%s %r' %
+                         (PREFIX, _labels(endpoint=endpoint),
+                          latency['sum']))
+            lines.append('%s_request_seconds_count%s %d' %
+                         (PREFIX, _labels(endpoint=endpoint),
+                          latency['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """ Pass a file path, e.g. in the directory of the node exporter's
+            textfile collector; write the counts in the Prometheus text
+            format """
+
+        _write(path, self.prometheus_text())
+
+    def write_json(self, path):
+        """ Pass a file path; write a .JSON snapshot of the counts with the
+            time it was taken """
+
+        _write(path, json.dumps({'time': time.time(),
+                                 'endpoints': self.snapshot()}, indent=2,
+                                sort_keys=True))
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides a pipeline running the chain of deltamtrsvs requests
+    & amsaves transforms for one or more sites as a graph of stages, each
+    depending on the results of others. Every stage of a site is run at most
+    once & its result shared by every stage & report output depending on it;
+    stages whose dependencies are met run concurrently, e.g. the
+    comparisons, audits, FirstView charts & meters of a site once its models
+    are known.
+    Usage:
+        pipe = Pipeline(deltamtrsvs.DeltaMeterClient(headers),
+                        config_urls(pvt))
+        reports = pipe.run(['results', 'audit', 'flags'], sites) """
+
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+import amsaves as ams
+from deltamtrsvs import URL_NAMES
+
+# The report outputs of a site
+REPORTS = ['results', 'audit', 'flags', 'flag_table', 'usage_range',
+           'billing_rate']
+
+
+def config_urls(config):
+    """ Pass the private module (or any object) holding the end-point URLs of
+        deltamtrsvs.URL_NAMES as attributes; return a dictionary of them """
+
+    return dict((name, getattr(config, name)) for name in URL_NAMES
+                if hasattr(config, name))
+
+
+def _bldgs(pipe, site):
+    return pipe.client.get_property_bldgs(pipe.urls['properties_url'], site)
+
+
+def _models(pipe, site, bldgIDct):
+    return pipe.client.get_bldg_models(pipe.urls['model_url'],
+                                       sorted(bldgIDct), pipe.fetch_workers)
+
+
+def _ref_models(pipe, site, bldgModelsDct):
+    return dict((key, value['Reference Model']) for key, value
+                in bldgModelsDct.items())
+
+
+def _comparisons(pipe, site, bldgModelsDct):
+    return pipe.client.get_model_comparisons(pipe.urls['comparison_url'],
+                                             bldgModelsDct,
+                                             pipe.fetch_workers)
+
+
+def _audits(pipe, site, refModelsDct):
+    return pipe.client.get_model_audits(pipe.urls['audit_url'], refModelsDct,
+                                        pipe.fetch_workers)
+
+
+def _fv_charts(pipe, site, bldgModelsDct):
+    return pipe.client.get_fv_charts(pipe.urls['fv_charts_url'],
+                                     sorted(bldgModelsDct),
+                                     pipe.fetch_workers)
+
+
+def _meters(pipe, site, bldgIDct):
+    return pipe.client.get_bldg_meters(pipe.urls['bldg_meters_url'],
+                                       sorted(bldgIDct), pipe.fetch_workers)
+
+
+def _meter_records(pipe, site, auditSpans, bldgMeterDct, refModelsDct):
+    return pipe.client.get_meter_records(auditSpans, bldgMeterDct,
+                                         pipe.urls['meter_records_url'],
+                                         refModelsDct, pipe.fetch_workers)
+
+
+def _results(pipe, site, comparisonsDct, bldgModelsDct, bldgIDct):
+    return ams.amsaves_results(comparisonsDct, bldgModelsDct, bldgIDct)
+
+
+def _audit(pipe, site, audits):
+    return ams.amsaves_audit(audits)
+
+
+def _flags(pipe, site, fvCharts):
+    return ams.amsaves_flags(fvCharts)
+
+
+def _flag_table(pipe, site, fvCharts):
+    return ams.amsaves_flag_table(fvCharts)
+
+
+def _usage_range(pipe, site, audits):
+    return ams.amsaves_usage_range(audits)
+
+
+def _billing_rate(pipe, site, bldgMeterRecordsDct):
+    return ams.amsaves_billing_rate(bldgMeterRecordsDct)
+
+
+# Each stage's function & the stages whose results it is passed, in order
+STAGES = {'bldgs': (_bldgs, []),
+          'models': (_models, ['bldgs']),
+          'ref_models': (_ref_models, ['models']),
+          'comparisons': (_comparisons, ['models']),
+          'audits': (_audits, ['ref_models']),
+          'fv_charts': (_fv_charts, ['models']),
+          'meters': (_meters, ['bldgs']),
+          'meter_records': (_meter_records, ['usage_range', 'meters',
+                                             'ref_models']),
+          'results': (_results, ['comparisons', 'models', 'bldgs']),
+          'audit': (_audit, ['audits']),
+          'flags': (_flags, ['fv_charts']),
+          'flag_table': (_flag_table, ['fv_charts']),
+          'usage_range': (_usage_range, ['audits']),
+          'billing_rate': (_billing_rate, ['meter_records'])}
+
+
+class Pipeline(object):
+    """ Pass a DeltaMeterClient & a dictionary of end-point URLs with the
+        names of deltamtrsvs.URL_NAMES as keys (see config_urls), &
+        optionally the number of stages to run at once & the threads per
+        fan-out of requests within a stage. Results are kept for the life of
+        the pipeline, so later runs share the stages of earlier ones """
+
+    def __init__(self, client, urls, max_workers=4, fetch_workers=None,
+                 stages=STAGES):
+        self.client = client
+        self.urls = urls
+        self.max_workers = max_workers
+        self.fetch_workers = fetch_workers
+        self.stages = stages
+        self.runs = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def _needed(self, outputs, sites):
+        """ Return the (site, stage) nodes to run for the outputs, with the
+            nodes each depends on, leaving out those already run """
+
+        needed = {}
+        todo = [(site, output) for site in sites for output in outputs]
+        while todo:
+            node = todo.pop()
+            if node in needed or node in self._results:
+                continue
+            site, name = node
+            deps = [(site, dep) for dep in self.stages[name][1]]
+            needed[node] = deps
+            todo.extend(deps)
+
+        return needed
+
+    def _run_stage(self, node):
+        site, name = node
+        function, deps = self.stages[name]
+        with self._lock:
+            args = [self._results[(site, dep)] for dep in deps]
+            self.runs[name] = self.runs.get(name, 0) + 1
+
+        return function(self, site, *args)
+
+    def run(self, outputs=REPORTS, sites=()):
+        """ Pass a list of stage names & a list of sites; run every stage
+            they depend on, once, & return a dictionary of dictionaries of
+            the results of the stages named, with sites as keys """
+
+        needed = self._needed(outputs, sites)
+        waiting = dict((node, set(dep for dep in deps
+                                  if dep not in self._results))
+                       for node, deps in needed.items())
+        dependents = {}
+        for node, deps in waiting.items():
+            for dep in deps:
+                dependents.setdefault(dep, []).append(node)
+
+        finished = Queue()
+        pool = ThreadPool(self.max_workers)
+        running = 0
+        error = None
+        try:
+            while waiting or running:
+                if error is None:
+                    ready = [node for node, deps in waiting.items()
+                             if not deps]
+                    for node in ready:
+                        del waiting[node]
+                        self._submit(pool, node, finished)
+                        running += 1
+                if not running:
+                    break
+                node, result, failure = finished.get()
+                running -= 1
+                if failure is not None:
+                    error = error or failure
+                    continue
+                with self._lock:
+                    self._results[node] = result
+                for dependent in dependents.get(node, []):
+                    waiting[dependent].discard(node)
+        finally:
+            pool.close()
+            pool.join()
+
+        if error is not None:
+            raise error
+
+        return dict((site, dict((name, self._results[(site, name)])
+                                for name in outputs)) for site in sites)
+
+    def _submit(self, pool, node, finished):
+        """ Run a stage on the pool, putting its node, result & any error on
+            the queue of finished stages """
+
+        def stage():
+            try:
+                finished.put((node, self._run_stage(node), None))
+            except Exception as error:
+                finished.put((node, None, error))
+
+        pool.apply_async(stage)
+
+    def get(self, site, name):
+        """ Pass a site & stage name; return the stage's result, running it
+            & the stages it depends on if they have not run """
+
+        return self.run([name], [site])[site][name]
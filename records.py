@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides compact records of the objects returned by the
+    DeltaMeter Services API * deltameterservices.com *, in place of the
+    dictionaries parsed from its .JSON. Each record keeps only the fields
+    the amsaves transforms & deltamtrsvs requests read, in __slots__ named
+    as the .JSON fields, shares one copy of each repeated string (units of
+    measure, dates, model types) with the records decoded with it & is read
+    as record['Field'] like the dictionaries it replaces, so the records can
+    be passed to the amsaves functions as they are. Each *_from_json
+    function takes the results of the deltamtrsvs function of the same name
+    & returns the same structure of records, sharing strings between the
+    records of the call; the table of shared strings is dropped with the
+    call, rather than kept for the life of the process.
+    Usage:
+        bldgIDct = records.property_bldgs_from_json(
+                   deltamtrsvs.get_property_bldgs(properties_url, site,
+                                                  headers)) """
+
+from array import array
+
+
+class Record(object):
+    """ Base of the records; __slots__ names the .JSON fields kept, & SHARED
+        those whose strings are shared between records """
+
+    __slots__ = ()
+    SHARED = ()
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_json(cls, jsonObj, shared=None):
+        """ Pass an object in .JSON format & optionally a dictionary of the
+            strings shared by the records decoded with it; return its
+            record, None for the fields it lacks """
+
+        record = cls(*[jsonObj.get(field) for field in cls.__slots__])
+        if shared is None:
+            return record
+        for field in cls.SHARED:
+            value = getattr(record, field)
+            if value is not None:
+                setattr(record, field, shared.setdefault(value, value))
+
+        return record
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __contains__(self, field):
+        return field in self.__slots__
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def to_json(self):
+        """ Return the record as an object in .JSON format """
+
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            all(getattr(self, field) == getattr(other, field)
+                for field in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join(repr(getattr(self, field))
+                                     for field in self.__slots__))
+
+
+class Building(Record):
+    __slots__ = ('BuildingID', 'ExternalID', 'BuildingName')
+
+
+class Solution(Record):
+    __slots__ = ('SolutionID', 'SolutionType', 'R2Coefficient',
+                 'IterationQty', 'SquareFeet')
+    SHARED = ('SolutionType',)
+
+
+class Comparison(Record):
+    __slots__ = ('ElectricRatioA', 'GasRatioA', 'ElectricDifference',
+                 'GasDifference', 'ModelAValues')
+
+    @classmethod
+    def from_json(cls, jsonObj, shared=None):
+        record = super(Comparison, cls).from_json(jsonObj, shared)
+        # The end-use values as one array of doubles, not a list of floats
+        if record.ModelAValues is not None:
+            record.ModelAValues = array('d', record.ModelAValues)
+
+        return record
+
+
+class AuditPeriod(Record):
+    __slots__ = ('TotalUnitsUsed', 'PeriodStartDate', 'PeriodEndDate',
+                 'DaysInPeriod', 'ElecWattsPerFt2', 'AirTemp',
+                 'UnitOfMeasure')
+    SHARED = ('PeriodStartDate', 'PeriodEndDate', 'UnitOfMeasure')
+
+
+class Meter(Record):
+    __slots__ = ('MeterID', 'MeterTypeID')
+
+
+class MeterReading(Record):
+    __slots__ = ('PeriodStartDate', 'PeriodEndDate', 'TotalUnitsUsed',
+                 'TotalUsageCost')
+    SHARED = ('PeriodStartDate', 'PeriodEndDate')
+
+
+def property_bldgs_from_json(bldgIDct):
+    """ Pass the results of get_property_bldgs function; return Buildings """
+
+    return dict((bldgID, Building.from_json(bldg))
+                for bldgID, bldg in bldgIDct.items())
+
+
+def bldg_models_from_json(bldgModelsDct):
+    """ Pass the results of get_bldg_models function; return Solutions """
+
+    shared = {}
+    return dict((bldgID, dict((modelType, Solution.from_json(model, shared))
+                              for modelType, model in jsonModelsDct.items()))
+                for bldgID, jsonModelsDct in bldgModelsDct.items())
+
+
+def model_comparisons_from_json(comparisonsDct):
+    """ Pass the results of get_model_comparisons function; return
+        Comparisons """
+
+    return dict((bldgID, Comparison.from_json(comparison))
+                for bldgID, comparison in comparisonsDct.items())
+
+
+def model_audits_from_json(audits):
+    """ Pass the results of get_model_audits function; return lists of
+        AuditPeriods """
+
+    shared = {}
+    return dict((modelID, [AuditPeriod.from_json(audit, shared) for audit in
+                           jsonAudits])
+                for modelID, jsonAudits in audits.items())
+
+
+def bldg_meters_from_json(bldgMeterDct):
+    """ Pass the results of get_bldg_meters function; return Meters """
+
+    return dict((bldgID, dict((fuel, Meter.from_json(meter))
+                              for fuel, meter in bldgMeter.items()))
+                for bldgID, bldgMeter in bldgMeterDct.items())
+
+
+def meter_records_from_json(bldgMeterRecordsDct):
+    """ Pass the results of get_meter_records function; return lists of
+        MeterReadings """
+
+    shared = {}
+    return dict((bldgID, dict((recordsKey, [MeterReading.from_json(record,
+                                                                   shared)
+                                            for record in meterRecords])
+                              for recordsKey, meterRecords
+                              in metersRecordsDct.items()))
+                for bldgID, metersRecordsDct in bldgMeterRecordsDct.items())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides a pool of background threads writing the America
+    Saves! reports, so the many small files of a site, e.g. the audit of
+    every reference model, are written at once rather than one after the
+    other, which on network storage is bound by the latency of each file,
+    not the bytes written. Each file is written to a temporary file &
+    renamed, so a report is either whole or missing. The audits of a site
+    can also be written as one partition of a dataset, one .CSV file per
+    site of every model's audit in long format, in place of a file per
+    model.
+    Usage:
+        with ReportWriter(max_workers=8) as writer:
+            writer.write_csv('reports/46/46-results.csv', resultsDf)
+            write_audit_dataset(writer, 'reports/audits', '46', auditDct) """
+
+import os
+from multiprocessing.pool import ThreadPool
+
+import amsaves as ams
+from atomicfile import atomic_write, makedirs
+from lazyimport import LazyModule
+
+pd = LazyModule('pandas')
+
+# The rows of audits written to each file of a partition of the dataset
+AUDIT_PART_ROWS = 500000
+
+
+def _write_csv(path, df, kwargs):
+    makedirs(os.path.dirname(path))
+    atomic_write(path, lambda tmpPath: df.to_csv(tmpPath, **kwargs))
+
+
+class ReportWriter(object):
+    """ Pass optionally the number of files to write at once; writes are
+        queued & made in the background until close, which raises the first
+        error of any write """
+
+    def __init__(self, max_workers=4):
+        self._pool = ThreadPool(max_workers)
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def write_csv(self, path, df, **kwargs):
+        """ Pass a path, a DataFrame & any keyword arguments of its to_csv
+            method; queue the DataFrame to be written to the path """
+
+        self._pending.append(self._pool.apply_async(_write_csv,
+                                                    (path, df, kwargs)))
+
+    def close(self):
+        """ Wait for every queued write to finish; raise the first error """
+
+        self._pool.close()
+        self._pool.join()
+        pending, self._pending = self._pending, []
+        for result in pending:
+            result.get()
+
+
+def audit_frame(auditDct):
+    """ Pass the results of amsaves_audit function; return the audits of
+        every model as one DataFrame in the long format of
+        amsaves_audit_records, a row per period of each fuel, with the model
+        ID, the fuel & the index of the period in its model's audit as its
+        first columns """
+
+    columns = ['Model ID', 'Fuel', 'Period'] + ams.AUDIT_NAMES
+    frames = []
+    for modelID in sorted(auditDct):
+        usageDf = auditDct[modelID]
+        # The electric columns, then the gas columns of a model with gas,
+        # whose names repeat those of the electric columns
+        for index, fuel in enumerate(('Electricity', 'Gas')):
+            start = index*len(ams.AUDIT_NAMES)
+            if usageDf.shape[1] <= start:
+                break
+            fuelDf = usageDf.iloc[:, start:start + len(ams.AUDIT_NAMES)]
+            fuelDf.columns = ams.AUDIT_NAMES
+            # Drop the padding of a fuel with fewer periods
+            fuelDf = fuelDf.dropna(how='all')
+            fuelDf.insert(0, 'Model ID', modelID)
+            fuelDf.insert(1, 'Fuel', fuel)
+            fuelDf.insert(2, 'Period', fuelDf.index)
+            frames.append(fuelDf)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(frames, ignore_index=True)[columns]
+
+
+def partition_dir(directory, site):
+    """ Pass the directory of a dataset & a site; return the directory of the
+        site's partition """
+
+    return os.path.join(directory, 'site=%s' % site)
+
+
+def write_audit_dataset(writer, directory, site, auditDct,
+                        rows=AUDIT_PART_ROWS):
+    """ Pass a ReportWriter, the directory of the audit dataset, a site, the
+        results of amsaves_audit function & optionally the rows per file;
+        queue the site's audits to be written as the files of its partition,
+        part-00000.csv & on. Return the paths of the files """
+
+    siteDir = partition_dir(directory, site)
+    if os.path.isdir(siteDir):
+        # Drop the parts of an earlier run, which may have had more
+        for name in os.listdir(siteDir):
+            if name.startswith('part-'):
+                os.remove(os.path.join(siteDir, name))
+    df = audit_frame(auditDct)
+    paths = []
+    for part, start in enumerate(range(0, max(len(df), 1), rows)):
+        paths.append(os.path.join(siteDir, 'part-%05d.csv' % part))
+        writer.write_csv(paths[-1], df.iloc[start:start + rows], index=False)
+
+    return paths
+
+
+def read_audit_dataset(directory, sites=None):
+    """ Pass the directory of an audit dataset & optionally a list of sites;
+        return the audits of the sites, or of every site, as one DataFrame
+        with the site as its first column """
+
+    if sites is None:
+        sites = sorted(name.split('=', 1)[1] for name in os.listdir(directory)
+                       if name.startswith('site='))
+    frames = []
+    for site in sites:
+        siteDir = partition_dir(directory, site)
+        for name in sorted(os.listdir(siteDir)):
+            if name.startswith('part-') and name.endswith('.csv'):
+                df = pd.read_csv(os.path.join(siteDir, name),
+                                 dtype={'Model ID': str})
+                df.insert(0, 'Site', site)
+                frames.append(df)
+
+    return pd.concat(frames, ignore_index=True) if frames else \
+        pd.DataFrame(columns=['Site', 'Model ID'])
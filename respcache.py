@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides a persistent, SQLite backed cache of responses from
+    the DeltaMeter Services API * deltameterservices.com *, keyed by end-point
+    URL, for use by the DeltaMeterClient of the deltamtrsvs module.
+    Entries expire after a time-to-live set per end-point, are revalidated
+    with ETag/Last-Modified headers when the server provided them, and the
+    least recently used entries are evicted to keep the cache under a size
+    limit """
+
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DAY = 24*60*60
+
+# Time-to-live, in seconds, of the responses from each end-point; the names
+# are those the DeltaMeterClient passes for each request. Incremental meter
+# syncs are always revalidated
+DEFAULT_TTLS = {'properties': DAY,
+                'models': 7*DAY,
+                'comparisons': 7*DAY,
+                'audits': 7*DAY,
+                'fv_charts': 7*DAY,
+                'meters': DAY,
+                'meter_records': DAY,
+                'meter_sync': 0}
+
+
+class ResponseCache(object):
+    """ Pass the path of the SQLite file to hold the cache; optionally a
+        dictionary of time-to-live values, in seconds, with end-point names
+        as keys, a default time-to-live for other end-points & the maximum
+        size in bytes of the response bodies kept """
+
+    def __init__(self, path, ttls=None, default_ttl=DAY,
+                 max_bytes=256*1024*1024):
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                             'url TEXT PRIMARY KEY, endpoint TEXT, tag TEXT, '
+                             'body BLOB, etag TEXT, last_modified TEXT, '
+                             'stored REAL, accessed REAL, size INTEGER)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_tag '
+                             'ON responses (tag)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed '
+                             'ON responses (accessed)')
+
+    def close(self):
+        """ Close the SQLite file """
+
+        with self._lock:
+            self._db.close()
+
+    def lookup(self, url):
+        """ Pass an end-point URL; return a tuple of the cached response and
+            whether it is still fresh, or (None, False) if it is not cached """
+
+        with self._lock:
+            row = self._db.execute('SELECT endpoint, body, etag, '
+                                   'last_modified, stored FROM responses '
+                                   'WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None, False
+            endpoint, body, etag, lastModified, stored = row
+            with self._db:
+                self._db.execute('UPDATE responses SET accessed = ? '
+                                 'WHERE url = ?', (time.time(), url))
+
+        headers = CaseInsensitiveDict()
+        if etag:
+            headers['ETag'] = etag
+        if lastModified:
+            headers['Last-Modified'] = lastModified
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = headers
+        response._content = bytes(body)
+        response.from_cache = True
+        fresh = time.time() - stored < self.ttls.get(endpoint,
+                                                     self.default_ttl)
+
+        return response, fresh
+
+    def store(self, url, response, endpoint=None, tag=None):
+        """ Pass an end-point URL & its successful response; keep the
+            response body with its validators, under an optional end-point
+            name & tag (e.g. the building ID it belongs to) """
+
+        body = response.content
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO responses VALUES '
+                                 '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 (url, endpoint, tag, sqlite3.Binary(body),
+                                  response.headers.get('ETag'),
+                                  response.headers.get('Last-Modified'),
+                                  now, now, len(body)))
+                self._evict()
+
+    def refresh(self, url):
+        """ Mark the cached response for an end-point URL as fresh, after the
+            server confirmed it has not changed """
+
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.execute('UPDATE responses SET stored = ?, '
+                                 'accessed = ? WHERE url = ?',
+                                 (now, now, url))
+
+    def invalidate(self, url=None, tag=None, endpoint=None):
+        """ Drop the cached responses matching an end-point URL, tag or
+            end-point name, or every response if none are given; return the
+            URLs dropped """
+
+        clauses = []
+        params = []
+        for column, value in (('url', url), ('tag', tag),
+                              ('endpoint', endpoint)):
+            if value is not None:
+                clauses.append(column + ' = ?')
+                params.append(value)
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+
+        with self._lock:
+            with self._db:
+                urls = [row[0] for row in self._db.execute(
+                        'SELECT url FROM responses' + where, params)]
+                self._db.execute('DELETE FROM responses' + where, params)
+
+        return urls
+
+    def _evict(self):
+        """ Drop the least recently used responses until the bodies kept fit
+            within max_bytes """
+
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) '
+                                 'FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = []
+        for url, size in self._db.execute('SELECT url, size FROM responses '
+                                          'ORDER BY accessed'):
+            if total <= self.max_bytes:
+                break
+            evicted.append((url,))
+            total -= size
+        self._db.executemany('DELETE FROM responses WHERE url = ?', evicted)
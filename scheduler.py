@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides a scheduler for the requests made of the DeltaMeter
+    Services API * deltameterservices.com * by the DeltaMeterClient of the
+    deltamtrsvs module, shared by every client & thread of a run. It limits
+    the rate of requests with a token bucket, retries throttled (429) &
+    failed (5xx) requests with jittered exponential backoff, waiting as long
+    as the server asks with Retry-After, and halves the number of requests
+    in flight under errors, adding one back per round of successes, so a run
+    keeps close to the service's real limit rather than failing outright """
+
+from email.utils import mktime_tz, parsedate_tz
+import random
+import threading
+import time
+
+import requests
+
+# Statuses of responses worth requesting again
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+
+def retry_after(response, now=None):
+    """ Pass a response; return the seconds its Retry-After header asks to
+        wait, given as seconds or as an HTTP date, or None without one """
+
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, mktime_tz(date) - (time.time() if now is None
+                                           else now))
+
+
+class TokenBucket(object):
+    """ Pass a rate of requests per second & optionally the burst of
+        requests allowed at once; acquire() waits for a token """
+
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._stamp = clock()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """ Take a token if one is available; return 0 if taken, or else the
+            seconds to wait for one, without waiting """
+
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens +
+                              (now - self._stamp)*self.rate)
+            self._stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens)/self.rate
+
+    def acquire(self):
+        """ Take a token, waiting until one is available """
+
+        wait = self.take()
+        while wait:
+            self.sleep(wait)
+            wait = self.take()
+
+
+class AdaptiveConcurrency(object):
+    """ Pass the number of requests allowed in flight at once, & optionally
+        the least & most it may adapt between; the limit is halved on a
+        failure & grows by one for each limit's worth of successes """
+
+    def __init__(self, limit, minimum=1, maximum=None):
+        self.limit = float(limit)
+        self.minimum = minimum
+        self.maximum = maximum or limit
+        self.active = 0
+        self._epoch = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """ Wait for a place in flight; return the token to release it
+            with """
+
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+            return self._epoch
+
+    def try_acquire(self):
+        """ Take a place in flight if one is free, without waiting; return
+            the token to release it with, or None """
+
+        with self._cond:
+            if self.active >= int(self.limit):
+                return None
+            self.active += 1
+            return self._epoch
+
+    def release(self, epoch, ok):
+        """ Pass the token from acquire & whether the request succeeded;
+            free its place & adapt the limit. Failures of requests started
+            before the last decrease do not decrease it again """
+
+        with self._cond:
+            self.active -= 1
+            if ok:
+                self.limit = min(self.maximum, self.limit + 1/self.limit)
+            elif epoch == self._epoch:
+                self.limit = max(self.minimum, self.limit/2)
+                self._epoch += 1
+            self._cond.notify_all()
+
+
+class RequestScheduler(object):
+    """ Pass optionally a rate limit in requests per second & its burst, the
+        most requests in flight at once & the least they may be cut to, the
+        number of retries, & the base & greatest backoff in seconds. Pass the
+        scheduler to a DeltaMeterClient, or to deltamtrsvs.use_scheduler for
+        the module functions """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=10,
+                 min_concurrency=1, retries=5, backoff=0.5, max_backoff=60,
+                 sleep=time.sleep, clock=time.time):
+        self.bucket = (TokenBucket(rate, burst, clock, sleep) if rate
+                       else None)
+        self.concurrency = AdaptiveConcurrency(max_concurrency,
+                                               min_concurrency)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.clock = clock
+        self._holdUntil = 0
+        self._lock = threading.Lock()
+
+    def delay(self, attempt, response=None):
+        """ Pass the number of attempts failed so far, less one, & the last
+            response; return the seconds to wait before the next attempt """
+
+        if response is not None:
+            wait = retry_after(response, self.clock())
+            if wait is not None:
+                return wait
+
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff*2**attempt))
+
+    def hold(self, wait):
+        """ Hold every request until wait seconds from now """
+
+        with self._lock:
+            self._holdUntil = max(self._holdUntil, self.clock() + wait)
+
+    def held(self):
+        """ Return the seconds every request is still held for, 0 if none """
+
+        with self._lock:
+            return max(0, self._holdUntil - self.clock())
+
+    def _wait_hold(self):
+        wait = self.held()
+        while wait:
+            self.sleep(wait)
+            wait = self.held()
+
+    def call(self, send):
+        """ Pass a function sending a request & returning its response;
+            send it within the limits, retrying throttled & failed
+            responses & connection errors. Return the response, raising
+            requests.HTTPError if it still failed after the retries """
+
+        for attempt in range(self.retries + 1):
+            self._wait_hold()
+            if self.bucket is not None:
+                self.bucket.acquire()
+            epoch = self.concurrency.acquire()
+            ok = False
+            error = None
+            try:
+                response = send()
+                ok = response.status_code not in RETRY_STATUSES
+            except RETRY_ERRORS as failure:
+                if attempt == self.retries:
+                    failure.retries = attempt
+                    raise
+                error = failure
+            finally:
+                # Free the place whatever send raised, retried or not
+                self.concurrency.release(epoch, ok)
+            if error is not None:
+                self.sleep(self.delay(attempt))
+                continue
+
+            # The number of retries is kept for the client's hooks
+            response.retries = attempt
+            if ok:
+                return response
+            if attempt == self.retries:
+                response.raise_for_status()
+
+            wait = self.delay(attempt, response)
+            response.close()
+            if response.status_code == 429:
+                # The server throttles every request, not just this one
+                self.hold(wait)
+            else:
+                self.sleep(wait)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides a local store of meter readings & audit periods
+    from the DeltaMeter Services API * deltameterservices.com *, kept as
+    fixed-width NumPy arrays in memory-mapped files, one per meter or model,
+    sorted by date. A query for a span of dates is a binary search of
+    the dates & a slice of the mapped file, without copying or decoding any
+    records; the arrays returned can be passed to amsaves_billing_rate &
+    amsaves_usage_range in place of lists of records in .JSON format.
+    Like the MeterRecordStore of the meterstore module, the store keeps a
+    watermark per meter, so it can be kept up to date by the
+    sync_meter_records function of the deltamtrsvs module """
+
+import mmap
+import os
+import threading
+
+import numpy as np
+
+from atomicfile import atomic_write
+from deltamtrsvs import RECORD_DATE_KEY, RECORDS_KEYS, meter_spans
+
+# The fields kept of each record, named as in the .JSON records; the files
+# hold the records alone, without a header, so they are mapped without
+# parsing anything
+READING_DTYPE = np.dtype([('PeriodStartDate', '<M8[s]'),
+                          ('PeriodEndDate', '<M8[s]'),
+                          ('TotalUnitsUsed', '<f8'),
+                          ('TotalUsageCost', '<f8')])
+AUDIT_DTYPE = np.dtype([('PeriodStartDate', '<M8[s]'),
+                        ('PeriodEndDate', '<M8[s]'),
+                        ('UnitOfMeasure', '<U8'),
+                        ('TotalUnitsUsed', '<f8')])
+READINGS = 'readings'
+AUDITS = 'audits'
+
+
+def to_array(records, dtype):
+    """ Pass a list of records in .JSON format & the dtype of the fields to
+        keep; return the records as an array sorted by date """
+
+    names = dtype.names
+    series = np.array([tuple(record[name] for name in names)
+                       for record in records], dtype)
+
+    return series[np.argsort(series[RECORD_DATE_KEY], kind='mergesort')]
+
+
+class MeterSeriesStore(object):
+    """ Pass the directory to hold the files of the meter readings & audit
+        periods """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._dtypes = {READINGS: READING_DTYPE, AUDITS: AUDIT_DTYPE}
+        self._mapped = {}
+        self._lock = threading.Lock()
+        for kind in self._dtypes:
+            path = os.path.join(directory, kind)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    def _path(self, kind, seriesID):
+        return os.path.join(self.directory, kind, str(seriesID) + '.dat')
+
+    def _series(self, kind, seriesID):
+        """ Return the mapped array of a meter's readings or a model's audit
+            periods, or an empty array if none are stored """
+
+        key = (kind, str(seriesID))
+        with self._lock:
+            series = self._mapped.get(key)
+            if series is None:
+                path = self._path(kind, seriesID)
+                if not os.path.exists(path):
+                    return np.empty(0, self._dtypes[kind])
+                with open(path, 'rb') as inf:
+                    mapped = mmap.mmap(inf.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+                series = self._mapped[key] = np.frombuffer(
+                                             mapped, self._dtypes[kind])
+
+        return series
+
+    def _put(self, kind, seriesID, records):
+        """ Merge records in .JSON format into the stored series, those of a
+            date already stored replacing it; return the number of records
+            in the series """
+
+        added = to_array(records, self._dtypes[kind])
+        if not len(added):
+            return len(self._series(kind, seriesID))
+
+        path = self._path(kind, seriesID)
+        with self._lock:
+            key = (kind, str(seriesID))
+            self._mapped.pop(key, None)
+            if os.path.exists(path):
+                stored = np.fromfile(path, self._dtypes[kind])
+                kept = ~np.in1d(stored[RECORD_DATE_KEY],
+                                added[RECORD_DATE_KEY])
+                series = np.concatenate([stored[kept], added])
+                series = series[np.argsort(series[RECORD_DATE_KEY],
+                                           kind='mergesort')]
+            else:
+                series = added
+            # Replace the file whole, so readers never map a partial write
+            atomic_write(path, series.tofile)
+
+        return len(series)
+
+    def _span(self, series, begin=None, end=None):
+        """ Return the slice of a series from begin through end """
+
+        dates = series[RECORD_DATE_KEY]
+        start = (0 if begin is None
+                 else dates.searchsorted(np.datetime64(begin, 's')))
+        stop = (len(series) if end is None
+                else dates.searchsorted(np.datetime64(end, 's'), 'right'))
+
+        return series[start:stop]
+
+    def put_readings(self, meterID, records):
+        """ Pass a meter ID & a list of its readings in .JSON format; store
+            the readings & return the number stored for the meter """
+
+        return self._put(READINGS, meterID, records)
+
+    def watermark(self, meterID):
+        """ Pass a meter ID; return the date of its latest stored reading, or
+            None if none are stored """
+
+        series = self._series(READINGS, meterID)
+        if not len(series):
+            return None
+
+        return str(series[RECORD_DATE_KEY][-1])
+
+    def append(self, meterID, records):
+        """ Pass a meter ID & a list of its readings in .JSON format; store
+            the readings, replacing any of the same date; return the number
+            of readings stored, as MeterRecordStore.append does """
+
+        self.put_readings(meterID, records)
+
+        return len(records)
+
+    def readings(self, meterID, begin=None, end=None):
+        """ Pass a meter ID & optionally the dates bounding a span; return an
+            array of the meter's readings in date order, a view of the
+            mapped file """
+
+        return self._span(self._series(READINGS, meterID), begin, end)
+
+    def put_audits(self, modelID, audits):
+        """ Pass a model ID & a list of its audit periods in .JSON format;
+            store the periods & return the number stored for the model """
+
+        return self._put(AUDITS, modelID, audits)
+
+    def audits(self, modelID, begin=None, end=None):
+        """ Pass a model ID & optionally the dates bounding a span; return an
+            array of the model's audit periods in date order, a view of the
+            mapped file """
+
+        return self._span(self._series(AUDITS, modelID), begin, end)
+
+    def put_model_audits(self, audits):
+        """ Pass the results of get_model_audits function; store the audit
+            periods of every model """
+
+        for modelID, modelAudits in audits.items():
+            self.put_audits(modelID, modelAudits)
+
+    def model_audits(self, modelIDs):
+        """ Pass a list of model IDs; return the stored audit periods in the
+            form returned by get_model_audits, for amsaves_usage_range """
+
+        return dict((str(modelID), self.audits(modelID))
+                    for modelID in modelIDs)
+
+    def put_bldg_meter_records(self, bldgMeterDct, bldgMeterRecordsDct):
+        """ Pass the dictionary of meter objects from get_bldg_meters function
+            & the results of get_meter_records function; store the readings
+            of every meter """
+
+        for bldgID, metersRecordsDct in bldgMeterRecordsDct.items():
+            for fuel, meter in bldgMeterDct.get(bldgID, {}).items():
+                records = metersRecordsDct.get(RECORDS_KEYS[fuel])
+                if records is not None:
+                    self.put_readings(meter['MeterID'], records)
+
+    def bldg_meter_records(self, bldgMeterDct, bldgSpans=None):
+        """ Pass the dictionary of meter objects from get_bldg_meters function
+            & optionally date ranges keyed by building ID (see
+            deltamtrsvs.bldg_audit_spans); return the stored readings in the
+            form returned by get_meter_records, for amsaves_billing_rate. As
+            by get_meter_records, a fuel without both dates of its range has
+            no readings (see deltamtrsvs.meter_spans) """
+
+        bldgMeterRecordsDct = {}
+        for bldgID, recordsKey, meterID, begin, end in meter_spans(
+                                                       bldgMeterDct,
+                                                       bldgSpans):
+            bldgMeterRecordsDct.setdefault(bldgID, {})[recordsKey] = \
+                self.readings(meterID, begin, end)
+
+        return bldgMeterRecordsDct
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides opt-in profiling of the stages of the amsaves
+    transforms. Each transform is decorated with stage(); while a
+    StageProfiler is in use, every call of a transform is timed, its input
+    records & output rows counted, and optionally one chosen stage run under
+    cProfile & with its memory allocations traced, and the results passed as
+    a dictionary to the profiler's sink. Without a profiler the transforms
+    run as if undecorated.
+    Usage:
+        sink = stageprof.ListSink()
+        stageprof.use_profiler(stageprof.StageProfiler(
+                               sink, profile='amsaves_audit'))
+        ...
+        stageprof.use_profiler(None) """
+
+import cProfile
+import functools
+import json
+import logging
+import pstats
+import threading
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_cpuTime = getattr(time, 'process_time', None) or time.clock
+_profiler = None
+
+
+def count_records(value, depth):
+    """ Pass the input of a stage & the depth of its records, e.g. 1 for a
+        dictionary of records, 2 for a dictionary of lists of records; return
+        the number of records, or None if some are not counted up front
+        (e.g. iterators of streamed records) """
+
+    if depth <= 1:
+        return len(value) if hasattr(value, '__len__') else None
+
+    total = 0
+    for item in (value.values() if hasattr(value, 'values') else value):
+        count = count_records(item, depth - 1)
+        if count is None:
+            return None
+        total += count
+
+    return total
+
+
+def count_rows(result):
+    """ Pass the output of a stage; return the rows of a DataFrame, the
+        total rows of a dictionary of DataFrames or else its length """
+
+    if hasattr(result, 'shape'):
+        return result.shape[0]
+    if hasattr(result, 'values') and result and \
+       all(hasattr(value, 'shape') for value in result.values()):
+        return sum(value.shape[0] for value in result.values())
+
+    return len(result) if hasattr(result, '__len__') else None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+
+class StageProfiler(object):
+    """ Pass a sink, a function called with the dictionary of results of each
+        stage, & optionally the name of one stage to run under cProfile &
+        whether to trace its memory allocations, & the number of functions
+        of the cProfile statistics to keep """
+
+    def __init__(self, sink, profile=None, allocations=False, top=25):
+        self.sink = sink
+        self.profile = profile
+        self.allocations = allocations
+        self.top = top
+
+    def run(self, name, function, args, kwargs, depth):
+        """ Run a stage's function, passing its results to the sink; return
+            the function's result """
+
+        stats = {'stage': name,
+                 'records': count_records(args[0], depth) if args else None}
+        chosen = name == self.profile
+        profiler = cProfile.Profile() if chosen else None
+        tracing = chosen and self.allocations and tracemalloc is not None
+        if tracing:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        elif chosen and self.allocations:
+            # Without tracemalloc, the growth of the peak resident memory
+            peakRss = _peak_rss_mb()
+
+        start = time.time()
+        cpuStart = _cpuTime()
+        try:
+            if profiler is not None:
+                result = profiler.runcall(function, *args, **kwargs)
+            else:
+                result = function(*args, **kwargs)
+        except Exception as error:
+            stats['error'] = repr(error)
+            raise
+        finally:
+            stats['wall_time_s'] = time.time() - start
+            stats['cpu_time_s'] = _cpuTime() - cpuStart
+            if tracing:
+                stats['allocated_peak_mb'] = (tracemalloc.get_traced_memory(
+                                              )[1] - baseline)/1024.0/1024.0
+                if started:
+                    tracemalloc.stop()
+            elif chosen and self.allocations and peakRss is not None:
+                stats['rss_growth_mb'] = _peak_rss_mb() - peakRss
+            if profiler is not None:
+                text = StringIO()
+                pstats.Stats(profiler, stream=text).sort_stats(
+                       'cumulative').print_stats(self.top)
+                stats['profile'] = text.getvalue()
+            if 'error' in stats:
+                self.sink(stats)
+
+        stats['rows'] = count_rows(result)
+        self.sink(stats)
+
+        return result
+
+
+def use_profiler(profiler):
+    """ Pass a StageProfiler (or None to stop profiling); every stage called
+        afterwards reports to it """
+
+    global _profiler
+    _profiler = profiler
+
+
+def stage(depth=1):
+    """ Decorate a transform as a profiled stage, passing the depth of the
+        records of its first argument (see count_records) """
+
+    def decorate(function):
+        name = function.__name__
+
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return function(*args, **kwargs)
+            return profiler.run(name, function, args, kwargs, depth)
+
+        return profiled
+
+    return decorate
+
+
+class ListSink(object):
+    """ Keeps the results of each stage in a list """
+
+    def __init__(self):
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def __call__(self, stats):
+        with self._lock:
+            self.stages.append(stats)
+
+
+class LogSink(object):
+    """ Pass optionally a logger & level; logs the results of each stage,
+        with the cProfile statistics when there are any """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('amsaves')
+        self.level = level
+
+    def __call__(self, stats):
+        self.logger.log(self.level, '%s: %.3f s wall, %.3f s CPU, %s records,'
+                        ' %s rows', stats['stage'], stats['wall_time_s'],
+                        stats['cpu_time_s'], stats['records'],
+                        stats.get('rows'))
+        if 'profile' in stats:
+            self.logger.log(self.level, stats['profile'])
+
+
+class JSONLinesSink(object):
+    """ Pass a file path; appends the results of each stage to the file as a
+        line of .JSON """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, stats):
+        with self._lock:
+            with open(self.path, 'a') as outf:
+                outf.write(json.dumps(stats, sort_keys=True) + '\n')
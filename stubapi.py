@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module provides a recorder of responses from the DeltaMeter Services
+    API * deltameterservices.com * & a local stub HTTP server serving the
+    recorded responses, so the deltamtrsvs & amsaves functions can be run
+    offline & deterministically.
+    Fixtures are kept one .JSON file per request, with the path & query of the
+    request, the status & the body of the response; the stub server answers
+    a request with the fixture of the same path & query, or failing that of
+    the same path, keeping only the records of a .JSON array dated within
+    the start & end dates of the query, as the API does for meter records """
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlsplit, urlunsplit
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+from deltamtrsvs import RECORD_DATE_KEY, URL_NAMES
+
+
+def fixture_name(path):
+    """ Pass the path & query of a request; return the name of its fixture
+        file """
+
+    return hashlib.sha1(path.encode('utf-8')).hexdigest() + '.json'
+
+
+def save_fixture(directory, path, body, status=200):
+    """ Pass a fixture directory, the path & query of a request and the body
+        & status of its response; write the response's fixture file """
+
+    fixture = {'path': path, 'status': status, 'body': body}
+    with open(os.path.join(directory, fixture_name(path)), 'w') as outf:
+        json.dump(fixture, outf)
+
+
+def load_fixtures(directory):
+    """ Pass a fixture directory; return a dictionary of (status, body)
+        tuples with the path & query of each request as keys """
+
+    fixtures = {}
+    for fname in os.listdir(directory):
+        if fname.endswith('.json'):
+            with open(os.path.join(directory, fname)) as inf:
+                fixture = json.load(inf)
+            fixtures[fixture['path']] = (fixture['status'], fixture['body'])
+
+    return fixtures
+
+
+class FixtureRecorder(object):
+    """ Pass a DeltaMeterClient & a fixture directory; every response the
+        client receives from the API is written to the directory until the
+        recorder is stopped """
+
+    def __init__(self, client, directory):
+        self.client = client
+        self.directory = directory
+        self.recorded = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self.client.session.hooks['response'].append(self._record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stop(self):
+        """ Stop recording the client's responses """
+
+        self.client.session.hooks['response'].remove(self._record)
+
+    def _record(self, response, *args, **kwargs):
+        if response.status_code == 304:
+            return
+        with self._lock:
+            save_fixture(self.directory, response.request.path_url,
+                         response.text, response.status_code)
+            self.recorded += 1
+
+
+def date_window(body, query):
+    """ Pass the body of a fixture & the query of a request; return the body
+        with only the records dated from the query's start date through its
+        end date, or the body as it is if it is not a .JSON array of records
+        or the query has no dates """
+
+    params = parse_qs(query)
+    start = params.get('start', [None])[0]
+    end = params.get('end', [None])[0]
+    if start is None and end is None:
+        return body
+    try:
+        records = json.loads(body)
+    except ValueError:
+        return body
+    if not isinstance(records, list) or \
+       not all(isinstance(record, dict) and RECORD_DATE_KEY in record
+               for record in records):
+        return body
+
+    return json.dumps([record for record in records
+                       if (start is None or record[RECORD_DATE_KEY] >= start)
+                       and (end is None or record[RECORD_DATE_KEY] <= end)])
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """ Answers each GET with the stub server's fixture for its path """
+
+    protocol_version = 'HTTP/1.1'
+    # Write each response in one piece, or the client's delayed ACKs stall
+    # every keep-alive request
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub._count()
+        latency = stub.latency() if callable(stub.latency) else stub.latency
+        if latency:
+            time.sleep(latency)
+
+        fixture = stub.fixtures.get(self.path)
+        path, query = (self.path.split('?', 1) + [''])[:2]
+        if fixture is None:
+            fixture = stub.fixtures.get(path)
+            if fixture is not None and fixture[0] == 200:
+                fixture = (200, date_window(fixture[1], query))
+        if fixture is None:
+            status, body = 404, ''
+        else:
+            status, body = fixture
+        body = body.encode('utf-8')
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 200:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(object):
+    """ Pass a dictionary of fixtures, as returned by load_fixtures, and
+        optionally the latency to inject in seconds, or a function returning
+        it, before each response; serves the fixtures over HTTP on the local
+        host from a background thread while started """
+
+    def __init__(self, fixtures, latency=0, host='127.0.0.1', port=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.stub = self
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        """ Start serving the fixtures """
+
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        """ Stop serving the fixtures """
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _count(self):
+        with self._lock:
+            self.requests += 1
+
+    def url(self, url):
+        """ Pass an API end-point URL; return the same end-point on the stub
+            server """
+
+        parts = urlsplit(url)
+        local = urlsplit(self.base_url)
+
+        return urlunsplit((local.scheme, local.netloc, parts.path,
+                           parts.query, parts.fragment))
+
+    def urls(self, config):
+        """ Pass the private module (or any object) holding the end-point
+            URLs of deltamtrsvs.URL_NAMES as attributes; return a dictionary
+            of the same end-points on the stub server """
+
+        return dict((name, self.url(getattr(config, name)))
+                    for name in URL_NAMES if hasattr(config, name))
+
+
+# End-point paths of the fixtures made by synthetic_fixtures
+SYNTHETIC_PATHS = {'properties_url': '/api/Properties/',
+                   'model_url': '/api/Models/',
+                   'comparison_url': '/api/Comparisons/',
+                   'audit_url': '/api/Audits/',
+                   'fv_charts_url': '/api/FirstViewCharts/',
+                   'bldg_meters_url': '/api/Meters/',
+                   'meter_records_url': '/api/MeterRecords/'}
+
+DIAGNOSTICS = [('Occupant Load', 'ABCOP'), ('Controls Heating', 'ABC'),
+               ('Shell Ventilation', 'ABC'), ('Controls Cooling', 'ABC'),
+               ('Cooling Efficiency', 'ABC'), ('Data Consistency', 'ABC'),
+               ('Summer Gas Use', 'ABC'), ('Heating Efficiency', 'ABC'),
+               ('Lighting Load', 'ABC'), ('Base Load', 'ABC')]
+
+
+def synthetic_fixtures(bldgQty, site='46', months=24, seed=0):
+    """ Pass a number of buildings; return a dictionary of fixtures, as
+        returned by load_fixtures, for a property of that many buildings with
+        models, comparisons, audits, FirstView charts, meters & monthly meter
+        records, at the paths of SYNTHETIC_PATHS """
+
+    rand = random.Random(seed)
+    paths = SYNTHETIC_PATHS
+    fixtures = {}
+
+    def add(path, body):
+        fixtures[path] = (200, json.dumps(body))
+
+    periods = []
+    for month in range(months):
+        year, month = divmod(month, 12)
+        periods.append(('%d-%02d-01T00:00:00' % (2013 + year, month + 1),
+                        '%d-%02d-28T00:00:00' % (2013 + year, month + 1)))
+
+    bldgs = []
+    for index in range(bldgQty):
+        bldgID = str(1000 + index)
+        refID = str(100000 + 2*index)
+        propID = str(100001 + 2*index)
+        elecMeterID = str(500000 + 2*index)
+        gasMeterID = str(500001 + 2*index)
+        area = rand.randint(5000, 200000)
+        bldgs.append({'BuildingID': int(bldgID),
+                      'ExternalID': 'EXT-' + bldgID,
+                      'BuildingName': 'Building ' + bldgID})
+
+        models = []
+        for solnID, solnType in ((refID, 'Reference Model'),
+                                 (propID, 'Proposed Model')):
+            models.append({'SolutionID': int(solnID),
+                           'SolutionType': solnType,
+                           'R2Coefficient': round(rand.uniform(0.7, 1), 3),
+                           'IterationQty': rand.randint(100, 1000),
+                           'SquareFeet': area})
+        add(paths['model_url'] + bldgID, models)
+
+        add(paths['comparison_url'] + refID + '/1/' + propID + '/1/',
+            {'ElectricRatioA': rand.uniform(0.8, 1.2),
+             'GasRatioA': rand.uniform(0.8, 1.2),
+             'ElectricDifference': rand.uniform(-5e4, 5e4),
+             'GasDifference': rand.uniform(-5e5, 5e5),
+             'ModelAValues': [rand.uniform(0, 1e6) for value in range(10)]})
+
+        audit = []
+        for unit in ('KWH', 'THERM'):
+            for begin, end in periods:
+                audit.append({'TotalUnitsUsed': rand.uniform(100, 1e5),
+                              'PeriodStartDate': begin,
+                              'PeriodEndDate': end,
+                              'DaysInPeriod': 28,
+                              'ElecWattsPerFt2': rand.uniform(0.1, 5),
+                              'AirTemp': rand.uniform(20, 90),
+                              'UnitOfMeasure': unit})
+        add(paths['audit_url'] + refID, audit)
+
+        add(paths['fv_charts_url'] + bldgID,
+            {'Diagnostics': [{'MessageName': name,
+                              'MessageCode': rand.choice(codes) +
+                                             str(rand.randint(1, 9)),
+                              'MessageText': rand.choice(['High', 'Low',
+                                                          'Normal'])}
+                             for name, codes in DIAGNOSTICS]})
+
+        add(paths['bldg_meters_url'] + bldgID,
+            [{'MeterID': int(elecMeterID), 'MeterTypeID': 1},
+             {'MeterID': int(gasMeterID), 'MeterTypeID': 2}])
+        for meterID in (elecMeterID, gasMeterID):
+            add(paths['meter_records_url'] + meterID,
+                [{'PeriodStartDate': begin, 'PeriodEndDate': end,
+                  'TotalUnitsUsed': rand.uniform(100, 1e5),
+                  'TotalUsageCost': rand.uniform(10, 1e4)}
+                 for begin, end in periods])
+
+    add(paths['properties_url'] + site, bldgs)
+
+    return fixtures
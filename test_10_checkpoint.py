@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the checkpoint module against the stub server of the
+    stubapi module, offline """
+
+import checkpoint
+import deltamtrsvs
+import pipeline
+import stubapi
+
+SITE = '46'
+
+
+def test_resume_retries_failed_buildings(tmpdir):
+    """ Fail one building's comparison; confirm the others are done & the
+        failure recorded, and that resuming requests only the failed
+        building's remaining stages & matches a run without failures """
+
+    fixtures = stubapi.synthetic_fixtures(4, SITE, months=6)
+    invalid = [path for path in fixtures
+               if path.startswith(stubapi.SYNTHETIC_PATHS['comparison_url'])
+               and '100002' in path][0]
+    comparison = fixtures.pop(invalid)
+    store = checkpoint.CheckpointStore(str(tmpdir.join('checkpoints.db')))
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        with deltamtrsvs.DeltaMeterClient({}) as client:
+            run = checkpoint.CheckpointedRun(client, urls, store, 2)
+            reports = run.run(SITE)
+            assert list(reports['failed']) == ['1001']
+            assert reports['failed']['1001']['stage'] == 'comparison'
+            assert 'InvalidComparison' in reports['failed']['1001']['error']
+            assert sorted(reports['results']['Blg. ID']) == ['1000', '1002',
+                                                             '1003']
+
+            # The building resumes at its comparison, so requests it, its
+            # audits, chart & meters & the records of its two meters
+            fixtures[invalid] = comparison
+            requests = server.requests
+            reports = run.run(SITE)
+            assert reports['failed'] == {}
+            assert server.requests - requests == 6
+
+            # With every stage done, a resumed run makes no requests
+            requests = server.requests
+            reports = run.run(SITE)
+            assert server.requests == requests
+
+            pipe = pipeline.Pipeline(client, urls)
+            expected = pipe.run(checkpoint.REPORTS, [SITE])[SITE]
+    store.close()
+
+    assert sorted(reports['results']['Blg. ID']) == \
+        sorted(expected['results']['Blg. ID'])
+    assert sorted(reports['audit']) == sorted(expected['audit'])
+    assert reports['flags'] == expected['flags']
+    assert reports['usage_range'] == expected['usage_range']
+    assert sorted(reports['billing_rate']) == \
+        sorted(expected['billing_rate'])
+
+
+def test_outputs_run_needed_stages(tmpdir):
+    """ Run only the reports written by the batch module; confirm no meter
+        or billing stage is run or requested, & the reports match those of
+        a full run """
+
+    fixtures = stubapi.synthetic_fixtures(3, SITE, months=6)
+    outputs = ['results', 'audit', 'flags', 'usage_range']
+    store = checkpoint.CheckpointStore(str(tmpdir.join('checkpoints.db')))
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        with deltamtrsvs.DeltaMeterClient({}) as client:
+            run = checkpoint.CheckpointedRun(client, urls, store,
+                                             outputs=outputs)
+            reports = run.run(SITE)
+            # The site's buildings, & each building's models, comparison,
+            # audits & chart
+            assert server.requests == 1 + 3*4
+            expected = pipeline.Pipeline(client, urls).run(outputs,
+                                                           [SITE])[SITE]
+    done = store.load(SITE, '1000')
+    store.close()
+
+    assert sorted(reports) == sorted(outputs + ['failed'])
+    assert not set(['meters', 'meter_records', 'billing_rate']) & set(done)
+    assert sorted(reports['results']['Blg. ID']) == \
+        sorted(expected['results']['Blg. ID'])
+    assert reports['flags'] == expected['flags']
+    assert reports['usage_range'] == expected['usage_range']
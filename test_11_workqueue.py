@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the workqueue module against the stub server of the
+    stubapi module, offline """
+
+import os
+import threading
+import time
+
+import amsaves
+import deltamtrsvs
+import pipeline
+import stubapi
+import workqueue
+
+SITES = ['46', '47']
+
+
+def test_lease_expiry(tmpdir):
+    """ Confirm a task leased to a worker that stopped is claimed again once
+        the lease expires, and only by one worker """
+
+    path = str(tmpdir.join('queue.db'))
+    queue = workqueue.WorkQueue(path, lease_seconds=0.05)
+    assert queue.enqueue('46', {'1000': {}, '1001': {}}) == 2
+    assert queue.enqueue('46', {'1000': {}}) == 0
+    assert [task[1] for task in queue.claim('dead', 2)] == ['1000', '1001']
+    assert queue.claim('live') == []
+    time.sleep(0.1)
+    claimed = queue.claim('live', 2)
+    assert [task[1] for task in claimed] == ['1000', '1001']
+    assert not queue.renew('dead', '46', '1000')
+    queue.complete('live', '46', '1000')
+    queue.complete('dead', '46', '1001')
+    assert queue.counts() == {'done': 1, 'leased': 1}
+
+    # Expired on its last attempt, the task is failed rather than claimed
+    queue.max_attempts = 2
+    time.sleep(0.1)
+    assert queue.claim('live') == []
+    assert queue.failures('46') == {'1001': {'error': 'Lease expired',
+                                             'attempts': 2}}
+    queue.close()
+
+
+def test_lease_lost(tmpdir):
+    """ Let a task's lease expire & another worker claim it; confirm the
+        first worker stops the task at its next renewal, writing no results
+        & leaving the task to the other worker """
+
+    path = str(tmpdir.join('queue.db'))
+    results = str(tmpdir.join('results'))
+    with stubapi.StubServer(stubapi.synthetic_fixtures(1, months=6)
+                            ) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        queue = workqueue.WorkQueue(path, lease_seconds=0.05)
+        queue.enqueue('46', {'1000': {}})
+        site, bldgID, bldg = queue.claim('slow')[0]
+        time.sleep(0.1)
+        assert queue.claim('live')
+        with deltamtrsvs.DeltaMeterClient({}) as client:
+            worker = workqueue.Worker(client, urls, queue, results, 'slow')
+            assert not worker.run_task(site, bldgID, bldg)
+        # Only the models were requested before the lease was found lost
+        assert server.requests == 1
+
+    assert not os.path.exists(workqueue.partition_path(results, site,
+                                                       bldgID))
+    assert queue.counts() == {'leased': 1}
+    queue.close()
+
+
+def test_workers_merge(tmpdir):
+    """ Enqueue two sites, one with an invalid comparison, & run three
+        workers at once, each with its own connection to the queue; confirm
+        the failing building is set aside after its attempts, its results of
+        an earlier run are not merged & the merged reports match a pipeline
+        run of the sites """
+
+    fixtures = stubapi.synthetic_fixtures(4, '46', months=6)
+    fixtures.update(stubapi.synthetic_fixtures(4, '47', months=6, seed=1))
+    invalid = [path for path in fixtures
+               if path.startswith(stubapi.SYNTHETIC_PATHS['comparison_url'])
+               and '100002' in path][0]
+    comparison = fixtures.pop(invalid)
+    path = str(tmpdir.join('queue.db'))
+    results = str(tmpdir.join('results'))
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        queue = workqueue.WorkQueue(path, max_attempts=2)
+        # The results of an earlier run, for the building failing in this one
+        stale = dict((name, {}) for name in workqueue.checkpoint.REPORTS)
+        stale.update({'results': amsaves.amsaves_results({}, {}, {}),
+                      'flags': {'1001': {}}})
+        workqueue.write_partition(results, '46', '1001', stale)
+        with deltamtrsvs.DeltaMeterClient({}) as client:
+            assert workqueue.enqueue_sites(client, urls, queue, SITES,
+                                           results) == 8
+
+        def work(index):
+            with deltamtrsvs.DeltaMeterClient({}) as client:
+                workqueue.Worker(client, urls,
+                                 workqueue.WorkQueue(path, max_attempts=2),
+                                 results, 'worker-%d' % index).run()
+
+        threads = [threading.Thread(target=work, args=(index,))
+                   for index in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert queue.counts() == {'done': 6, 'failed': 2}
+
+        fixtures[invalid] = comparison
+        with deltamtrsvs.DeltaMeterClient({}) as client:
+            expected = pipeline.Pipeline(client, urls).run(
+                       workqueue.checkpoint.REPORTS, SITES)
+
+    for site in SITES:
+        reports = workqueue.merge_site(results, site, queue)
+        assert sorted(reports['failed']) == ['1001']
+        assert 'InvalidComparison' in reports['failed']['1001']['error']
+        assert reports['failed']['1001']['attempts'] == 2
+        assert sorted(reports['results']['Blg. ID']) == ['1000', '1002',
+                                                         '1003']
+        assert reports['flags'] == dict(
+               (key, value) for key, value in expected[site]['flags'].items()
+               if key != '1001')
+        assert sorted(reports['audit']) == sorted(
+               key for key in expected[site]['audit'] if key != '100002')
+    queue.close()
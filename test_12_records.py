@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the records module against the stub server of the
+    stubapi module, offline """
+
+import pytest
+
+import amsaves as ams
+import benchmark
+import deltamtrsvs
+import pipeline
+import records
+import stubapi
+
+SITE = '46'
+
+
+def test_record_fields():
+    """ Confirm records read as the dictionaries they replace & share their
+        repeated strings with the records decoded with them only """
+
+    jsonAudit = {'TotalUnitsUsed': 12.5, 'PeriodStartDate':
+                 '2013-01-01T00:00:00', 'PeriodEndDate': '2013-01-28T00:00:00',
+                 'UnitOfMeasure': 'KWH', 'Unused': 1}
+    shared = {}
+    audit = records.AuditPeriod.from_json(jsonAudit, shared)
+    assert audit['TotalUnitsUsed'] == 12.5
+    assert audit['AirTemp'] is None
+    assert 'Unused' not in audit
+    with pytest.raises(KeyError):
+        audit['Unused']
+    other = records.AuditPeriod.from_json(dict(jsonAudit), shared)
+    assert other == audit
+    assert other.PeriodStartDate is audit.PeriodStartDate
+    assert len(shared) == 3
+
+    copies = [dict(jsonAudit, PeriodStartDate=''.join(
+              jsonAudit['PeriodStartDate'])) for copy in range(2)]
+    assert copies[0]['PeriodStartDate'] is not \
+        copies[1]['PeriodStartDate']
+    audits = records.model_audits_from_json({'501': copies[:1],
+                                             '502': copies[1:]})
+    assert audits['501'][0].PeriodStartDate is \
+        audits['502'][0].PeriodStartDate
+    assert records.AuditPeriod.from_json(copies[0]).PeriodStartDate is \
+        copies[0]['PeriodStartDate']
+    assert not hasattr(audit, '__dict__')
+    assert deltamtrsvs.sort_meters([records.Meter(71, 1)]) == \
+        {'Electricity': records.Meter(71, 1)}
+
+
+def test_amsaves_accepts_records():
+    """ Fetch a site's objects; confirm the amsaves transforms return the
+        same from records as from dictionaries, & the records take less
+        memory """
+
+    fixtures = stubapi.synthetic_fixtures(5, SITE, months=12)
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        with deltamtrsvs.DeltaMeterClient({}) as client:
+            jsonObjs = pipeline.Pipeline(client, urls).run(
+                       ['bldgs', 'models', 'comparisons', 'audits',
+                        'meter_records'], [SITE])[SITE]
+
+    bldgIDct = records.property_bldgs_from_json(jsonObjs['bldgs'])
+    bldgModelsDct = records.bldg_models_from_json(jsonObjs['models'])
+    comparisonsDct = records.model_comparisons_from_json(
+                     jsonObjs['comparisons'])
+    audits = records.model_audits_from_json(jsonObjs['audits'])
+    bldgMeterRecordsDct = records.meter_records_from_json(
+                          jsonObjs['meter_records'])
+
+    assert ams.amsaves_results(comparisonsDct, bldgModelsDct,
+                               bldgIDct).equals(
+           ams.amsaves_results(jsonObjs['comparisons'], jsonObjs['models'],
+                               jsonObjs['bldgs']))
+    recordAudit = ams.amsaves_audit(audits)
+    jsonAudit = ams.amsaves_audit(jsonObjs['audits'])
+    assert all(recordAudit[key].equals(jsonAudit[key]) for key in jsonAudit)
+    assert ams.amsaves_usage_range(audits) == \
+        ams.amsaves_usage_range(jsonObjs['audits'])
+    assert ams.amsaves_billing_rate(bldgMeterRecordsDct) == \
+        ams.amsaves_billing_rate(jsonObjs['meter_records'])
+    assert benchmark.deep_size(audits) < \
+        benchmark.deep_size(jsonObjs['audits'])/2
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the flags table of the amsaves module against the flags
+    built from amsaves_flags as in test_amsaves_flags, offline """
+
+import json
+import random
+
+import amsaves as ams
+import stubapi
+
+
+def expected_flags(diagnMsgCodes):
+    """ Build the flag rows from the results of amsaves_flags function, one
+        building at a time, as test_amsaves_flags does """
+
+    siteFlags = []
+    for key, value in sorted(diagnMsgCodes.items()):
+        letter = lambda name: value[name][0] if name in value else ''
+        intrnElec = ultrHighIntExt = ''
+        if letter('Occupant Load') in ('A', 'B', 'C'):
+            intrnElec = letter('Occupant Load')
+        elif letter('Occupant Load') in ('O', 'P'):
+            ultrHighIntExt = letter('Occupant Load')
+        if 'Summer Gas Use' in value and value['Summer Gas Use'][1] == 'High':
+            highGasBaseLd = 'M'
+        else:
+            highGasBaseLd = ''
+        siteFlags.append([key, intrnElec, ultrHighIntExt,
+                          letter('Controls Heating'),
+                          letter('Shell Ventilation'),
+                          letter('Controls Cooling'),
+                          letter('Cooling Efficiency'),
+                          letter('Data Consistency'), highGasBaseLd])
+
+    return siteFlags
+
+
+def test_flag_table():
+    """ Confirm the flags table of synthetic FirstView charts, with repeated
+        & missing diagnostics & codes of one letter & of several, matches
+        the flags built one building at a time """
+
+    fixtures = stubapi.synthetic_fixtures(300, months=1)
+    fvCharts = dict((path.rsplit('/', 1)[1], json.loads(body))
+                    for path, (status, body) in fixtures.items()
+                    if path.startswith(stubapi.SYNTHETIC_PATHS[
+                                       'fv_charts_url']))
+    rand = random.Random(1)
+    for fvChart in fvCharts.values():
+        diagnstcs = fvChart['Diagnostics']
+        rand.shuffle(diagnstcs)
+        del diagnstcs[rand.randint(0, len(diagnstcs)):]
+        diagnstcs.extend(rand.sample(diagnstcs, min(2, len(diagnstcs))))
+        if rand.random() < 0.5:
+            for diagnstc in diagnstcs:
+                diagnstc['MessageCode'] = diagnstc['MessageCode'][:1]
+    fvCharts['999'] = {'Diagnostics': []}
+
+    table = ams.amsaves_flag_table(fvCharts)
+    assert list(table.columns) == ams.FLAG_COLUMNS
+    assert table.values.tolist() == \
+        expected_flags(ams.amsaves_flags(fvCharts))
+    assert ams.amsaves_flag_table({}).shape == (0, 9)
+
+
+def test_flag_codes():
+    """ Confirm a flag keeps the whole of its message code & a missing code
+        gives no flag """
+
+    fvCharts = {'1': {'Diagnostics': [
+                {'MessageName': 'Controls Heating', 'MessageCode': 'B12',
+                 'MessageText': 'High'},
+                {'MessageName': 'Shell Ventilation', 'MessageCode': None,
+                 'MessageText': 'Normal'},
+                {'MessageName': 'Occupant Load', 'MessageCode': 'P',
+                 'MessageText': 'High'}]}}
+    table = ams.amsaves_flag_table(fvCharts).set_index('Bldg ID')
+    assert table.loc['1', 'Excessive Htg.'] == 'B12'
+    assert table.loc['1', 'Shell & Vent.'] == ''
+    assert table.loc['1', 'Ultra-High Elec.'] == 'P'
+    assert table.loc['1', 'Int. Elec.'] == ''
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests that NumPy & pandas are imported only on first use by
+    a transform, not by importing the modules """
+
+import benchmark
+import lazyimport
+
+
+def test_fetch_layer_imports_lazily():
+    """ Confirm importing the fetch layer in a fresh interpreter leaves NumPy
+        & pandas out of sys.modules """
+
+    assert benchmark.import_time(benchmark.FETCH_MODULES, repeat=1)[1] == []
+
+
+def test_report_modules_import_lazily():
+    """ Confirm the report modules import NumPy & pandas only when used """
+
+    for module in ('amsaves', 'pipeline', 'checkpoint', 'workqueue', 'batch'):
+        assert benchmark.import_time([module], repeat=1)[1] == []
+
+
+def test_lazy_module():
+    """ Confirm a lazy module imports on first access """
+
+    json = lazyimport.LazyModule('json')
+    assert 'imported' not in repr(json)
+    assert json.loads('[1]') == [1]
+    assert 'imported' in repr(json)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the reportwriter module, offline """
+
+import os
+
+import pandas as pd
+import pytest
+
+import amsaves as ams
+import deltamtrsvs
+import reportwriter
+import stubapi
+
+
+def _audits():
+    """ Return the amsaves_audit results of three synthetic models, the
+        first without gas periods & the second with fewer gas periods than
+        electric """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(3, months=6)
+                            ) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        with deltamtrsvs.DeltaMeterClient({}) as client:
+            refModelsDct = dict((key, value['Reference Model'])
+                                for key, value in client.get_bldg_models(
+                                urls['model_url'],
+                                ['1000', '1001', '1002']).items())
+            audits = client.get_model_audits(urls['audit_url'],
+                                             refModelsDct)
+    audits['100000'] = [jsonAudit for jsonAudit in audits['100000']
+                        if jsonAudit['UnitOfMeasure'] == 'KWH']
+    audits['100002'] = audits['100002'][:-2]
+
+    return ams.amsaves_audit(audits)
+
+
+def test_audit_dataset(tmpdir):
+    """ Write a site's audits, of models with & without gas, as a partition
+        of several files; confirm they read back as written, in long format
+        with the columns of amsaves_audit_records, & a rewrite drops the
+        parts of the first """
+
+    auditDct = _audits()
+    directory = str(tmpdir.join('audits'))
+    with reportwriter.ReportWriter(max_workers=2) as writer:
+        paths = reportwriter.write_audit_dataset(writer, directory, '46',
+                                                 auditDct, rows=10)
+    assert [os.path.basename(path) for path in paths] == \
+        ['part-00000.csv', 'part-00001.csv', 'part-00002.csv']
+
+    auditDf = reportwriter.read_audit_dataset(directory)
+    expected = reportwriter.audit_frame(auditDct)
+    assert list(auditDf.columns) == ['Site', 'Model ID', 'Fuel', 'Period'] + \
+        ams.AUDIT_NAMES
+    assert auditDf.groupby(['Model ID', 'Fuel']).size().to_dict() == {
+           ('100000', 'Electricity'): 6, ('100002', 'Electricity'): 6,
+           ('100002', 'Gas'): 4, ('100004', 'Electricity'): 6,
+           ('100004', 'Gas'): 6}
+    for column in ('Model ID', 'Fuel', 'Period', 'Per. Start', 'Per. End'):
+        assert list(auditDf[column].astype(str)) == \
+            list(expected[column].astype(str))
+    for column in ('Units Used', 'W/SF', 'Hrs. in Per.', 'Air Temp'):
+        assert list(auditDf[column]) == pytest.approx(list(expected[column]))
+    gasDf = auditDct['100004'].iloc[:, len(ams.AUDIT_NAMES):]
+    assert list(auditDf[(auditDf['Model ID'] == '100004') &
+                        (auditDf['Fuel'] == 'Gas')]['Units Used']) == \
+        pytest.approx(list(gasDf['[Therms/Mo.]']))
+
+    with reportwriter.ReportWriter() as writer:
+        reportwriter.write_audit_dataset(writer, directory, '46', auditDct)
+    assert os.listdir(reportwriter.partition_dir(directory, '46')) == \
+        ['part-00000.csv']
+
+
+def test_write_error(tmpdir):
+    """ Confirm the error of a write in the background is raised on close &
+        the writes queued with it are made """
+
+    path = str(tmpdir.join('ok.csv'))
+    writer = reportwriter.ReportWriter()
+    writer.write_csv(str(tmpdir.join('bad.csv')), None)
+    writer.write_csv(path, pd.DataFrame({'a': [1]}))
+    with pytest.raises(AttributeError):
+        writer.close()
+    assert os.path.exists(path)
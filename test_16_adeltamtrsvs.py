@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the asyncio coroutines of the adeltamtrsvs module
+    against the stub server of the stubapi module, offline; skipped without
+    aiohttp, as on Python 2 """
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+import asyncio
+
+import adeltamtrsvs
+import deltamtrsvs
+import stubapi
+
+headers = {'Authorization': 'stub'}
+
+
+def synthetic_urls(server):
+    return dict((name, server.base_url + path) for name, path
+                in stubapi.SYNTHETIC_PATHS.items())
+
+
+def test_same_results():
+    """ Request the models, comparisons, audits & meters of synthetic
+        buildings; confirm the coroutines return what the deltamtrsvs
+        functions do """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(4)) as server:
+        urls = synthetic_urls(server)
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        bldgIDs = sorted(client.get_property_bldgs(urls['properties_url'],
+                                                   '46'))
+        assert sorted(asyncio.run(adeltamtrsvs.aget_property_bldgs(
+               urls['properties_url'], '46', headers))) == bldgIDs
+
+        bldgModelsDct = client.get_bldg_models(urls['model_url'], bldgIDs)
+        assert asyncio.run(adeltamtrsvs.aget_bldg_models(
+               urls['model_url'], bldgIDs, headers)) == bldgModelsDct
+        assert asyncio.run(adeltamtrsvs.aget_model_comparisons(
+               urls['comparison_url'], bldgModelsDct, headers)) == \
+            client.get_model_comparisons(urls['comparison_url'],
+                                         bldgModelsDct)
+        refModelsDct = dict((key, value['Reference Model']) for key, value
+                            in bldgModelsDct.items())
+        assert asyncio.run(adeltamtrsvs.aget_model_audits(
+               urls['audit_url'], refModelsDct, headers)) == \
+            client.get_model_audits(urls['audit_url'], refModelsDct)
+        assert asyncio.run(adeltamtrsvs.aget_bldg_meters(
+               urls['bldg_meters_url'], bldgIDs, headers)) == \
+            client.get_bldg_meters(urls['bldg_meters_url'], bldgIDs)
+
+
+def test_same_errors(tmpdir):
+    """ Serve failed responses; confirm the coroutines leave out buildings
+        without models & raise the errors the deltamtrsvs functions do """
+
+    stubapi.save_fixture(str(tmpdir), '/api/Models/1001', '', 404)
+    stubapi.save_fixture(str(tmpdir), '/api/Comparisons/501/1/502/1/', '',
+                         500)
+    with stubapi.StubServer(stubapi.load_fixtures(str(tmpdir))) as server:
+        api = server.base_url + '/api/'
+        assert asyncio.run(adeltamtrsvs.aget_bldg_models(
+               api + 'Models/', ['1001'], headers)) == {}
+
+        models = {'1001': {'Reference Model': {'SolutionID': 501},
+                           'Proposed Model': {'SolutionID': 502}}}
+        with pytest.raises(deltamtrsvs.InvalidComparison):
+            asyncio.run(adeltamtrsvs.aget_model_comparisons(
+                        api + 'Comparisons/', models, headers))
+        with pytest.raises(ValueError):
+            asyncio.run(adeltamtrsvs.aget_model_audits(
+                        api + 'Audits/', {'1001': {'SolutionID': 501}},
+                        headers))
+        with pytest.raises(ValueError):
+            asyncio.run(adeltamtrsvs.aget_bldg_meters(api + 'Meters/',
+                                                      ['1001'], headers))
+
+
+def test_client_hooks():
+    """ Request the same models twice through one memoizing client with a
+        hook; confirm one request is made & reported, in the loop the client
+        was entered in """
+
+    events = []
+    with stubapi.StubServer(stubapi.synthetic_fixtures(2)) as server:
+        urls = synthetic_urls(server)
+        client = adeltamtrsvs.AsyncDeltaMeterClient(headers, memoize=True,
+                                                    hooks=[events.append])
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(client.__aenter__())
+            for attempt in range(2):
+                bldgModelsDct = loop.run_until_complete(
+                                client.get_bldg_models(urls['model_url'],
+                                                       ['1000']))
+            loop.run_until_complete(client.close())
+        finally:
+            loop.close()
+        assert server.requests == 1
+
+    assert sorted(bldgModelsDct['1000']) == ['Proposed Model',
+                                             'Reference Model']
+    assert [(event['endpoint'], event['status']) for event in events] == \
+        [('models', 200)]
+    assert events[0]['bytes'] > 0
+
+
+def test_scheduler_retries(tmpdir):
+    """ Confirm a request still failing after the retries of the client's
+        scheduler raises HTTPError, as through the deltamtrsvs client """
+
+    import requests
+    import scheduler
+
+    stubapi.save_fixture(str(tmpdir), '/api/Comparisons/501/1/502/1/', '',
+                         503)
+    models = {'1001': {'Reference Model': {'SolutionID': 501},
+                       'Proposed Model': {'SolutionID': 502}}}
+    with stubapi.StubServer(stubapi.load_fixtures(str(tmpdir))) as server:
+        client = adeltamtrsvs.AsyncDeltaMeterClient(
+                 headers, scheduler=scheduler.RequestScheduler(retries=2,
+                                                               backoff=0))
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(client.__aenter__())
+            with pytest.raises(requests.HTTPError):
+                loop.run_until_complete(client.get_model_comparisons(
+                     server.base_url + '/api/Comparisons/', models))
+            loop.run_until_complete(client.close())
+        finally:
+            loop.close()
+        assert server.requests == 3
+        assert client.scheduler.concurrency.active == 0
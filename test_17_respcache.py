@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the response cache of the respcache module through a
+    DeltaMeterClient against the stub server of the stubapi module,
+    offline """
+
+import time
+
+import deltamtrsvs
+import respcache
+import stubapi
+
+headers = {'Authorization': 'stub'}
+
+
+def cached_client(tmpdir, **kwargs):
+    """ Return a client with a new cache & the list its hooks append the
+        cache outcome of each request to """
+
+    outcomes = []
+    cache = respcache.ResponseCache(str(tmpdir.join('cache.db')), **kwargs)
+    client = deltamtrsvs.DeltaMeterClient(
+             headers, cache=cache,
+             hooks=[lambda event: outcomes.append(event['cache'])])
+
+    return client, outcomes
+
+
+def test_ttl_revalidation(tmpdir):
+    """ Confirm a fresh response is answered from the cache & an expired one
+        revalidated with its ETag, the server answering 304 """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(1)) as server:
+        model_url = server.base_url + '/api/Models/'
+        client, outcomes = cached_client(tmpdir, ttls={'models': 0.3})
+        models = client.get_bldg_models(model_url, ['1000'])
+        assert client.get_bldg_models(model_url, ['1000']) == models
+        assert server.requests == 1
+
+        time.sleep(0.35)
+        assert client.get_bldg_models(model_url, ['1000']) == models
+        assert server.requests == 2
+        assert client.get_bldg_models(model_url, ['1000']) == models
+        assert server.requests == 2
+    assert outcomes == ['miss', 'hit', 'revalidated', 'hit']
+
+
+def test_lru_eviction(tmpdir):
+    """ Fill the cache past its size limit; confirm the least recently used
+        response is dropped & the others kept """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(3)) as server:
+        model_url = server.base_url + '/api/Models/'
+        size = len(stubapi.synthetic_fixtures(3)['/api/Models/1000'][1])
+        client, outcomes = cached_client(tmpdir, max_bytes=int(2.5*size))
+        for bldgID in ('1000', '1001', '1000', '1002'):
+            client.get_bldg_models(model_url, [bldgID])
+            time.sleep(0.01)
+        assert server.requests == 3
+
+    assert client.cache.lookup(model_url + '1001')[0] is None
+    for bldgID in ('1000', '1002'):
+        assert client.cache.lookup(model_url + bldgID)[1]
+
+
+def test_invalidate(tmpdir):
+    """ Confirm invalidating the responses of one building requests only
+        them again """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(2)) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        client, outcomes = cached_client(tmpdir)
+        for attempt in range(2):
+            client.get_bldg_models(urls['model_url'], ['1000', '1001'])
+            client.get_bldg_meters(urls['bldg_meters_url'], ['1000'])
+        assert server.requests == 3
+
+        client.invalidate(tag='1000')
+        client.get_bldg_models(urls['model_url'], ['1000', '1001'])
+        client.get_bldg_meters(urls['bldg_meters_url'], ['1000'])
+        assert server.requests == 5
+
+        client.invalidate(endpoint='meters')
+        client.get_bldg_meters(urls['bldg_meters_url'], ['1000'])
+        assert server.requests == 6
+
+
+def test_invalidate_memoized():
+    """ Confirm invalidating the responses of one building drops them from a
+        memoizing client without a cache, so only they are requested again """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(2)) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        with deltamtrsvs.DeltaMeterClient({}, memoize=True) as client:
+            for attempt in range(2):
+                client.get_bldg_models(urls['model_url'], ['1000', '1001'])
+                client.get_bldg_meters(urls['bldg_meters_url'], ['1000'])
+            assert server.requests == 3
+
+            client.invalidate(tag='1000')
+            client.get_bldg_models(urls['model_url'], ['1000', '1001'])
+            client.get_bldg_meters(urls['bldg_meters_url'], ['1000'])
+            assert server.requests == 5
+
+            client.invalidate(endpoint='meters')
+            client.get_bldg_meters(urls['bldg_meters_url'], ['1000'])
+            assert server.requests == 6
+
+            client.invalidate()
+            client.get_bldg_models(urls['model_url'], ['1000', '1001'])
+            assert server.requests == 8
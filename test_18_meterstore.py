@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the SQLite store of the meterstore module, kept by
+    deltamtrsvs.sync_meter_records against the stub server of the stubapi
+    module, offline """
+
+import amsaves
+import deltamtrsvs
+import meterstore
+import stubapi
+
+headers = {'Authorization': 'stub'}
+START = '2013-01-01T00:00:00'
+
+
+def test_sync_watermarks(tmpdir):
+    """ Sync the meters of a synthetic building over a year & then over two;
+        confirm each meter's watermark, that a later sync appends only the
+        readings since it & that syncing again stores no duplicates """
+
+    fixtures = stubapi.synthetic_fixtures(1, months=24)
+    path = stubapi.SYNTHETIC_PATHS['meter_records_url'] + '500000'
+    status, body = fixtures[path]
+    readings = deltamtrsvs.json.loads(body)
+    fixtures[path] = (status, deltamtrsvs.json.dumps(readings[:12]))
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        bldgMeterDct = client.get_bldg_meters(urls['bldg_meters_url'],
+                                              ['1000'])
+        store = meterstore.MeterRecordStore(str(tmpdir.join('meters.db')))
+        assert store.watermark('500000') is None
+
+        counts = client.sync_meter_records(bldgMeterDct,
+                                           urls['meter_records_url'], store,
+                                           START)
+        assert counts == {'500000': 12, '500001': 24}
+        assert store.watermark('500000') == readings[11]['PeriodStartDate']
+
+        fixtures[path] = (status, body)
+        counts = client.sync_meter_records(bldgMeterDct,
+                                           urls['meter_records_url'], store,
+                                           START)
+        # The reading of the watermark's date is requested again
+        assert counts == {'500000': 13, '500001': 1}
+        assert store.watermark('500000') == readings[-1]['PeriodStartDate']
+        assert store.records('500000') == readings
+
+        client.sync_meter_records(bldgMeterDct, urls['meter_records_url'],
+                                  store, START)
+        assert store.records('500000') == readings
+        store.close()
+
+
+def test_store_matches_requests(tmpdir):
+    """ Confirm the readings read back from the store for the audit spans of
+        synthetic buildings are those requested by get_meter_records, and a
+        span without gas dates gives no gas readings either way """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(3)) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        bldgIDs = ['1000', '1001', '1002']
+        refModelsDct = dict((key, value['Reference Model']) for key, value
+                            in client.get_bldg_models(urls['model_url'],
+                                                      bldgIDs).items())
+        auditSpans = amsaves.amsaves_usage_range(
+                     client.get_model_audits(urls['audit_url'], refModelsDct))
+        auditSpans['100000'].update({'E. Per. Begin': '2013-03-01T00:00:00',
+                                     'G. Per. Begin': 0, 'G. Per. End': 0})
+        bldgMeterDct = client.get_bldg_meters(urls['bldg_meters_url'],
+                                              bldgIDs)
+        store = meterstore.MeterRecordStore(str(tmpdir.join('meters.db')))
+        client.sync_meter_records(bldgMeterDct, urls['meter_records_url'],
+                                  store, START)
+
+        fetched = client.get_meter_records(auditSpans, bldgMeterDct,
+                                           urls['meter_records_url'],
+                                           refModelsDct)
+    stored = store.bldg_meter_records(bldgMeterDct,
+                                      deltamtrsvs.bldg_audit_spans(
+                                      auditSpans, refModelsDct))
+    assert stored == fetched
+    assert list(stored['1000']) == ['Elec. Meter Records']
+    assert len(stored['1000']['Elec. Meter Records']) == 22
+    assert amsaves.amsaves_billing_rate(stored) == \
+        amsaves.amsaves_billing_rate(fetched)
+    store.close()
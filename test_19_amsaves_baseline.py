@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the array transforms of the amsaves module against the
+    loops they replaced, kept here as baseline_* functions, on synthetic
+    fixtures of the stubapi module, offline """
+
+import datetime
+
+import pandas as pd
+import pytest
+from pandas.util.testing import assert_frame_equal
+
+import amsaves as ams
+import deltamtrsvs
+import stubapi
+
+headers = {'Authorization': 'stub'}
+
+
+def synthetic_objects(bldgQty):
+    """ Return the buildings, models & comparisons of a property of synthetic
+        buildings, as returned by the deltamtrsvs functions """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(bldgQty)) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        bldgIDct = client.get_property_bldgs(urls['properties_url'], '46')
+        bldgModelsDct = client.get_bldg_models(urls['model_url'],
+                                               sorted(bldgIDct))
+        comparisonsDct = client.get_model_comparisons(urls['comparison_url'],
+                                                      bldgModelsDct)
+
+    return bldgIDct, bldgModelsDct, comparisonsDct
+
+
+def synthetic_audits(bldgQty):
+    """ Return the audits of the reference models of synthetic buildings, as
+        returned by get_model_audits, the first without gas periods & the
+        second with fewer gas periods than electric """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(bldgQty)) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        refModelsDct = dict((key, value['Reference Model']) for key, value
+                            in client.get_bldg_models(
+                            urls['model_url'],
+                            [str(1000 + index) for index
+                             in range(bldgQty)]).items())
+        audits = client.get_model_audits(urls['audit_url'], refModelsDct)
+
+    audits['100000'] = [jsonAudit for jsonAudit in audits['100000']
+                        if jsonAudit['UnitOfMeasure'] == 'KWH']
+    audits['100002'] = audits['100002'][:-3]
+
+    return audits
+
+
+def baseline_results(comparisonsDct, bldgModelsDct, bldgIDct):
+    """ The amsaves_results function as a loop over the buildings """
+
+    uses = []
+    for key, value in comparisonsDct.iteritems():
+        elecRatio = value['ElectricRatioA']
+        gasRatio = value['GasRatioA']
+        elecKwhSavings = round(-value['ElectricDifference']*elecRatio, 0)
+        gasThermSavings = round(-value['GasDifference']/29.3072*gasRatio, 0)
+        elecBaseLdKwh = round(value['ModelAValues'][1]*elecRatio + \
+                              value['ModelAValues'][3]*elecRatio + \
+                              value['ModelAValues'][5]*elecRatio + \
+                              value['ModelAValues'][7]*elecRatio, 0)
+        elecClgKwh = round(value['ModelAValues'][0]*elecRatio, 0)
+        elecHtgKwh = round(value['ModelAValues'][8]*elecRatio, 0)
+        gasSpcHtgTherm = round(value['ModelAValues'][9]/29.3072*gasRatio, 0)
+        gasBaseLd = round((value['ModelAValues'][2] + \
+                           value['ModelAValues'][4] + \
+                           value['ModelAValues'][6])/29.3072*gasRatio, 0)
+        bldg = bldgIDct[key]
+        jsonModel = bldgModelsDct[key]['Reference Model']
+        uses.append([key, bldg['ExternalID'], bldg['BuildingName'],
+                     jsonModel['R2Coefficient'], jsonModel['IterationQty'],
+                     jsonModel['SquareFeet'], jsonModel['SolutionID'],
+                     elecKwhSavings, gasThermSavings, elecBaseLdKwh,
+                     elecClgKwh, elecHtgKwh, gasSpcHtgTherm, gasBaseLd,
+                     elecRatio, gasRatio])
+
+    names = ['Blg. ID', 'BldgEnergy ID', 'Bldg Name', 'R2Coef.', 'Iterations',
+             'Bldg. Area [ft2]', 'Solution ID', 'Electric Savings [kWh]',
+             'Gas Savings [Therms]', 'Elec. Base-load [kWh]',
+             'Elec. Cooling [kWh]', 'Elec. Heat [kWh]',
+             'Gas Space Heat [Therms]', 'Gas Base-load [Therms]',
+             'Elec. True-up Ratio', 'Gas True-up Ratio']
+
+    return pd.DataFrame(data=uses, columns=names)
+
+
+def test_results():
+    """ Confirm amsaves_results matches the loop for synthetic buildings, for
+        savings & end-uses at exact halves, rounded away from zero, & for no
+        buildings """
+
+    bldgIDct, bldgModelsDct, comparisonsDct = synthetic_objects(50)
+    halves = {'ElectricRatioA': 0.5, 'GasRatioA': 1.0,
+              'ElectricDifference': 5.0, 'GasDifference': -2.5*29.3072,
+              'ModelAValues': [1.0, 3.0, -5.0, -7.0, 9.0, 11.0, 13.0, 1.0,
+                               -3.0, 29.3072*0.5]}
+    for key in sorted(comparisonsDct)[:2]:
+        comparisonsDct[key] = dict(halves)
+    comparisonsDct[sorted(comparisonsDct)[1]]['ElectricDifference'] = -5.0
+
+    usesDf = ams.amsaves_results(comparisonsDct, bldgModelsDct, bldgIDct)
+    assert_frame_equal(usesDf, baseline_results(comparisonsDct,
+                                                bldgModelsDct, bldgIDct))
+    halfRows = usesDf.set_index('Blg. ID').loc[sorted(comparisonsDct)[:2]]
+    assert halfRows['Electric Savings [kWh]'].tolist() == [-3.0, 3.0]
+    assert halfRows['Elec. Cooling [kWh]'].tolist() == [1.0, 1.0]
+    assert halfRows['Elec. Heat [kWh]'].tolist() == [-2.0, -2.0]
+
+    emptyDf = ams.amsaves_results({}, {}, {})
+    assert list(emptyDf.columns) == list(baseline_results({}, {},
+                                                          {}).columns)
+    assert emptyDf.shape == (0, 16)
+
+
+def baseline_audit(audits):
+    """ The amsaves_audit function as a loop over the models' periods """
+
+    combinedUsageDct = {}
+    for key, value in audits.iteritems():
+        elecUsage = []
+        gasUsage = []
+        for jsonAudit in value:
+            periodStartDate = \
+                       datetime.datetime.strptime(jsonAudit['PeriodStartDate'],
+                                                  '%Y-%m-%dT%H:%M:%S').date()
+            periodEndDate = \
+                         datetime.datetime.strptime(jsonAudit['PeriodEndDate'],
+                                                    '%Y-%m-%dT%H:%M:%S').date()
+            row = [jsonAudit['TotalUnitsUsed'], jsonAudit['ElecWattsPerFt2'],
+                   periodStartDate, periodEndDate,
+                   jsonAudit['DaysInPeriod']*24, jsonAudit['AirTemp']]
+            if jsonAudit['UnitOfMeasure'] == 'KWH':
+                elecUsage.append(row)
+            elif jsonAudit['UnitOfMeasure'] == 'THERM':
+                gasUsage.append(row)
+
+        elecUsageDf = pd.DataFrame(data=elecUsage,
+                                   columns=ams.ELEC_AUDIT_NAMES)
+        if gasUsage:
+            gasUsageDf = pd.DataFrame(data=gasUsage,
+                                      columns=ams.GAS_AUDIT_NAMES)
+            combinedUsageDct[key] = pd.concat([elecUsageDf, gasUsageDf],
+                                              axis=1)
+        else:
+            combinedUsageDct[key] = elecUsageDf
+
+    return combinedUsageDct
+
+
+def test_audit():
+    """ Confirm amsaves_audit matches the loop for synthetic models, with &
+        without gas & with unequal numbers of periods, & for no models """
+
+    audits = synthetic_audits(20)
+    combinedUsageDct = ams.amsaves_audit(audits)
+    expected = baseline_audit(audits)
+    assert sorted(combinedUsageDct) == sorted(expected)
+    for key, usageDf in expected.items():
+        assert_frame_equal(combinedUsageDct[key], usageDf)
+    assert combinedUsageDct['100000'].shape == (24, 6)
+    assert combinedUsageDct['100002'].shape == (24, 12)
+
+    assert ams.amsaves_audit({}) == {}
+
+
+def baseline_usage_range(audits):
+    """ The amsaves_usage_range function as a loop over the models' periods
+        """
+
+    auditSpans = {}
+    for key, value in audits.iteritems():
+        elecStart = [str(jsonAudit['PeriodStartDate']) for jsonAudit in value
+                     if jsonAudit['UnitOfMeasure'] == 'KWH']
+        elecEnd = [str(jsonAudit['PeriodEndDate']) for jsonAudit in value
+                   if jsonAudit['UnitOfMeasure'] == 'KWH']
+        gasStart = [str(jsonAudit['PeriodStartDate']) for jsonAudit in value
+                    if jsonAudit['UnitOfMeasure'] == 'THERM']
+        gasEnd = [str(jsonAudit['PeriodEndDate']) for jsonAudit in value
+                  if jsonAudit['UnitOfMeasure'] == 'THERM']
+        auditSpans[key] = {'E. Per. Begin': min(elecStart),
+                           'E. Per. End': max(elecEnd),
+                           'G. Per. Begin': min(gasStart) if gasStart else 0,
+                           'G. Per. End': max(gasEnd) if gasEnd else 0}
+
+    return auditSpans
+
+
+def baseline_billing_rate(bldgMeterRecordsDct):
+    """ The amsaves_billing_rate function as a loop over the buildings """
+
+    bldgRatesDct = {}
+    for key, value in bldgMeterRecordsDct.iteritems():
+        utilityRateDct = {}
+        elecMeterRecords = value['Elec. Meter Records']
+        elecUse = sum([record['TotalUnitsUsed'] for record
+                       in elecMeterRecords])
+        elecCost = sum([record['TotalUsageCost'] for record
+                        in elecMeterRecords])
+        utilityRateDct['Electric Rate'] = elecCost / elecUse
+        if len(value) == 2:
+            gasMeterRecords = value['Gas Meter Records']
+            gasUse = sum([record['TotalUnitsUsed'] for record
+                          in gasMeterRecords])
+            gasCost = sum([record['TotalUsageCost'] for record
+                           in gasMeterRecords])
+            utilityRateDct['Gas Rate'] = gasCost / gasUse
+        bldgRatesDct[key] = utilityRateDct
+
+    return bldgRatesDct
+
+
+def test_usage_range():
+    """ Confirm amsaves_usage_range matches the loop for synthetic models,
+        with & without gas, & for no models """
+
+    audits = synthetic_audits(20)
+    auditSpans = ams.amsaves_usage_range(audits)
+    assert auditSpans == baseline_usage_range(audits)
+    assert auditSpans['100000']['G. Per. Begin'] == 0
+    assert ams.amsaves_usage_range({}) == {}
+
+
+def test_billing_rate():
+    """ Confirm amsaves_billing_rate matches the loop for the meter records
+        of synthetic buildings, with & without gas, & for no buildings; a
+        fuel without usage has a rate of NaN, where the loop failed """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(20)) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        bldgIDs = [str(1000 + index) for index in range(20)]
+        refModelsDct = dict((key, value['Reference Model']) for key, value
+                            in client.get_bldg_models(urls['model_url'],
+                                                      bldgIDs).items())
+        audits = synthetic_audits(20)
+        bldgMeterRecordsDct = client.get_meter_records(
+                              ams.amsaves_usage_range(audits),
+                              client.get_bldg_meters(urls['bldg_meters_url'],
+                                                     bldgIDs),
+                              urls['meter_records_url'], refModelsDct)
+    assert list(bldgMeterRecordsDct['1000']) == ['Elec. Meter Records']
+
+    bldgRatesDct = ams.amsaves_billing_rate(bldgMeterRecordsDct)
+    expected = baseline_billing_rate(bldgMeterRecordsDct)
+    assert sorted(bldgRatesDct) == sorted(expected)
+    for key, utilityRateDct in expected.items():
+        assert sorted(bldgRatesDct[key]) == sorted(utilityRateDct)
+        for rateKey, rate in utilityRateDct.items():
+            assert bldgRatesDct[key][rateKey] == pytest.approx(rate)
+    assert ams.amsaves_billing_rate({}) == {}
+
+    noUse = [{'TotalUnitsUsed': 0, 'TotalUsageCost': 0}]
+    rates = ams.amsaves_billing_rate({'1': {'Elec. Meter Records': noUse,
+                                            'Gas Meter Records': []}})
+    assert all(rate != rate for rate in rates['1'].values())
@@ -191,7 +191,7 @@ def test_get_meter_records():
     bldgMeterRecordsDct = deltamtrsvs.get_meter_records(auditSpans,
                                                         bldgMeterDct,
                                                         pvt.meter_records_url,
-                                                        headers)
+                                                        headers, refModelsDct)
     assert type(bldgMeterRecordsDct) == tp.DictType
     for key, value in bldgMeterRecordsDct.iteritems():
         assert type(key) == tp.StringType
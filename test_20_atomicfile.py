@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the atomicfile module, offline """
+
+import os
+
+import pytest
+
+import atomicfile
+
+
+def test_atomic_write(tmpdir):
+    """ Replace a file, then fail a write of it; confirm the file holds the
+        last whole write & no temporary file is left """
+
+    directory = str(tmpdir.join('reports', '46'))
+    path = os.path.join(directory, '46-results.csv')
+    atomicfile.makedirs(directory)
+    atomicfile.makedirs(directory)
+
+    def write(text):
+        def writer(tmpPath):
+            with open(tmpPath, 'w') as outf:
+                outf.write(text)
+        return writer
+
+    atomicfile.atomic_write(path, write('first'))
+    atomicfile.atomic_write(path, write('second'))
+
+    def fail(tmpPath):
+        write('partial')(tmpPath)
+        raise IOError('Disk full')
+
+    with pytest.raises(IOError):
+        atomicfile.atomic_write(path, fail)
+    with open(path) as inf:
+        assert inf.read() == 'second'
+    assert os.listdir(directory) == ['46-results.csv']
@@ -11,6 +11,7 @@ __license__ = "GNU Affero (GPLv3)"
 import datetime
 import types as tp
 import pandas as pd
+import pytest
 import re
 import deltamtrsvs 
 import amsaves as ams
@@ -24,6 +25,14 @@ audit_url = pvt.audit_url
 sites = [pvt.Middlesboro, pvt.FDL, pvt.HJSMS]
 
 
+@pytest.fixture(scope='module', autouse=True)
+def memoized_run():
+    """ Request the buildings & models the tests share once for the module """
+
+    with deltamtrsvs.memoized_run():
+        yield
+
+
 def test_amsaves_results():
     """ Pass the results of get_model_comparisons to the amsaves_results 
         function, confirm DataFrame returned in requested results format for
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the recorder & stub server of the stubapi module, and
+    the deltamtrsvs functions against the stub server, offline """
+
+import json
+import time
+import deltamtrsvs
+import stubapi
+
+headers = {'Authorization': 'stub'}
+bldgs = [{'BuildingID': 1001, 'BuildingName': 'Gym'},
+         {'BuildingID': 1002, 'BuildingName': 'Library'}]
+models = [{'SolutionID': 501, 'SolutionType': 'Reference Model'},
+          {'SolutionID': 502, 'SolutionType': 'Proposed Model'}]
+meters = [{'MeterID': 71, 'MeterTypeID': 1}, {'MeterID': 72, 'MeterTypeID': 2}]
+
+
+def write_fixtures(directory):
+    """ Write fixtures for one property of two buildings, the second having no
+        models """
+
+    stubapi.save_fixture(directory, '/api/Properties/46', json.dumps(bldgs))
+    stubapi.save_fixture(directory, '/api/Models/1001', json.dumps(models))
+    stubapi.save_fixture(directory, '/api/Models/1002', '', 404)
+    stubapi.save_fixture(directory, '/api/Comparisons/501/1/502/1/',
+                         json.dumps({'ElectricRatioA': 1.0}))
+    stubapi.save_fixture(directory, '/api/Audits/501', json.dumps([]))
+    stubapi.save_fixture(directory, '/api/Meters/1001', json.dumps(meters))
+
+
+def test_stub_server(tmpdir):
+    """ Serve fixtures from a directory; confirm the deltamtrsvs functions
+        return the expected data structures from the stub server """
+
+    write_fixtures(str(tmpdir))
+    with stubapi.StubServer(stubapi.load_fixtures(str(tmpdir))) as server:
+        api = server.base_url + '/api/'
+        bldgIDct = deltamtrsvs.get_property_bldgs(api + 'Properties/', '46',
+                                                  headers)
+        assert sorted(bldgIDct) == ['1001', '1002']
+
+        bldgModelsDct = deltamtrsvs.get_bldg_models(api + 'Models/',
+                                                    sorted(bldgIDct), headers,
+                                                    max_workers=2)
+        assert list(bldgModelsDct) == ['1001']
+        assert bldgModelsDct['1001']['Reference Model']['SolutionID'] == 501
+
+        comparisonsDct = deltamtrsvs.get_model_comparisons(
+                                     api + 'Comparisons/', bldgModelsDct,
+                                     headers)
+        assert comparisonsDct == {'1001': {'ElectricRatioA': 1.0}}
+
+        refModelsDct = {'1001': bldgModelsDct['1001']['Reference Model']}
+        audits = deltamtrsvs.get_model_audits(api + 'Audits/', refModelsDct,
+                                              headers)
+        assert audits == {'501': []}
+
+        bldgMeterDct = deltamtrsvs.get_bldg_meters(api + 'Meters/', ['1001'],
+                                                   headers)
+        assert sorted(bldgMeterDct['1001']) == ['Electricity', 'Gas']
+        assert server.requests == 6
+
+
+def test_stub_server_latency(tmpdir):
+    """ Confirm the stub server waits the injected latency before answering """
+
+    write_fixtures(str(tmpdir))
+    fixtures = stubapi.load_fixtures(str(tmpdir))
+    with stubapi.StubServer(fixtures, latency=0.2) as server:
+        start = time.time()
+        deltamtrsvs.get_property_bldgs(server.base_url + '/api/Properties/',
+                                       '46', headers)
+        assert time.time() - start >= 0.2
+
+
+def test_fixture_recorder(tmpdir):
+    """ Record the responses of the stub server; confirm the recording
+        replays the same responses """
+
+    write_fixtures(str(tmpdir.mkdir('source')))
+    recording = str(tmpdir.join('recording'))
+    with stubapi.StubServer(stubapi.load_fixtures(str(tmpdir.join('source')))
+                            ) as server:
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        with stubapi.FixtureRecorder(client, recording) as recorder:
+            bldgModelsDct = client.get_bldg_models(
+                                   server.base_url + '/api/Models/',
+                                   ['1001', '1002'])
+        assert recorder.recorded == 2
+
+    with stubapi.StubServer(stubapi.load_fixtures(recording)) as server:
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        assert client.get_bldg_models(server.base_url + '/api/Models/',
+                                      ['1001', '1002']) == bldgModelsDct
+
+
+def test_iter_json_array():
+    """ Split a .JSON array at every byte; confirm each item is decoded """
+
+    body = json.dumps(bldgs + [[1, 2], 3.5, u'\u00e9]']).encode('utf-8')
+    chunks = [body[index:index + 1] for index in range(len(body))]
+    assert list(deltamtrsvs.iter_json_array(chunks)) == json.loads(body)
+    assert list(deltamtrsvs.iter_json_array([b''])) == []
+
+
+def test_stream_records():
+    """ Stream the audits & meter records of synthetic buildings from the
+        stub server; confirm the amsaves aggregations of the streams match
+        those of the records fetched in full """
+
+    import amsaves
+
+    fixtures = stubapi.synthetic_fixtures(3)
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        bldgIDs = sorted(client.get_property_bldgs(urls['properties_url'],
+                                                   '46'))
+        refModelsDct = dict((key, value['Reference Model']) for key, value
+                            in client.get_bldg_models(urls['model_url'],
+                                                      bldgIDs).items())
+        auditSpans = amsaves.amsaves_usage_range(
+                     client.stream_model_audits(urls['audit_url'],
+                                                refModelsDct))
+        assert auditSpans == amsaves.amsaves_usage_range(
+                             client.get_model_audits(urls['audit_url'],
+                                                     refModelsDct))
+
+        bldgMeterDct = client.get_bldg_meters(urls['bldg_meters_url'],
+                                              bldgIDs)
+        streamed = client.stream_meter_records(auditSpans, bldgMeterDct,
+                                               urls['meter_records_url'],
+                                               refModelsDct, chunk_days=200)
+        fetched = client.get_meter_records(auditSpans, bldgMeterDct,
+                                           urls['meter_records_url'],
+                                           refModelsDct, chunk_days=200)
+        assert amsaves.amsaves_billing_rate(streamed) == \
+               amsaves.amsaves_billing_rate(fetched)
+
+
+def test_stream_errors(tmpdir):
+    """ Serve a failed response for an audit & a missing one for a meter's
+        records; confirm streaming them raises HTTPError, reported to the
+        client's hooks, rather than yield no records """
+
+    import pytest
+    import requests
+
+    stubapi.save_fixture(str(tmpdir), '/api/Audits/501', '', 500)
+    with stubapi.StubServer(stubapi.load_fixtures(str(tmpdir))) as server:
+        api = server.base_url + '/api/'
+        events = []
+        for memoize in (False, True):
+            client = deltamtrsvs.DeltaMeterClient(headers, memoize=memoize,
+                                                  hooks=[events.append])
+            audits = client.stream_model_audits(api + 'Audits/',
+                                                {'1001': {'SolutionID': 501}})
+            with pytest.raises(requests.HTTPError):
+                list(audits['501'])
+            with pytest.raises(requests.HTTPError):
+                list(client.iter_meter_records(api + 'MeterRecords/', '71',
+                                               '2013-01-01T00:00:00',
+                                               '2013-12-31T00:00:00'))
+    assert [event['status'] for event in events] == [500, 404, 500, 404]
+
+
+def test_fan_out():
+    """ Request the models & meters of synthetic buildings one at a time &
+        on a pool of threads; confirm the results are the same & the client
+        keeps one pool across fan-outs """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(10)) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        bldgIDs = [str(1000 + index) for index in range(10)]
+        with deltamtrsvs.DeltaMeterClient(headers) as client:
+            models = client.get_bldg_models(urls['model_url'], bldgIDs)
+            meters = client.get_bldg_meters(urls['bldg_meters_url'], bldgIDs)
+        with deltamtrsvs.DeltaMeterClient(headers) as client:
+            assert client.get_bldg_models(urls['model_url'], bldgIDs,
+                                          max_workers=4) == models
+            assert client.get_bldg_meters(urls['bldg_meters_url'], bldgIDs,
+                                          max_workers=4) == meters
+            assert list(client._pools) == [4]
+        assert client._pools == {}
+
+
+def test_coalesce_requests():
+    """ Request one URL from several threads at once; confirm one request is
+        made, its response shared, & a failure of the request raised to
+        every caller """
+
+    import threading
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(1),
+                            latency=0.2) as server:
+        url = server.base_url + '/api/Models/1000'
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        responses = []
+        threads = [threading.Thread(target=lambda: responses.append(
+                                    client._get(url))) for index in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert server.requests == 1
+        assert len(set(id(response) for response in responses)) == 1
+
+    calls = []
+    errors = []
+
+    def request(url, endpoint=None, tag=None):
+        calls.append(url)
+        time.sleep(0.2)
+        raise ValueError('lost')
+
+    def get():
+        try:
+            client._get('/fails')
+        except ValueError as error:
+            errors.append(error)
+
+    client._request = request
+    threads = [threading.Thread(target=get) for index in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ['/fails']
+    assert len(errors) == 5 and len(set(map(id, errors))) == 1
+
+
+def test_memoized_run():
+    """ Request the same models twice through the module functions within a
+        memoized run & once after it; confirm each building's models are
+        requested once within the run """
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(3)) as server:
+        model_url = server.base_url + '/api/Models/'
+        bldgIDs = ['1000', '1001', '1002']
+        with deltamtrsvs.memoized_run():
+            bldgModelsDct = deltamtrsvs.get_bldg_models(model_url, bldgIDs,
+                                                        headers)
+            with deltamtrsvs.memoized_run():
+                assert deltamtrsvs.get_bldg_models(model_url, bldgIDs,
+                                                   headers) == bldgModelsDct
+            assert server.requests == 3
+        deltamtrsvs.get_bldg_models(model_url, bldgIDs, headers)
+        assert server.requests == 6
+
+
+def test_meter_record_windows():
+    """ Request the meter records of synthetic buildings whole & in parts of
+        40 days, & of two buildings sharing one meter over overlapping spans;
+        confirm the same records are returned each way & spans keyed by
+        model ID without the reference models are refused """
+
+    import pytest
+
+    with stubapi.StubServer(stubapi.synthetic_fixtures(2)) as server:
+        url = server.base_url + '/api/MeterRecords/'
+        meter = {'Electricity': {'MeterID': 500000}}
+        spans = {'A': {'E. Per. Begin': '2013-02-01T00:00:00',
+                       'E. Per. End': '2013-09-01T00:00:00'},
+                 'B': {'E. Per. Begin': '2013-06-01T00:00:00',
+                       'E. Per. End': '2014-03-01T00:00:00'}}
+        bldgMeterDct = {'A': meter, 'B': meter}
+        client = deltamtrsvs.DeltaMeterClient(headers)
+
+        part = client._get(deltamtrsvs.meter_record_endpoint(
+                           url, '500000', '2013-02-01T00:00:00',
+                           '2013-03-13T00:00:00')).json()
+        assert [record['PeriodStartDate'] for record in part] == \
+            ['2013-02-01T00:00:00', '2013-03-01T00:00:00']
+
+        apart = {}
+        for bldgID in spans:
+            apart.update(client.get_meter_records(
+                         {bldgID: spans[bldgID]}, {bldgID: meter}, url))
+        requests = server.requests
+        merged = client.get_meter_records(spans, bldgMeterDct, url)
+        assert server.requests == requests + 1
+        chunked = client.get_meter_records(spans, bldgMeterDct, url,
+                                           chunk_days=40)
+        assert server.requests > requests + 2
+        assert merged == chunked == apart
+        assert len(apart['A']['Elec. Meter Records']) == 8
+        assert len(apart['B']['Elec. Meter Records']) == 10
+
+        with pytest.raises(ValueError):
+            client.get_meter_records({'100000': spans['A']},
+                                     {'1000': meter}, url)
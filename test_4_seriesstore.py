@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the memory-mapped store of the seriesstore module with
+    the amsaves aggregations, offline """
+
+import amsaves
+import deltamtrsvs
+import meterstore
+import seriesstore
+import stubapi
+
+readings = [{'PeriodStartDate': '2013-%02d-01T00:00:00' % month,
+             'PeriodEndDate': '2013-%02d-28T00:00:00' % month,
+             'TotalUnitsUsed': 100.0*month, 'TotalUsageCost': 10.0*month}
+            for month in range(1, 13)]
+audits = [{'PeriodStartDate': reading['PeriodStartDate'],
+           'PeriodEndDate': reading['PeriodEndDate'],
+           'TotalUnitsUsed': reading['TotalUnitsUsed'], 'UnitOfMeasure': unit}
+          for reading in readings for unit in ('KWH', 'THERM')]
+bldgMeterDct = {'1001': {'Electricity': {'MeterID': 71},
+                         'Gas': {'MeterID': 72}}}
+
+
+def test_readings_span(tmpdir):
+    """ Store readings out of order & in two parts; confirm a span of dates
+        returns the readings within it in date order """
+
+    store = seriesstore.MeterSeriesStore(str(tmpdir))
+    store.put_readings('71', readings[6:])
+    assert store.put_readings('71', readings[5::-1] + readings[6:7]) == 12
+
+    span = store.readings('71', '2013-03-01T00:00:00', '2013-05-01T00:00:00')
+    assert [str(date) for date in span['PeriodStartDate']] == \
+           ['2013-03-01T00:00:00', '2013-04-01T00:00:00',
+            '2013-05-01T00:00:00']
+    assert len(seriesstore.MeterSeriesStore(str(tmpdir)).readings('71')) == 12
+    assert len(store.readings('73')) == 0
+
+
+def test_store_aggregations(tmpdir):
+    """ Confirm amsaves_usage_range & amsaves_billing_rate give the same
+        results reading from the store as from the records in .JSON
+        format """
+
+    store = seriesstore.MeterSeriesStore(str(tmpdir))
+    store.put_model_audits({'501': audits})
+    assert amsaves.amsaves_usage_range(store.model_audits(['501'])) == \
+           amsaves.amsaves_usage_range({'501': audits})
+
+    bldgMeterRecordsDct = {'1001': {'Elec. Meter Records': readings,
+                                    'Gas Meter Records': readings[:6]}}
+    store.put_bldg_meter_records(bldgMeterDct, bldgMeterRecordsDct)
+    assert amsaves.amsaves_billing_rate(
+           store.bldg_meter_records(bldgMeterDct)) == \
+           amsaves.amsaves_billing_rate(bldgMeterRecordsDct)
+
+
+def test_sync_series(tmpdir):
+    """ Sync the meters of synthetic buildings into a series store & a
+        SQLite store; confirm the watermarks & the rates of the readings
+        read back for the audit spans match, & a re-sync stores no
+        duplicates """
+
+    headers = {'Authorization': 'stub'}
+    with stubapi.StubServer(stubapi.synthetic_fixtures(3)) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        client = deltamtrsvs.DeltaMeterClient(headers)
+        bldgIDs = ['1000', '1001', '1002']
+        refModelsDct = dict((key, value['Reference Model']) for key, value
+                            in client.get_bldg_models(urls['model_url'],
+                                                      bldgIDs).items())
+        bldgSpans = deltamtrsvs.bldg_audit_spans(amsaves.amsaves_usage_range(
+                    client.get_model_audits(urls['audit_url'],
+                                            refModelsDct)), refModelsDct)
+        bldgMeterDct = client.get_bldg_meters(urls['bldg_meters_url'],
+                                              bldgIDs)
+        store = seriesstore.MeterSeriesStore(str(tmpdir.join('series')))
+        sqlStore = meterstore.MeterRecordStore(str(tmpdir.join('meters.db')))
+        for meterStore in (store, sqlStore, store):
+            client.sync_meter_records(bldgMeterDct, urls['meter_records_url'],
+                                      meterStore, '2013-01-01T00:00:00')
+
+    assert store.watermark('500000') == sqlStore.watermark('500000')
+    assert len(store.readings('500000')) == 24
+    assert amsaves.amsaves_billing_rate(store.bldg_meter_records(
+           bldgMeterDct, bldgSpans)) == \
+           amsaves.amsaves_billing_rate(sqlStore.bldg_meter_records(
+           bldgMeterDct, bldgSpans))
+    sqlStore.close()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the request scheduler of the scheduler module, and the
+    DeltaMeterClient through it against the stub server, offline """
+
+import pytest
+import requests
+import deltamtrsvs
+import scheduler
+import stubapi
+
+
+def response(status, **headers):
+    """ Return a bare response of a status & headers """
+
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers.update(headers)
+    resp._content = b'[]'
+    resp._content_consumed = True
+
+    return resp
+
+
+def test_retry_after():
+    """ Confirm throttled & failed responses are retried, waiting as long as
+        Retry-After asks, & the concurrency halves & recovers """
+
+    now = [0.0]
+    waits = []
+
+    def sleep(wait):
+        waits.append(wait)
+        now[0] += wait
+
+    responses = [response(429, **{'Retry-After': '7'}), response(503),
+                 response(200)]
+    sched = scheduler.RequestScheduler(max_concurrency=8, retries=3,
+                                       sleep=sleep, clock=lambda: now[0])
+    assert sched.call(lambda: responses.pop(0)).status_code == 200
+    assert waits[0] == 7
+    assert 0 <= waits[1] <= 1
+    assert sched.concurrency.limit == 2 + 1/2.0
+
+    for attempt in range(40):
+        sched.call(lambda: response(200))
+    assert sched.concurrency.limit == 8
+
+
+def test_unretried_errors():
+    """ Raise an error that is not retried from as many requests as may be in
+        flight at once; confirm each frees its place, so a further request
+        is still sent """
+
+    def send():
+        raise KeyError('not a connection error')
+
+    sched = scheduler.RequestScheduler(max_concurrency=4, retries=3,
+                                       sleep=lambda wait: None)
+    for attempt in range(4):
+        with pytest.raises(KeyError):
+            sched.call(send)
+    assert sched.concurrency.active == 0
+    assert sched.call(lambda: response(200)).status_code == 200
+
+
+def test_token_bucket():
+    """ Confirm the bucket allows its burst at once & then waits for each
+        token at the rate """
+
+    now = [0.0]
+    waits = []
+
+    def sleep(wait):
+        waits.append(wait)
+        now[0] += wait
+
+    bucket = scheduler.TokenBucket(2, burst=3, clock=lambda: now[0],
+                                   sleep=sleep)
+    for token in range(5):
+        bucket.acquire()
+    assert waits == [0.5, 0.5]
+
+
+def test_retries_exhausted(tmpdir):
+    """ Confirm a request still failing after its retries raises HTTPError
+        rather than returning the failed response """
+
+    stubapi.save_fixture(str(tmpdir), '/api/Comparisons/501/1/502/1/', '',
+                         503)
+    with stubapi.StubServer(stubapi.load_fixtures(str(tmpdir))) as server:
+        client = deltamtrsvs.DeltaMeterClient(
+                 {}, memoize=True, scheduler=scheduler.RequestScheduler(
+                                             retries=2, backoff=0))
+        models = {'1001': {'Reference Model': {'SolutionID': 501},
+                           'Proposed Model': {'SolutionID': 502}}}
+        with pytest.raises(requests.HTTPError):
+            client.get_model_comparisons(server.base_url + '/api/Comparisons/',
+                                         models)
+        assert server.requests == 3
+        assert client._responses == {}
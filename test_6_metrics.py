@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the request metrics of the metrics module, reported by
+    the DeltaMeterClient against the stub server, offline """
+
+import json
+import deltamtrsvs
+import metrics
+import respcache
+import stubapi
+
+
+def test_endpoint_metrics(tmpdir):
+    """ Request models, a missing model & cached models; confirm the counts
+        of each end-point & their export """
+
+    fixtures = {'/api/Models/1001': (200, json.dumps([])),
+                '/api/Models/1002': (404, '')}
+    endpointMetrics = metrics.EndpointMetrics()
+    cache = respcache.ResponseCache(str(tmpdir.join('cache.db')))
+    with stubapi.StubServer(fixtures) as server:
+        client = deltamtrsvs.DeltaMeterClient({}, cache=cache,
+                                              hooks=[endpointMetrics])
+        for run in range(2):
+            client.get_bldg_models(server.base_url + '/api/Models/',
+                                   ['1001', '1002'])
+
+    snapshot = endpointMetrics.snapshot()['models']
+    assert snapshot['requests'] == 4
+    assert snapshot['statuses'] == {'200': 2, '404': 2}
+    assert snapshot['cache'] == {'hit': 1, 'miss': 3}
+    assert snapshot['bytes'] == 4
+    assert snapshot['latency']['buckets'][-1][1] == 4
+
+    endpointMetrics.write_prometheus(str(tmpdir.join('metrics.prom')))
+    text = tmpdir.join('metrics.prom').read()
+    assert 'deltamtrsvs_requests_total{endpoint="models",status="404"} 2' \
+           in text
+    assert 'deltamtrsvs_request_seconds_bucket{endpoint="models",' \
+           'le="+Inf"} 4' in text
+    endpointMetrics.write_json(str(tmpdir.join('metrics.json')))
+    assert json.loads(tmpdir.join('metrics.json').read()
+                      )['endpoints']['models']['requests'] == 4
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the profiling of the amsaves stages by the stageprof
+    module, offline """
+
+import amsaves
+import stageprof
+
+audits = {'501': [{'UnitOfMeasure': unit, 'TotalUnitsUsed': 10.0,
+                   'ElecWattsPerFt2': 1.0, 'DaysInPeriod': 28, 'AirTemp': 50,
+                   'PeriodStartDate': '2013-01-01T00:00:00',
+                   'PeriodEndDate': '2013-01-28T00:00:00'}
+                  for unit in ('KWH', 'THERM')]}
+
+
+def test_stage_profiler():
+    """ Profile the amsaves_audit stage; confirm the sink receives the
+        records & rows of each stage, & the cProfile statistics of the
+        chosen one """
+
+    sink = stageprof.ListSink()
+    stageprof.use_profiler(stageprof.StageProfiler(sink,
+                                                   profile='amsaves_audit'))
+    try:
+        amsaves.amsaves_usage_range(audits)
+        amsaves.amsaves_audit(audits)
+    finally:
+        stageprof.use_profiler(None)
+    amsaves.amsaves_usage_range(audits)
+
+    assert [stats['stage'] for stats in sink.stages] == \
+           ['amsaves_usage_range', 'amsaves_audit']
+    assert [(stats['records'], stats['rows']) for stats in sink.stages] == \
+           [(2, 1), (2, 1)]
+    assert 'profile' not in sink.stages[0]
+    assert 'amsaves_audit' in sink.stages[1]['profile']
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the pipeline module against the stub server of the
+    stubapi module, offline """
+
+import benchmark
+import deltamtrsvs
+import pipeline
+import stubapi
+
+SITE = '46'
+
+
+def test_pipeline_runs_each_stage_once():
+    """ Run every report of a site; confirm each stage runs once, the stub
+        server sees the requests of one hand-wired chain & the reports match
+        the hand-wired chain's """
+
+    fixtures = stubapi.synthetic_fixtures(6, SITE, months=12)
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        with deltamtrsvs.DeltaMeterClient({}) as client:
+            timer = benchmark.StageTimer(server, client)
+            benchmark.run_chain(timer, client, urls, SITE)
+        chainRequests = server.requests
+
+        with deltamtrsvs.DeltaMeterClient({}, pool_maxsize=16) as client:
+            pipe = pipeline.Pipeline(client, urls, max_workers=4,
+                                     fetch_workers=4)
+            reports = pipe.run(pipeline.REPORTS, [SITE])[SITE]
+            assert server.requests - chainRequests == chainRequests
+            assert set(pipe.runs) == set(pipeline.STAGES)
+            assert all(runs == 1 for runs in pipe.runs.values())
+
+            # Later requests of any stage share the results already made
+            assert pipe.get(SITE, 'models') is pipe.get(SITE, 'models')
+            assert server.requests - chainRequests == chainRequests
+            assert all(runs == 1 for runs in pipe.runs.values())
+
+    assert sorted(reports['results']['Blg. ID']) == \
+        [str(1000 + index) for index in range(6)]
+    assert len(reports['audit']) == 6
+    assert len(reports['flags']) == 6
+    assert len(reports['usage_range']) == len(reports['billing_rate']) == 6
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module tests the batch module against the stub server of the
+    stubapi module, offline """
+
+import os
+
+import batch
+import reportwriter
+import stubapi
+
+
+def test_run_batch(tmpdir):
+    """ Run two sites & one missing from the stub server in two processes;
+        confirm each site's reports are written & the failure summarised """
+
+    fixtures = stubapi.synthetic_fixtures(3, '46', months=6)
+    fixtures.update(stubapi.synthetic_fixtures(3, '47', months=6))
+    output = str(tmpdir)
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        summary = batch.run_batch(['46', '47', '48'], {}, urls, output,
+                                  processes=2, fetch_workers=2)
+
+    assert list(summary.columns) == batch.SUMMARY_COLUMNS
+    assert list(summary['Site']) == ['46', '47', '48']
+    assert list(summary['Status']) == ['ok', 'ok', 'failed']
+    assert list(summary['Buildings'][:2]) == [3, 3]
+    assert list(summary['Models'][:2]) == [3, 3]
+    assert os.path.exists(os.path.join(output, 'summary.csv'))
+    for site in ('46', '47'):
+        names = os.listdir(os.path.join(output, site))
+        for report in ('results', 'flags', 'use_ranges'):
+            assert site + '-' + report + '.csv' in names
+        assert len([name for name in names
+                    if name.endswith('-audit.csv')]) == 3
+
+
+def test_flagged_count():
+    """ Confirm only buildings with a flag set are counted, not those with
+        charts of no flag """
+
+    flagsDf = batch.flags_frame({'1000': {},
+                                 '1001': {'Occupant Load': ('X1', '')},
+                                 '1002': {'Summer Gas Use': ('G1', 'Low')},
+                                 '1003': {'Occupant Load': ('O2', ''),
+                                          'Summer Gas Use': ('G1', 'High')},
+                                 '1004': {'Summer Gas Use': ('G1', 'High')}})
+    assert batch.flagged_count(flagsDf) == 2
+    assert batch.flagged_count(batch.flags_frame({})) == 0
+
+
+def test_run_batch_no_sites(tmpdir):
+    """ Confirm a batch of no sites writes an empty summary without starting
+        any process """
+
+    summary = batch.run_batch([], {}, {}, str(tmpdir))
+    assert list(summary.columns) == batch.SUMMARY_COLUMNS
+    assert summary.shape[0] == 0
+    assert os.path.exists(str(tmpdir.join('summary.csv')))
+
+
+def test_run_batch_checkpoint(tmpdir):
+    """ Run two sites in two processes keeping one checkpoint file; confirm
+        a resumed run of the same sites requests nothing again """
+
+    fixtures = stubapi.synthetic_fixtures(3, '46', months=6)
+    fixtures.update(stubapi.synthetic_fixtures(3, '47', months=6))
+    output = str(tmpdir)
+    checkpointPath = str(tmpdir.join('checkpoints.db'))
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        summary = batch.run_batch(['46', '47'], {}, urls, output,
+                                  processes=2, checkpoint_path=checkpointPath)
+        requests = server.requests
+        resumed = batch.run_batch(['46', '47'], {}, urls, output,
+                                  processes=2, checkpoint_path=checkpointPath)
+        assert server.requests == requests
+
+    assert list(summary['Status']) == list(resumed['Status']) == ['ok', 'ok']
+    # Counted as by a run without a checkpoint
+    assert list(summary['Models']) == list(resumed['Models']) == [3, 3]
+    assert list(resumed['Failed']) == [0, 0]
+    assert list(resumed['Audits']) == [3, 3]
+
+
+def test_run_batch_audit_dataset(tmpdir):
+    """ Run two sites writing the audits as a dataset; confirm no file is
+        written per model & the dataset holds every model's audit """
+
+    fixtures = stubapi.synthetic_fixtures(3, '46', months=6)
+    fixtures.update(stubapi.synthetic_fixtures(3, '47', months=6))
+    output = str(tmpdir)
+    with stubapi.StubServer(fixtures) as server:
+        urls = dict((name, server.base_url + path) for name, path
+                    in stubapi.SYNTHETIC_PATHS.items())
+        summary = batch.run_batch(['46', '47'], {}, urls, output,
+                                  processes=2, writers=2, audit_dataset=True)
+
+    assert list(summary['Status']) == ['ok', 'ok']
+    for site in ('46', '47'):
+        names = os.listdir(os.path.join(output, site))
+        assert not [name for name in names if name.endswith('-audit.csv')]
+        assert not [name for name in names if name.endswith('.tmp')]
+    auditDf = reportwriter.read_audit_dataset(
+              os.path.join(output, batch.AUDIT_DATASET))
+    assert sorted(set(auditDf['Site'])) == ['46', '47']
+    assert auditDf.groupby('Site')['Model ID'].nunique().tolist() == [3, 3]
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+
+__author__ = "Eric Allen Youngson"
+__email__ = "eric@successionecological.com"
+__copyright__ = "Copyright 2015, Succession Ecological Services"
+__license__ = "GNU Affero (GPLv3)"
+
+""" This module distributes the buildings of a run across any number of
+    worker processes & machines through a queue kept in an SQLite file on a
+    shared volume, without a broker. A coordinator enqueues one task per
+    building of each site; workers claim tasks under a lease, run the
+    building's requests & transforms (see checkpoint.BLDG_STAGES) & write
+    its results to a file of its own under a shared results directory. A
+    task whose worker dies is claimed again once its lease expires, & a
+    worker finding its lease lost stops the task without writing its
+    results; one failing too often is set aside as failed. The merge step
+    assembles each site's reports from the files of its buildings.
+    (SQLite's locking needs a volume with working POSIX locks; some network
+    file systems lack them)
+    Usage:
+        python workqueue.py enqueue --queue queue.db 46 47 48
+        python workqueue.py work --queue queue.db --results results
+        python workqueue.py merge --queue queue.db --results results \
+            --output reports 46 47 48 """
+
+import argparse
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+
+from atomicfile import atomic_write, makedirs
+import checkpoint
+import deltamtrsvs
+import pipeline
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class LeaseLost(Exception):
+    """ Raised for a worker whose lease of a task expired & was claimed by
+        another worker, with the task's site & building ID """
+
+    def __init__(self, site, bldgID):
+        Exception.__init__(self, 'Lease of building %s of site %s lost' %
+                           (bldgID, site))
+        self.site = site
+        self.bldgID = bldgID
+
+
+class WorkQueue(object):
+    """ Pass the path of the SQLite file holding the queue, & optionally the
+        seconds a claimed task is leased for, the attempts allowed each task
+        & the seconds to wait for a lock held by another process """
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3, timeout=60):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # Transactions are begun explicitly, so claims lock the file first
+        self._db = sqlite3.connect(path, timeout=timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                         'site TEXT, bldg_id TEXT, bldg BLOB, state TEXT, '
+                         'worker TEXT, lease_until REAL, attempts INTEGER, '
+                         'error TEXT, PRIMARY KEY (site, bldg_id))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS tasks_state '
+                         'ON tasks (state, lease_until)')
+
+    def close(self):
+        """ Close the SQLite file """
+
+        with self._lock:
+            self._db.close()
+
+    def _transaction(self, statements):
+        """ Run a function of the connection in an immediate transaction;
+            return its result """
+
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                result = statements(self._db)
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+        return result
+
+    def enqueue(self, site, bldgIDct):
+        """ Pass a site & the results of get_property_bldgs function for it;
+            add a task for each building not already queued, returning the
+            number added """
+
+        rows = [(site, bldgID, sqlite3.Binary(pickle.dumps(bldg, 2)), PENDING,
+                 0) for bldgID, bldg in sorted(bldgIDct.items())]
+
+        def statements(db):
+            before = db.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+            db.executemany('INSERT OR IGNORE INTO tasks (site, bldg_id, '
+                           'bldg, state, attempts) VALUES (?, ?, ?, ?, ?)',
+                           rows)
+            return db.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] - \
+                before
+
+        return self._transaction(statements)
+
+    def claim(self, worker, limit=1):
+        """ Pass a worker's name & optionally the number of tasks to claim;
+            lease pending tasks, & tasks whose lease expired, to the worker.
+            Return a list of the (site, building ID, building object) of each
+            task claimed """
+
+        def statements(db):
+            now = time.time()
+            # Tasks whose workers stopped on their last attempt
+            db.execute('UPDATE tasks SET state = ?, error = ? WHERE state = ? '
+                       'AND lease_until < ? AND attempts >= ?',
+                       (FAILED, 'Lease expired', LEASED, now,
+                        self.max_attempts))
+            rows = db.execute('SELECT site, bldg_id, bldg FROM tasks WHERE '
+                              '(state = ? OR (state = ? AND lease_until < ?)) '
+                              'AND attempts < ? ORDER BY site, bldg_id '
+                              'LIMIT ?', (PENDING, LEASED, now,
+                                          self.max_attempts, limit)
+                              ).fetchall()
+            db.executemany('UPDATE tasks SET state = ?, worker = ?, '
+                           'lease_until = ?, attempts = attempts + 1 WHERE '
+                           'site = ? AND bldg_id = ?',
+                           [(LEASED, worker, now + self.lease_seconds, site,
+                             bldgID) for site, bldgID, bldg in rows])
+            return [(site, bldgID, pickle.loads(bytes(bldg)))
+                    for site, bldgID, bldg in rows]
+
+        return self._transaction(statements)
+
+    def renew(self, worker, site, bldgID):
+        """ Pass a worker's name & a task it holds; extend the task's lease,
+            returning False if the worker no longer holds it """
+
+        def statements(db):
+            return db.execute('UPDATE tasks SET lease_until = ? WHERE '
+                              'site = ? AND bldg_id = ? AND state = ? AND '
+                              'worker = ?', (time.time() + self.lease_seconds,
+                                             site, bldgID, LEASED, worker)
+                              ).rowcount == 1
+
+        return self._transaction(statements)
+
+    def complete(self, worker, site, bldgID):
+        """ Pass a worker's name & a task it holds; mark the task done """
+
+        def statements(db):
+            db.execute('UPDATE tasks SET state = ?, lease_until = NULL, '
+                       'error = NULL WHERE site = ? AND bldg_id = ? AND '
+                       'worker = ?', (DONE, site, bldgID, worker))
+
+        self._transaction(statements)
+
+    def fail(self, worker, site, bldgID, error):
+        """ Pass a worker's name, a task it holds & the error it failed on;
+            release the task to be claimed again, or mark it failed once it
+            has had every attempt allowed """
+
+        def statements(db):
+            db.execute('UPDATE tasks SET state = CASE WHEN attempts < ? THEN '
+                       '? ELSE ? END, lease_until = NULL, error = ? WHERE '
+                       'site = ? AND bldg_id = ? AND worker = ?',
+                       (self.max_attempts, PENDING, FAILED, repr(error), site,
+                        bldgID, worker))
+
+        self._transaction(statements)
+
+    def done(self, site):
+        """ Pass a site; return a list of the building IDs of its tasks
+            done """
+
+        with self._lock:
+            rows = self._db.execute('SELECT bldg_id FROM tasks WHERE site = ? '
+                                    'AND state = ? ORDER BY bldg_id',
+                                    (site, DONE)).fetchall()
+
+        return [row[0] for row in rows]
+
+    def counts(self, site=None):
+        """ Pass optionally a site; return a dictionary of the number of
+            tasks in each state """
+
+        query = 'SELECT state, COUNT(*) FROM tasks'
+        params = ()
+        if site is not None:
+            query += ' WHERE site = ?'
+            params = (site,)
+        with self._lock:
+            rows = self._db.execute(query + ' GROUP BY state',
+                                    params).fetchall()
+
+        return dict(rows)
+
+    def failures(self, site):
+        """ Pass a site; return a dictionary of the errors of its failed
+            tasks, with building IDs as keys """
+
+        with self._lock:
+            rows = self._db.execute('SELECT bldg_id, error, attempts FROM '
+                                    'tasks WHERE site = ? AND state = ?',
+                                    (site, FAILED)).fetchall()
+
+        return dict((bldgID, {'error': error, 'attempts': attempts})
+                    for bldgID, error, attempts in rows)
+
+    def retry_failed(self, site=None):
+        """ Pass optionally a site; return its failed tasks, or every failed
+            task, to the queue with their attempts reset """
+
+        query = 'UPDATE tasks SET state = ?, attempts = 0 WHERE state = ?'
+        params = (PENDING, FAILED)
+        if site is not None:
+            query += ' AND site = ?'
+            params += (site,)
+
+        self._transaction(lambda db: db.execute(query, params))
+
+
+def partition_path(directory, site, bldgID):
+    """ Pass the results directory, a site & a building ID; return the path
+        of the file of the building's results """
+
+    return os.path.join(directory, site, bldgID + '.pkl')
+
+
+def write_partition(directory, site, bldgID, done):
+    """ Pass the results directory, a site, a building ID & the results of
+        the building's stages; write the results of checkpoint.REPORTS """
+
+    path = partition_path(directory, site, bldgID)
+    makedirs(os.path.dirname(path))
+    results = dict((name, done[name]) for name in checkpoint.REPORTS
+                   if name in done)
+    # Replace the file whole, so the merge never reads a partial write
+
+    def write(tmpPath):
+        with open(tmpPath, 'wb') as outf:
+            pickle.dump(results, outf, 2)
+
+    atomic_write(path, write)
+
+
+def clear_partitions(directory, site, keep=()):
+    """ Pass the results directory, a site & optionally the IDs of buildings
+        whose results to keep; remove the files of the site's other
+        buildings, left by an earlier run """
+
+    siteDirectory = os.path.join(directory, site)
+    if not os.path.isdir(siteDirectory):
+        return
+    keep = set(bldgID + '.pkl' for bldgID in keep)
+    for name in os.listdir(siteDirectory):
+        if name.endswith('.pkl') and name not in keep:
+            path = os.path.join(siteDirectory, name)
+            try:
+                os.remove(path)
+            except OSError:
+                # Removed meanwhile by another coordinator
+                if os.path.exists(path):
+                    raise
+
+
+def enqueue_sites(client, urls, queue, sites, directory=None):
+    """ Pass a DeltaMeterClient, a dictionary of end-point URLs (see
+        pipeline.config_urls), a WorkQueue, a list of sites & optionally the
+        results directory; enqueue a task for every building of each site,
+        returning the number added. With the directory, the files of the
+        buildings of each site not done in the queue are removed, so the
+        merge never reads the results of an earlier run """
+
+    added = 0
+    for site in sites:
+        site = str(site)
+        added += queue.enqueue(site, client.get_property_bldgs(
+                                     urls['properties_url'], site))
+        if directory is not None:
+            clear_partitions(directory, site, queue.done(site))
+
+    return added
+
+
+class Worker(object):
+    """ Pass a DeltaMeterClient, a dictionary of end-point URLs (see
+        pipeline.config_urls), a WorkQueue, the shared results directory &
+        optionally the worker's name, unique across machines, & the number
+        of tasks to claim at a time """
+
+    def __init__(self, client, urls, queue, directory, name=None, batch=1):
+        self.client = client
+        self.urls = urls
+        self.queue = queue
+        self.directory = directory
+        self.name = name or '%s-%d' % (socket.gethostname(), os.getpid())
+        self.batch = batch
+
+    def run_task(self, site, bldgID, bldg):
+        """ Run a claimed task, writing its results & marking it done or
+            failed; return True if it is done. A task whose lease is lost,
+            claimed again by another worker, is stopped & its results
+            discarded """
+
+        # The lease is renewed after each stage, so a long task keeps it
+        def renew(name, result):
+            if not self.queue.renew(self.name, site, bldgID):
+                raise LeaseLost(site, bldgID)
+
+        try:
+            done = checkpoint.run_stages(self, bldgID, bldg, {}, renew)
+            write_partition(self.directory, site, bldgID, done)
+        except LeaseLost:
+            return False
+        except Exception as error:
+            self.queue.fail(self.name, site, bldgID, error)
+            return False
+        self.queue.complete(self.name, site, bldgID)
+
+        return True
+
+    def run(self, poll=5, wait=False):
+        """ Pass optionally the seconds between polls of the queue & whether
+            to wait for tasks leased to others, which may be claimed again if
+            their worker dies; claim & run tasks until none are left to
+            claim, returning the number run """
+
+        ran = 0
+        while True:
+            tasks = self.queue.claim(self.name, self.batch)
+            if not tasks:
+                if wait and self.queue.counts().get(LEASED):
+                    time.sleep(poll)
+                    continue
+                return ran
+            for site, bldgID, bldg in tasks:
+                self.run_task(site, bldgID, bldg)
+                ran += 1
+
+
+def merge_site(directory, site, queue=None):
+    """ Pass the results directory, a site & optionally the WorkQueue; return
+        the site's reports in the form of CheckpointedRun.run, merged from
+        the files of its buildings, with the failures of the queue """
+
+    siteDirectory = os.path.join(directory, site)
+    names = (sorted(name for name in os.listdir(siteDirectory)
+                    if name.endswith('.pkl'))
+             if os.path.isdir(siteDirectory) else [])
+
+    def partitions():
+        for name in names:
+            with open(os.path.join(siteDirectory, name), 'rb') as inf:
+                yield pickle.load(inf)
+
+    reports = checkpoint.merge_reports(partitions())
+    reports['failed'] = queue.failures(site) if queue is not None else {}
+
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Distribute the America '
+                                     'Saves! reports of a batch of sites '
+                                     'across workers through a shared queue')
+    parser.add_argument('command', choices=['enqueue', 'work', 'merge'])
+    parser.add_argument('sites', nargs='*', help='property IDs of the sites')
+    parser.add_argument('--queue', required=True,
+                        help='SQLite file of the queue, on a shared volume')
+    parser.add_argument('--results', default='results',
+                        help='shared directory of the buildings\' results')
+    parser.add_argument('--output', default='reports',
+                        help='directory to write the merged reports to')
+    parser.add_argument('--lease', type=float, default=600,
+                        help='seconds a claimed task is leased for')
+    parser.add_argument('--wait', action='store_true',
+                        help='keep polling while tasks are leased to others')
+    args = parser.parse_args(argv)
+
+    import private as pvt
+    import batch
+    urls = pipeline.config_urls(pvt)
+    queue = WorkQueue(args.queue, args.lease)
+    try:
+        if args.command == 'enqueue':
+            with deltamtrsvs.DeltaMeterClient(pvt.headers) as client:
+                print('%d tasks added' % enqueue_sites(client, urls, queue,
+                                                       args.sites,
+                                                       args.results))
+        elif args.command == 'work':
+            with deltamtrsvs.DeltaMeterClient(pvt.headers) as client:
+                print('%d tasks run' % Worker(client, urls, queue,
+                                              args.results).run(
+                                              wait=args.wait))
+        else:
+            for site in args.sites:
+                reports = merge_site(args.results, site, queue)
+                batch.write_site(os.path.join(args.output, site), site,
+                                 reports)
+                print('%s: %d buildings, %d failed' %
+                      (site, reports['results'].shape[0],
+                       len(reports['failed'])))
+    finally:
+        queue.close()
+
+
+if __name__ == '__main__':
+    main()